@@ -0,0 +1,183 @@
+from collections import namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from traceback import format_exc
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from atb_outputs.mol_data import MolData, mol_data_from_mol_data_dict
+
+# One result per input item, in input (ordered) or completion order. mol_data is None if reading the item raised error,
+# in which case traceback holds the formatted traceback from the worker.
+BatchResult = namedtuple('BatchResult', ['index', 'mol_data', 'error', 'traceback'])
+
+Progress_Callback = Callable[[int, Optional[int]], None]
+
+
+def _read_pdb(source: Any, options: Dict[str, Any]) -> MolData:
+    mol_data = MolData(source, **options)
+    if options.get('build_ring', True):
+        # Rings are perceived lazily; do it in the worker, so that they come back with the molecule
+        mol_data.rings
+    return mol_data
+
+
+def _read_fdb_molecule(source: Any, options: Dict[str, Any]) -> MolData:
+    assert type(source).__name__ == 'FDBMolecule', type(source)
+    return _read_pdb(source, options)
+
+
+def _read_mol_data_dict(source: Any, options: Dict[str, Any]) -> MolData:
+    '''source is a mol_data_dict, or the path of a YAML file holding one (as written by formats.yml)'''
+    if not isinstance(source, dict):
+        from yaml import load
+        try:
+            from yaml import CUnsafeLoader as Loader
+        except ImportError:
+            from yaml import UnsafeLoader as Loader
+        with open(source) as fh:
+            source = load(fh, Loader=Loader)
+    return mol_data_from_mol_data_dict(source, **options)
+
+
+READERS = {
+    'pdb': _read_pdb,
+    'fdb_molecule': _read_fdb_molecule,
+    'mol_data_dict': _read_mol_data_dict,
+}
+
+
+def _read_chunk(chunk: List[Tuple[int, Any]], reader: str, options: Dict[str, Any]) -> List[BatchResult]:
+    results = []
+    for (index, source) in chunk:
+        try:
+            results.append(BatchResult(index, READERS[reader](source, options), None, None))
+        except Exception as error:
+            results.append(BatchResult(index, None, error, format_exc()))
+    return results
+
+
+def _chunks(sources: Iterable[Any], chunksize: int) -> Iterator[List[Tuple[int, Any]]]:
+    numbered = enumerate(sources)
+    while True:
+        chunk = list(islice(numbered, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_many(reader: str,
+              sources: Iterable[Any],
+              max_workers: Optional[int] = None,
+              chunksize: int = 16,
+              ordered: bool = True,
+              progress: Optional[Progress_Callback] = None,
+              executor: Optional[Executor] = None,
+              **options: Any) -> Iterator[BatchResult]:
+    '''
+    Read many molecules with reader ('pdb', 'fdb_molecule' or 'mol_data_dict', see READERS) over a pool of processes, yielding a
+    BatchResult per source. Sources are sent to the workers in chunks of chunksize, with at most two chunks per worker in
+    flight, so that sources can be a lazy iterable. Results come in the order of sources if ordered, or else as soon as
+    their chunk is done. An exception raised while reading a source is captured in its result instead of stopping the
+    batch. progress(done, total) is called after each chunk; total is None if sources has no length.
+    options are passed on to the reader (e.g. build_ring, compact). max_workers defaults to the number of CPUs (see
+    ProcessPoolExecutor); with max_workers=1 and no executor, sources are read in this process. An executor can be given
+    to share a pool between batches; it is not shut down.
+    '''
+    assert reader in READERS, reader
+    yield from map_chunks(
+        _read_chunk,
+        sources,
+        args=(reader, options),
+        on_error=_failed_chunk,
+        max_workers=max_workers,
+        chunksize=chunksize,
+        ordered=ordered,
+        progress=progress,
+        executor=executor,
+    )
+
+
+def _failed_chunk(chunk: List[Tuple[int, Any]], error: Exception, traceback: str) -> List[BatchResult]:
+    return [BatchResult(index, None, error, traceback) for (index, _) in chunk]
+
+
+def map_chunks(function: Callable[..., List[Any]],
+               sources: Iterable[Any],
+               args: Tuple = (),
+               on_error: Optional[Callable[[List[Tuple[int, Any]], Exception, str], List[Any]]] = None,
+               max_workers: Optional[int] = None,
+               chunksize: int = 16,
+               ordered: bool = True,
+               progress: Optional[Progress_Callback] = None,
+               executor: Optional[Executor] = None) -> Iterator[Any]:
+    '''
+    Call function(chunk, *args) over a pool of processes for chunks of (index, source) pairs of sources, yielding the
+    results it returns for each chunk (a list, with a result per source), as read_many does: with at most two chunks per
+    worker in flight, in the order of sources if ordered, and with the same progress, max_workers and executor. function
+    and args must be picklable. If a chunk fails in the pool (e.g. a worker died, or a result could not be pickled), its
+    results are on_error(chunk, error, formatted traceback); without on_error, the error is raised.
+    '''
+    assert chunksize > 0, chunksize
+    try:
+        total = len(sources)
+    except TypeError:
+        total = None
+    chunks = _chunks(sources, chunksize)
+
+    if executor is None and max_workers == 1:
+        done = 0
+        for chunk in chunks:
+            results = function(chunk, *args)
+            done += len(results)
+            if progress is not None:
+                progress(done, total)
+            yield from results
+        return
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    max_in_flight = 2 * (getattr(executor, '_max_workers', None) or 1)
+    in_flight = {}
+    try:
+        # Ordered results wait here, by chunk number, until all earlier chunks are done
+        pending_results = {}
+        submitted = 0
+        next_chunk = 0
+        done = 0
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    in_flight[executor.submit(function, chunk, *args)] = (submitted, chunk)
+                    submitted += 1
+            if not in_flight:
+                break
+            (finished, _) = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                (number, chunk) = in_flight.pop(future)
+                try:
+                    results = future.result()
+                except Exception as error:
+                    if on_error is None:
+                        raise
+                    results = on_error(chunk, error, format_exc())
+                done += len(results)
+                if progress is not None:
+                    progress(done, total)
+                if not ordered:
+                    yield from results
+                    continue
+                pending_results[number] = results
+            while next_chunk in pending_results:
+                yield from pending_results.pop(next_chunk)
+                next_chunk += 1
+    finally:
+        # Reached early if the caller stops iterating
+        for future in in_flight:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
@@ -0,0 +1,289 @@
+'''
+Content addressed cache of rendered outputs (see formats.RENDER_TARGETS).
+
+An output is stored under a hash of the MolData fields its writer reads (see CACHE_FIELDS), of anything else its output
+depends on (the date in PDB headers, the coordinates used by pdb, ...) and of the writer and its keyword arguments, so
+that the outputs of unchanged molecules are found again, while any change to what a writer reads gives a new key.
+For the writers that only read some fields of the atoms, and some of their coordinates (see CACHE_ATOM_FIELDS), only
+those are hashed: moving a molecule does not change the key of its itp.
+Outputs are kept in a bounded, least recently used in-memory tier and, optionally, in a directory, evicted least
+recently used first past a total size.
+
+Fields are hashed through their pickle, with numpy arrays pickled as lists, so that the same content always gives the
+same key; coordinates are hashed as the float64 arrays of MolData.coordinate_array, which leaves the atoms as they are.
+Objects shared within a field, sets, or coordinates held within whole atoms as lists of ints rather than floats, can
+still make equal contents hash differently, which only costs a miss.
+'''
+import hashlib
+import json
+import os
+import pickle
+from io import BytesIO
+from collections import OrderedDict, namedtuple
+from datetime import date
+from tempfile import NamedTemporaryFile
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from atb_outputs.coordinates import COORDINATE_KEYS
+from atb_outputs.formats import RENDER_TARGETS
+import atb_outputs.pdb as PDB
+
+# Bumped when a writer changes its output, or keys are made differently, so that outputs cached by earlier versions are
+# no longer found
+CACHE_VERSION = 2
+
+HASH_PROTOCOL = 4
+
+TERMS = ('bonds', 'angles', 'dihedrals', 'impropers')
+MOL_DATA_DICT_FIELDS = ('atoms',) + TERMS + ('rings', 'var')
+
+# target: (MolData fields read by its writer, function of (mol_data, kwargs) giving anything else the output depends on)
+CACHE_FIELDS = {
+    'pdb': (('atoms', 'var'), lambda mol_data, kwargs: [
+        PDB.coordinate_key(mol_data, kwargs.get('optimized', True)), date.today().isoformat(),
+    ]),
+    'g96': (('atoms', 'var'), None),
+    'itp': (('atoms', 'var') + TERMS, None),
+    'yml': (MOL_DATA_DICT_FIELDS, None),
+    'template_yml': (MOL_DATA_DICT_FIELDS, None),
+    'pickle': (MOL_DATA_DICT_FIELDS, None),
+    'columnar': (MOL_DATA_DICT_FIELDS, None),
+    'ccd_cif': (('atoms', 'bonds', 'rings', 'var'), None),
+    'lgf': (('atoms', 'bonds'), None),
+}
+CACHE_FIELDS['pdb_united'] = CACHE_FIELDS['pdb']
+CACHE_FIELDS['g96_united'] = CACHE_FIELDS['g96']
+CACHE_FIELDS['itp_united'] = CACHE_FIELDS['itp']
+
+# Atom fields read by the itp writer, in either representation
+ITP_ATOM_FIELDS = (
+    'id', 'index', 'uindex', 'symbol', 'ljsym', 'uljsym', 'charge', 'ucharge', 'mass', 'umass', 'conn', 'uconn', 'excl',
+    'uexcl',
+)
+
+# target: (atom fields read by its writer, function of (mol_data, kwargs) giving the coordinates it reads); the atoms of
+# the other targets are hashed whole
+CACHE_ATOM_FIELDS = {
+    'pdb': (('id', 'index', 'uindex', 'symbol', 'group', 'pdb', 'conn'), lambda mol_data, kwargs: [
+        PDB.coordinate_key(mol_data, kwargs.get('optimized', True)),
+    ]),
+    'g96': (('id', 'index', 'uindex', 'symbol'), lambda mol_data, kwargs: [
+        'ocoord' if kwargs.get('optimized', True) else 'coord',
+    ]),
+    'itp': (ITP_ATOM_FIELDS, lambda mol_data, kwargs: []),
+    'ccd_cif': (('id', 'index', 'symbol', 'type', 'conn'), lambda mol_data, kwargs: list(COORDINATE_KEYS)),
+    'lgf': (('id', 'symbol', 'charge', 'iacm', 'std_iacm', 'cgroup'), lambda mol_data, kwargs: [
+        'ocoord' if kwargs.get('enforce_has_ocoords', True) else 'coord',
+    ]),
+}
+CACHE_ATOM_FIELDS['pdb_united'] = CACHE_ATOM_FIELDS['pdb']
+CACHE_ATOM_FIELDS['g96_united'] = CACHE_ATOM_FIELDS['g96']
+CACHE_ATOM_FIELDS['itp_united'] = CACHE_ATOM_FIELDS['itp']
+
+CacheStats = namedtuple('CacheStats', ['hits', 'disk_hits', 'misses', 'evictions', 'disk_evictions', 'invalidations'])
+
+DISK_SUFFIX = '.output'
+
+
+class _HashPickler(pickle.Pickler):
+    dispatch_table = {np.ndarray: lambda array: (list, (array.tolist(),))}
+
+
+def field_digest(value: Any) -> str:
+    fh = BytesIO()
+    _HashPickler(fh, protocol=HASH_PROTOCOL).dump(value)
+    return hashlib.sha256(fh.getbuffer()).hexdigest()
+
+
+def atom_fields_digest(atoms: Any, fields: Tuple[str, ...]) -> str:
+    '''Digest of the given fields of atoms (a dict of atoms by id), in the order of the atoms'''
+    # Ellipsis for missing fields, which are not the same as fields set to None
+    return field_digest([[atom_id, [atom.get(field, Ellipsis) for field in fields]] for (atom_id, atom) in atoms.items()])
+
+
+def coordinates_digest(mol_data: Any, key: str) -> Optional[str]:
+    '''Digest of the key ('coord' or 'ocoord') coordinates of the atoms of mol_data, or None if an atom has none'''
+    try:
+        array = mol_data.coordinate_array(key)
+    except KeyError:
+        return None
+    return hashlib.sha256(memoryview(np.ascontiguousarray(array))).hexdigest()
+
+
+def _writer_name(writer: Callable) -> str:
+    return '{0}.{1}'.format(writer.__module__, writer.__qualname__)
+
+
+def output_size(output: Any) -> int:
+    '''Size of an output: length of a str or bytes, summed over the files of a list of (extension, file)'''
+    if isinstance(output, (str, bytes)):
+        return len(output)
+    return sum(len(content) for (_, content) in output)
+
+
+class OutputCache(object):
+    '''
+    Cache of the outputs of the writers of RENDER_TARGETS (see render), holding at most max_entries outputs, and at most
+    max_bytes of them (see output_size), in memory. If directory is given, outputs are also stored there, as one file
+    per key, up to max_disk_bytes in all; outputs found on disk are brought back into memory.
+    '''
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 256 * 2 ** 20, directory: Optional[str] = None,
+                 max_disk_bytes: int = 2 ** 30) -> None:
+        assert max_entries > 0, max_entries
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counts = dict.fromkeys(CacheStats._fields, 0)
+
+    def key(self, mol_data: Any, target: str, **kwargs: Any) -> str:
+        '''Key of the output of target for mol_data (see render)'''
+        assert target in RENDER_TARGETS, target
+        assert target in CACHE_FIELDS, target
+        (writer, default_kwargs, _) = RENDER_TARGETS[target]
+        kwargs = dict(default_kwargs, **kwargs)
+        (fields, extra) = CACHE_FIELDS[target]
+        (atom_fields, coordinate_keys) = CACHE_ATOM_FIELDS.get(target, (None, None))
+        description = {
+            'version': CACHE_VERSION,
+            'writer': _writer_name(writer),
+            'kwargs': sorted(kwargs.items()),
+            'fields': [
+                [field, atom_fields_digest(mol_data.atoms, atom_fields)]
+                if field == 'atoms' and atom_fields is not None else
+                [field, field_digest(getattr(mol_data, field))]
+                for field in fields
+            ],
+            'coordinates': [
+                [key, coordinates_digest(mol_data, key)] for key in coordinate_keys(mol_data, kwargs)
+            ] if coordinate_keys is not None else None,
+            'extra': extra(mol_data, kwargs) if extra is not None else None,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=repr).encode('utf-8')).hexdigest()
+
+    def render(self, mol_data: Any, target: str, **kwargs: Any) -> Any:
+        '''
+        Output of target (see RENDER_TARGETS) for mol_data, rendered with the extra keyword arguments kwargs (united,
+        optimized, comp_id, ...) unless already cached.
+        '''
+        key = self.key(mol_data, target, **kwargs)
+        output = self.get(key)
+        if output is None:
+            self._counts['misses'] += 1
+            (writer, default_kwargs, _) = RENDER_TARGETS[target]
+            output = writer(mol_data, **dict(default_kwargs, **kwargs))
+            self.put(key, output)
+        return output
+
+    def get(self, key: str) -> Optional[Any]:
+        '''Cached output for key, from memory or else from disk, or None (not counted as a miss)'''
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._counts['hits'] += 1
+            return self._entries[key]
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                output = pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # Disk entries are evicted least recently used first, by modification time
+        os.utime(path)
+        self._counts['disk_hits'] += 1
+        self._remember(key, output)
+        return output
+
+    def put(self, key: str, output: Any) -> None:
+        self._remember(key, output)
+        if self.directory is not None:
+            with NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as fh:
+                pickle.dump(output, fh, protocol=HASH_PROTOCOL)
+            os.replace(fh.name, self._path(key))
+            self._evict_disk()
+
+    def invalidate(self, key: str) -> bool:
+        '''Drop the output cached for key (see key) from both tiers, returning whether there was one'''
+        found = False
+        if key in self._entries:
+            self._bytes -= output_size(self._entries.pop(key))
+            found = True
+        if self.directory is not None:
+            try:
+                os.remove(self._path(key))
+                found = True
+            except FileNotFoundError:
+                pass
+        if found:
+            self._counts['invalidations'] += 1
+        return found
+
+    def invalidate_output(self, mol_data: Any, target: str, **kwargs: Any) -> bool:
+        '''Drop the output of target for mol_data, see invalidate'''
+        return self.invalidate(self.key(mol_data, target, **kwargs))
+
+    def clear(self) -> None:
+        '''Drop all cached outputs, from both tiers'''
+        self._entries.clear()
+        self._bytes = 0
+        if self.directory is not None:
+            for (path, _, _) in self._disk_entries():
+                os.remove(path)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(**self._counts)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries or (self.directory is not None and os.path.exists(self._path(key)))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + DISK_SUFFIX)
+
+    def _remember(self, key: str, output: Any) -> None:
+        size = output_size(output)
+        if key in self._entries:
+            self._bytes -= output_size(self._entries.pop(key))
+        if size > self.max_bytes:
+            return
+        self._entries[key] = output
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= output_size(evicted)
+            self._counts['evictions'] += 1
+
+    def _disk_entries(self) -> List[Tuple[str, int, float]]:
+        '''(path, size, modification time) of the outputs stored on disk'''
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(DISK_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict_disk(self) -> None:
+        entries = self._disk_entries()
+        total = sum(size for (_, size, _) in entries)
+        for (path, size, _) in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self._counts['disk_evictions'] += 1
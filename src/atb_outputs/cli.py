@@ -0,0 +1,272 @@
+'''
+atb-outputs: render the outputs of many mol_data_dicts (YAML files as written by formats.yml, pickles as written by
+formats.pickle, or columnar files) over a pool of processes.
+
+Each molecule is written to a directory of its own in the output tree, named after its source file, holding a file per
+format (see OUTPUT_FILE_NAMES). Sources must therefore have distinct molecule names. The directory is filled under a temporary name and then renamed into place, so that it
+appears with all its outputs or not at all. A format that fails for a molecule is left out of its directory, and
+reported. The run ends with a summary of throughput, time per format and failures.
+'''
+import os
+import pickle
+import shutil
+import sys
+from argparse import ArgumentParser
+from collections import namedtuple
+from tempfile import mkdtemp
+from time import perf_counter
+from traceback import format_exc
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from atb_outputs.batch import map_chunks
+from atb_outputs.formats import RenderContext, WRITE_TARGETS
+from atb_outputs.mol_data import MolData, mol_data_from_columnar, mol_data_from_mol_data_dict
+
+YAML_EXTENSIONS = ('.yml', '.yaml')
+PICKLE_EXTENSIONS = ('.pickle', '.pkl')
+COLUMNAR_EXTENSIONS = ('.columnar',)
+SOURCE_EXTENSIONS = YAML_EXTENSIONS + PICKLE_EXTENSIONS + COLUMNAR_EXTENSIONS
+
+# format: file name, given the molecule name
+OUTPUT_FILE_NAMES = {
+    'pdb': '{0}.pdb',
+    'pdb_united': '{0}_united.pdb',
+    'g96': '{0}.g96',
+    'g96_united': '{0}_united.g96',
+    'itp': '{0}.itp',
+    'itp_united': '{0}_united.itp',
+    'yml': '{0}.yml',
+    'template_yml': '{0}_template.yml',
+    'ccd_cif': '{0}.cif',
+    'lgf': '{0}.lgf',
+    'pickle': '{0}.pickle',
+    'columnar': '{0}.columnar',
+}
+
+DEFAULT_FORMATS = ('pdb', 'pdb_united', 'g96', 'itp', 'itp_united', 'yml', 'template_yml', 'ccd_cif', 'lgf')
+
+ConversionResult = namedtuple(
+    'ConversionResult',
+    ['index', 'source', 'output', 'n_atoms', 'timings', 'failures', 'error', 'traceback'],
+)
+
+
+def find_sources(paths: List[str], manifest: Optional[str] = None) -> List[str]:
+    '''
+    Source files: paths that are files, the files with a SOURCE_EXTENSIONS extension found (recursively, in sorted
+    order) under paths that are directories, then the paths listed in manifest, one per line (blank lines and lines
+    starting with # are skipped; relative paths are relative to the manifest).
+    '''
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (directory, directories, files) in os.walk(path):
+                directories.sort()
+                sources.extend(
+                    os.path.join(directory, name) for name in sorted(files) if name.endswith(SOURCE_EXTENSIONS)
+                )
+        else:
+            sources.append(path)
+    if manifest is not None:
+        with open(manifest) as fh:
+            for line in fh:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    sources.append(os.path.join(os.path.dirname(manifest), line))
+    return sources
+
+
+def molecule_name(source: str) -> str:
+    name = os.path.basename(source)
+    for extension in SOURCE_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def duplicate_molecule_names(sources: List[str]) -> Dict[str, List[str]]:
+    '''The sources sharing each molecule name used by more than one of sources, whose outputs would overwrite each other'''
+    sources_by_name = {}
+    for source in sources:
+        sources_by_name.setdefault(molecule_name(source), []).append(source)
+    return {name: named for (name, named) in sources_by_name.items() if len(named) > 1}
+
+
+def load_mol_data(source: str, residue_name: Optional[str] = None) -> MolData:
+    '''
+    MolData from a mol_data_dict file (see SOURCE_EXTENSIONS), ready for the writers: its 'has_ocoord' completion flag
+    is set if all atoms have an 'ocoord', and residue_name is used for molecules whose var has no 'rnme'.
+    '''
+    if source.endswith(COLUMNAR_EXTENSIONS):
+        mol_data = mol_data_from_columnar(source)
+    else:
+        with open(source, 'rb') as fh:
+            if source.endswith(PICKLE_EXTENSIONS):
+                mol_data_dict = pickle.load(fh)
+            else:
+                from yaml import load
+                try:
+                    from yaml import CUnsafeLoader as Loader
+                except ImportError:
+                    from yaml import UnsafeLoader as Loader
+                mol_data_dict = load(fh, Loader=Loader)
+        mol_data = mol_data_from_mol_data_dict(mol_data_dict)
+
+    has_ocoord = bool(mol_data.atoms) and all('ocoord' in atom for atom in mol_data.atoms.values())
+    mol_data.completed = lambda flag: has_ocoord if flag == 'has_ocoord' else False
+    if residue_name is not None and 'rnme' not in mol_data.var:
+        mol_data.var['rnme'] = residue_name
+    return mol_data
+
+
+def _write_molecule(mol_data: MolData, name: str, directory: str, formats: List[str]) -> Tuple[Dict, List]:
+    '''Write formats into directory, returning the time taken by each (s) and the (format, error) of those that failed'''
+    context = RenderContext(mol_data)
+    timings, failures = {}, []
+    for target in formats:
+        (writer, kwargs, shares_context) = WRITE_TARGETS[target]
+        kwargs = dict(kwargs)
+        if shares_context:
+            kwargs['context'] = context
+        if target == 'ccd_cif':
+            kwargs.update(comp_id=mol_data.var['rnme'], comp_id_3char=mol_data.var['rnme'][:3])
+        path = os.path.join(directory, OUTPUT_FILE_NAMES[target].format(name))
+        start = perf_counter()
+        try:
+            with open(path, 'wb') as fh:
+                writer(mol_data, fh, **kwargs)
+        except Exception as error:
+            if os.path.exists(path):
+                os.remove(path)
+            failures.append((target, '{0}: {1}'.format(type(error).__name__, error)))
+            continue
+        timings[target] = perf_counter() - start
+    return timings, failures
+
+
+def _replace_directory(directory: str, destination: str) -> None:
+    '''Move the (complete) directory into place at destination, replacing what was there'''
+    if os.path.exists(destination):
+        previous = mkdtemp(prefix='.{0}.'.format(os.path.basename(destination)), dir=os.path.dirname(destination))
+        os.replace(destination, os.path.join(previous, 'previous'))
+        os.replace(directory, destination)
+        shutil.rmtree(previous)
+    else:
+        os.replace(directory, destination)
+
+
+def convert_chunk(chunk: List[Tuple[int, str]], output_root: str, formats: List[str],
+                  residue_name: Optional[str] = None) -> List[ConversionResult]:
+    '''Write formats for each (index, source) of chunk into output_root (see the module docstring)'''
+    results = []
+    for (index, source) in chunk:
+        name = molecule_name(source)
+        destination = os.path.join(output_root, name)
+        directory = None
+        try:
+            mol_data = load_mol_data(source, residue_name=residue_name)
+            directory = mkdtemp(prefix='.{0}.'.format(name), suffix='.tmp', dir=output_root)
+            # mkdtemp makes directories only readable by their owner
+            os.chmod(directory, 0o755)
+            (timings, failures) = _write_molecule(mol_data, name, directory, formats)
+            _replace_directory(directory, destination)
+            results.append(ConversionResult(index, source, destination, len(mol_data.atoms), timings, failures, None, None))
+        except Exception as error:
+            if directory is not None and os.path.exists(directory):
+                shutil.rmtree(directory)
+            results.append(ConversionResult(index, source, None, 0, {}, [], error, format_exc()))
+    return results
+
+
+def _failed_chunk(chunk: List[Tuple[int, str]], error: Exception, traceback: str) -> List[ConversionResult]:
+    return [ConversionResult(index, source, None, 0, {}, [], error, traceback) for (index, source) in chunk]
+
+
+def convert_many(sources: List[str], output_root: str, formats: List[str], residue_name: Optional[str] = None,
+                 **batch_options: Any) -> Iterator[ConversionResult]:
+    '''
+    Convert sources into output_root over a process pool, yielding a ConversionResult per source. batch_options are
+    those of batch.map_chunks (max_workers, chunksize, ordered, progress, executor).
+    '''
+    for target in formats:
+        assert target in WRITE_TARGETS and target in OUTPUT_FILE_NAMES, target
+    assert not duplicate_molecule_names(sources), duplicate_molecule_names(sources)
+    os.makedirs(output_root, exist_ok=True)
+    return map_chunks(
+        convert_chunk, sources, args=(output_root, formats, residue_name), on_error=_failed_chunk, **batch_options
+    )
+
+
+def summary(results: List[ConversionResult], formats: List[str], elapsed: float, max_failures: int = 20) -> str:
+    lines = []
+    converted = [result for result in results if result.error is None]
+    n_atoms = sum(result.n_atoms for result in converted)
+    lines.append('{0} molecules ({1} atoms) in {2:.2f} s: {3:.2f} molecules/s, {4:.0f} atoms/s'.format(
+        len(results), n_atoms, elapsed, len(results) / elapsed if elapsed else 0.0, n_atoms / elapsed if elapsed else 0.0,
+    ))
+    lines.append('{0:>14s} {1:>8s} {2:>8s} {3:>12s} {4:>12s}'.format('format', 'written', 'failed', 'total (s)', 'mean (ms)'))
+    for target in formats:
+        timings = [result.timings[target] for result in converted if target in result.timings]
+        n_failed = sum(1 for result in converted for (failed, _) in result.failures if failed == target)
+        lines.append('{0:>14s} {1:>8d} {2:>8d} {3:>12.3f} {4:>12.2f}'.format(
+            target, len(timings), n_failed, sum(timings), 1e3 * sum(timings) / len(timings) if timings else 0.0,
+        ))
+    failures = [
+        (result.source, 'all', '{0}: {1}'.format(type(result.error).__name__, result.error))
+        for result in results if result.error is not None
+    ] + [
+        (result.source, target, message) for result in converted for (target, message) in result.failures
+    ]
+    lines.append('{0} failures'.format(len(failures)))
+    for (source, target, message) in failures[:max_failures]:
+        lines.append('  {0} [{1}] {2}'.format(source, target, ' '.join(message.split())))
+    if len(failures) > max_failures:
+        lines.append('  ... and {0} more'.format(len(failures) - max_failures))
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(prog='atb-outputs', description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('sources', nargs='*', help='mol_data_dict files, or directories searched for them')
+    parser.add_argument('-m', '--manifest', help='file listing sources, one per line')
+    parser.add_argument('-o', '--output', required=True, help='root of the output tree')
+    parser.add_argument(
+        '-f', '--formats', default=','.join(DEFAULT_FORMATS),
+        help='comma separated formats, among: {0} (default: %(default)s)'.format(', '.join(sorted(OUTPUT_FILE_NAMES))),
+    )
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: number of CPUs)')
+    parser.add_argument('--chunksize', type=int, default=4, help='molecules sent to a worker at a time')
+    parser.add_argument('--residue-name', help="residue name for molecules whose var has no 'rnme'")
+    parser.add_argument('-q', '--quiet', action='store_true', help='no progress output')
+    args = parser.parse_args(argv)
+
+    formats = [target.strip() for target in args.formats.split(',') if target.strip()]
+    unknown = [target for target in formats if target not in OUTPUT_FILE_NAMES]
+    if unknown:
+        parser.error('unknown formats: {0}'.format(', '.join(unknown)))
+    sources = find_sources(args.sources, manifest=args.manifest)
+    if not sources:
+        parser.error('no sources found')
+    duplicates = duplicate_molecule_names(sources)
+    if duplicates:
+        parser.error('sources with the same molecule name would be written to the same directory: {0}'.format(
+            '; '.join(', '.join(named) for (_, named) in sorted(duplicates.items())),
+        ))
+
+    def progress(done: int, total: Optional[int]) -> None:
+        print('\r{0}/{1} molecules'.format(done, total), end='', file=sys.stderr, flush=True)
+
+    start = perf_counter()
+    results = list(convert_many(
+        sources, args.output, formats, residue_name=args.residue_name, max_workers=args.workers,
+        chunksize=args.chunksize, ordered=False, progress=None if args.quiet else progress,
+    ))
+    elapsed = perf_counter() - start
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(summary(results, formats, elapsed))
+    return 1 if any(result.error is not None or result.failures for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
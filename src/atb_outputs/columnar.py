@@ -0,0 +1,414 @@
+'''
+Versioned binary, columnar cache format for mol_data_dicts (see formats.mol_data_dict), meant to be memory mapped.
+
+A file is laid out as:
+    MAGIC, then the format version and the size of the header (little endian uint32 each);
+    a JSON header, describing each top level entry of the mol_data_dict and where its arrays are;
+    the arrays themselves, contiguous and aligned on ARRAY_ALIGNMENT bytes.
+
+Lists and dicts of records (atoms, bonds, angles, dihedrals, rings, ...) are stored one column per key: bool, int and
+float columns as arrays, str columns as codes into a string table, and columns of int or float lists (coordinates,
+connectivity, term atoms) in CSR form, i.e. the concatenated values and the offsets of each record into them. Columns of
+lists of records (the 'code' of terms) are stored as offsets into a nested table of records, itself stored column by
+column. A record missing a key is marked in a presence mask. Anything else ('var', mixed types, ...) is pickled into a
+byte array, so that loading gives back exactly what was dumped.
+
+load memory maps the file: its arrays are views onto the mapping, and atoms are only turned into dicts when they are
+looked up (or all at once, column by column, when they are iterated over).
+'''
+import json
+import pickle
+from io import BytesIO
+from collections.abc import Mapping, MutableMapping
+from itertools import compress
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+MAGIC = b'ATBMOLC\n'
+FORMAT_VERSION = 2
+# Version 1 files (without 'record_list' columns) are read as well
+READABLE_VERSIONS = (1, 2)
+ARRAY_ALIGNMENT = 64
+
+_PREAMBLE_SIZE = len(MAGIC) + 8
+_INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+# Top level entries that are loaded lazily, one record at a time
+LAZY_ENTRIES = ('atoms',)
+
+
+class _Writer(object):
+    def __init__(self) -> None:
+        self.arrays = []
+
+    def add(self, array: np.ndarray) -> str:
+        name = str(len(self.arrays))
+        self.arrays.append(np.ascontiguousarray(array))
+        return name
+
+    def add_pickle(self, obj: Any) -> str:
+        return self.add(np.frombuffer(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8))
+
+
+def _fits_int64(values: List[int]) -> bool:
+    return _INT64_RANGE[0] <= min(values) and max(values) <= _INT64_RANGE[1]
+
+
+def _encode_column(writer: _Writer, values: List[Any]) -> Dict[str, Any]:
+    '''Store the (present) values of a column, returning its kind, the names of its arrays and any nested records.'''
+    types = set(map(type, values))
+    if types == {type(None)}:
+        return {'kind': 'none', 'arrays': {}}
+    if types == {bool}:
+        return {'kind': 'bool', 'arrays': {'values': writer.add(np.array(values, dtype=np.bool_))}}
+    if types == {int} and _fits_int64(values):
+        return {'kind': 'int', 'arrays': {'values': writer.add(np.array(values, dtype='<i8'))}}
+    if types == {float}:
+        return {'kind': 'float', 'arrays': {'values': writer.add(np.array(values, dtype='<f8'))}}
+    if types == {str}:
+        strings = list(dict.fromkeys(values))
+        code_for_string = {string: code for (code, string) in enumerate(strings)}
+        encoded = [string.encode('utf-8') for string in strings]
+        return {'kind': 'str', 'arrays': {
+            'codes': writer.add(np.array([code_for_string[v] for v in values], dtype='<i4')),
+            'strings': writer.add(np.frombuffer(b''.join(encoded), dtype=np.uint8)),
+            'string_offsets': writer.add(np.cumsum([0] + [len(s) for s in encoded], dtype='<i8')),
+        }}
+    if types == {list}:
+        flat = [x for v in values for x in v]
+        item_types = set(map(type, flat))
+        offsets = np.cumsum([0] + [len(v) for v in values], dtype='<i8')
+        if item_types <= {int} and (not flat or _fits_int64(flat)):
+            return {'kind': 'int_list', 'arrays': {'values': writer.add(np.array(flat, dtype='<i8')), 'offsets': writer.add(offsets)}}
+        if item_types == {float}:
+            return {'kind': 'float_list', 'arrays': {'values': writer.add(np.array(flat, dtype='<f8')), 'offsets': writer.add(offsets)}}
+        if item_types == {dict} and all(type(key) is str for item in flat for key in item):
+            # e.g. the 'code' of terms: lists of parameter dicts, stored as a nested table
+            return {
+                'kind': 'record_list',
+                'arrays': {'offsets': writer.add(offsets)},
+                'records': _encode_records(writer, flat, None),
+            }
+    return {'kind': 'object', 'arrays': {'values': writer.add_pickle(values)}}
+
+
+def _encode_records(writer: _Writer, records: List[Mapping], ids: Optional[List[int]]) -> Dict[str, Any]:
+    keys = {}
+    for record in records:
+        for key in record:
+            keys.setdefault(key, None)
+    columns = []
+    for key in keys:
+        present = [key in record for record in records]
+        column_values = [record[key] for record in records if key in record]
+        column = _encode_column(writer, column_values)
+        if not all(present):
+            column['arrays']['present'] = writer.add(np.array(present, dtype=np.bool_))
+        column['key'] = key
+        columns.append(column)
+    return {
+        'kind': 'records',
+        'length': len(records),
+        'ids': writer.add(np.array(ids, dtype='<i8')) if ids is not None else None,
+        'columns': columns,
+    }
+
+
+def encode_records(records: List[Mapping]) -> Tuple[Dict[str, Any], List[np.ndarray]]:
+    '''The columns of a list of records, as stored in columnar files: (spec, arrays), see decode_records.'''
+    writer = _Writer()
+    return _encode_records(writer, records, None), writer.arrays
+
+
+def decode_records(spec: Dict[str, Any], arrays: List[np.ndarray]) -> List[Dict[str, Any]]:
+    return _RecordTable(spec, {str(name): array for (name, array) in enumerate(arrays)}).records()
+
+
+def _is_record_table(value: Any) -> bool:
+    if isinstance(value, dict):
+        if not all(type(k) is int for k in value) or not _fits_int64(list(value) or [0]):
+            return False
+        records = value.values()
+    elif isinstance(value, list):
+        records = value
+    else:
+        return False
+    return all(type(record) is dict and all(type(key) is str for key in record) for record in records)
+
+
+def _encode_entry(writer: _Writer, value: Any) -> Dict[str, Any]:
+    if _is_record_table(value):
+        if isinstance(value, dict):
+            return dict(_encode_records(writer, list(value.values()), list(value)), container='dict')
+        return dict(_encode_records(writer, value, None), container='list')
+    return {'kind': 'pickle', 'array': writer.add_pickle(value)}
+
+
+def dumps(mol_data_dict: Mapping) -> bytes:
+    '''Encode a mol_data_dict (see formats.mol_data_dict), or any str keyed mapping, in the columnar format.'''
+    fh = BytesIO()
+    write(mol_data_dict, fh)
+    return fh.getvalue()
+
+
+def write(mol_data_dict: Mapping, fh: Any) -> None:
+    '''Stream the columnar encoding of mol_data_dict (see dumps) to a binary file handle, one array at a time.'''
+    writer = _Writer()
+    entries = [[key, _encode_entry(writer, value)] for (key, value) in mol_data_dict.items()]
+
+    layout = {}
+    offset = 0
+    for (name, array) in enumerate(writer.arrays):
+        offset = -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+        layout[str(name)] = [array.dtype.str, list(array.shape), offset]
+        offset += array.nbytes
+    header = json.dumps({'entries': entries, 'arrays': layout}, separators=(',', ':')).encode('utf-8')
+    # Array offsets are relative to the (aligned) end of the header
+    data_start = -(-(_PREAMBLE_SIZE + len(header)) // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+    fh.write(MAGIC + np.array([FORMAT_VERSION, len(header)], dtype='<u4').tobytes())
+    fh.write(header)
+    position = _PREAMBLE_SIZE + len(header)
+    for (name, array) in enumerate(writer.arrays):
+        start = data_start + layout[str(name)][2]
+        fh.write(bytes(start - position))
+        fh.write(np.ascontiguousarray(array).reshape(-1).view(np.uint8).data)
+        position = start + array.nbytes
+    fh.write(bytes(data_start + offset - position))
+
+
+def dump(mol_data_dict: Mapping, path: str) -> None:
+    with open(path, 'wb') as fh:
+        write(mol_data_dict, fh)
+
+
+class _Column(object):
+    '''Decoder of a stored column; values are indexed by position among the records that have the key.'''
+
+    def __init__(self, spec: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        self.key = spec['key']
+        self.kind = spec['kind']
+        self._arrays = {role: arrays[name] for (role, name) in spec['arrays'].items()}
+        self.present = self._arrays.get('present')
+        self._records = _RecordTable(spec['records'], arrays) if self.kind == 'record_list' else None
+        self._rank = None
+        self._strings = None
+        self._objects = None
+
+    def position(self, record_position: int) -> Optional[int]:
+        '''Position of the record's value in the column, or None if the record does not have the key.'''
+        if self.present is None:
+            return record_position
+        if not self.present[record_position]:
+            return None
+        if self._rank is None:
+            self._rank = np.cumsum(self.present) - 1
+        return int(self._rank[record_position])
+
+    def strings(self) -> List[str]:
+        if self._strings is None:
+            (data, offsets) = (self._arrays['strings'].tobytes(), self._arrays['string_offsets'].tolist())
+            self._strings = [data[start:end].decode('utf-8') for (start, end) in zip(offsets, offsets[1:])]
+        return self._strings
+
+    def objects(self) -> List[Any]:
+        if self._objects is None:
+            self._objects = pickle.loads(self._arrays['values'])
+        return self._objects
+
+    def value(self, position: int) -> Any:
+        kind = self.kind
+        if kind == 'none':
+            return None
+        if kind in ('bool', 'int', 'float'):
+            return self._arrays['values'][position].item()
+        if kind == 'str':
+            return self.strings()[self._arrays['codes'][position]]
+        if kind in ('int_list', 'float_list'):
+            (start, end) = self._arrays['offsets'][position:position + 2]
+            return self._arrays['values'][start:end].tolist()
+        if kind == 'record_list':
+            (start, end) = self._arrays['offsets'][position:position + 2].tolist()
+            return [self._records.record(i) for i in range(start, end)]
+        return self.objects()[position]
+
+    def values(self, count: int) -> List[Any]:
+        '''All count (present) values of the column, decoded in bulk.'''
+        kind = self.kind
+        if kind == 'none':
+            return [None] * count
+        if kind in ('bool', 'int', 'float'):
+            return self._arrays['values'].tolist()
+        if kind == 'str':
+            strings = self.strings()
+            return [strings[code] for code in self._arrays['codes'].tolist()]
+        if kind in ('int_list', 'float_list'):
+            (values, offsets) = (self._arrays['values'], self._arrays['offsets'])
+            lengths = np.diff(offsets)
+            if count and (lengths == lengths[0]).all() and lengths[0]:
+                # e.g. coordinates or the atoms of terms: rows of a 2D view
+                return values.reshape(count, int(lengths[0])).tolist()
+            flat = values.tolist()
+            offsets = offsets.tolist()
+            return [flat[start:end] for (start, end) in zip(offsets, offsets[1:])]
+        if kind == 'record_list':
+            flat = self._records.records()
+            offsets = self._arrays['offsets'].tolist()
+            return [flat[start:end] for (start, end) in zip(offsets, offsets[1:])]
+        return list(self.objects())
+
+
+class _RecordTable(object):
+    def __init__(self, spec: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        self.length = spec['length']
+        self.ids = arrays[spec['ids']] if spec['ids'] is not None else None
+        self.columns = [_Column(column, arrays) for column in spec['columns']]
+
+    def record(self, position: int) -> Dict[str, Any]:
+        record = {}
+        for column in self.columns:
+            column_position = column.position(position)
+            if column_position is not None:
+                record[column.key] = column.value(column_position)
+        return record
+
+    def records(self) -> List[Dict[str, Any]]:
+        records = [{} for _ in range(self.length)]
+        for column in self.columns:
+            if column.present is None:
+                targets = records
+                count = self.length
+            else:
+                targets = list(compress(records, column.present.tolist()))
+                count = len(targets)
+            key = column.key
+            for (record, value) in zip(targets, column.values(count)):
+                record[key] = value
+        return records
+
+
+class LazyRecords(MutableMapping):
+    '''
+    Dict of records (by id) read from a columnar file, each turned into a plain dict on first lookup. Iterating over it,
+    or changing it, turns all the records into dicts, after which it behaves like a plain dict.
+    '''
+
+    def __init__(self, table: _RecordTable) -> None:
+        self._table = table
+        self._ids = table.ids.tolist()
+        self._position_for_id = None
+        self._records = {}
+        self._complete = False
+
+    def _materialize(self) -> Dict[int, Dict[str, Any]]:
+        if not self._complete:
+            # Keep the records handed out so far, so that changes made to them stick
+            looked_up = self._records
+            self._records = {
+                record_id: looked_up.get(record_id, record)
+                for (record_id, record) in zip(self._ids, self._table.records())
+            }
+            self._complete = True
+            self._table = None
+        return self._records
+
+    def __getitem__(self, record_id: int) -> Dict[str, Any]:
+        try:
+            return self._records[record_id]
+        except KeyError:
+            if self._complete:
+                raise
+        if self._position_for_id is None:
+            self._position_for_id = {record_id: position for (position, record_id) in enumerate(self._ids)}
+        record = self._records[record_id] = self._table.record(self._position_for_id[record_id])
+        return record
+
+    def __setitem__(self, record_id: int, record: Dict[str, Any]) -> None:
+        self._materialize()[record_id] = record
+
+    def __delitem__(self, record_id: int) -> None:
+        del self._materialize()[record_id]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._materialize())
+
+    def __len__(self) -> int:
+        return len(self._records) if self._complete else len(self._ids)
+
+    def __contains__(self, record_id: Any) -> bool:
+        if self._complete:
+            return record_id in self._records
+        if self._position_for_id is None:
+            self._position_for_id = {record_id: position for (position, record_id) in enumerate(self._ids)}
+        return record_id in self._position_for_id
+
+    def __repr__(self) -> str:
+        return '{0}({1!r})'.format(type(self).__name__, self._materialize())
+
+    def __reduce__(self) -> Any:
+        return (dict, (self._materialize(),))
+
+
+class ColumnarMolDataDict(Mapping):
+    '''
+    A mol_data_dict read from a columnar buffer or file. Entries are decoded on first access; 'atoms' (see
+    LAZY_ENTRIES) is a LazyRecords. arrays holds the stored arrays, e.g. for columns that are used as they are.
+    '''
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview, np.ndarray]) -> None:
+        buffer = np.frombuffer(buffer, dtype=np.uint8) if not isinstance(buffer, np.ndarray) else buffer
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Not a columnar mol_data_dict (bad magic number)')
+        (version, header_size) = buffer[len(MAGIC):_PREAMBLE_SIZE].view('<u4').tolist()
+        if version not in READABLE_VERSIONS:
+            raise ValueError('Unsupported columnar format version {0} (expected {1})'.format(version, FORMAT_VERSION))
+        header = json.loads(bytes(buffer[_PREAMBLE_SIZE:_PREAMBLE_SIZE + header_size]).decode('utf-8'))
+        data_start = -(-(_PREAMBLE_SIZE + header_size) // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+        self.arrays = {}
+        for (name, (dtype, shape, offset)) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            start = data_start + offset
+            count = int(np.prod(shape, dtype=np.int64))
+            self.arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(shape)
+        self._specs = dict((key, spec) for (key, spec) in header['entries'])
+        self._keys = [key for (key, _) in header['entries']]
+        self._values = {}
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._values:
+            self._values[key] = self._decode(key, self._specs[key])
+        return self._values[key]
+
+    def _decode(self, key: str, spec: Dict[str, Any]) -> Any:
+        if spec['kind'] == 'pickle':
+            return pickle.loads(self.arrays[spec['array']])
+        table = _RecordTable(spec, self.arrays)
+        if spec['container'] == 'list':
+            return table.records()
+        if key in LAZY_ENTRIES:
+            return LazyRecords(table)
+        return dict(zip(table.ids.tolist(), table.records()))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def to_dict(self) -> Dict[str, Any]:
+        '''Plain mol_data_dict, with every entry fully decoded.'''
+        return {key: dict(value) if isinstance(value, LazyRecords) else value for (key, value) in self.items()}
+
+
+def loads(buffer: Union[bytes, bytearray, memoryview]) -> ColumnarMolDataDict:
+    return ColumnarMolDataDict(buffer)
+
+
+def load(path: str, mmap: bool = True) -> ColumnarMolDataDict:
+    '''Read a columnar file, memory mapping it (read only) unless mmap is False.'''
+    if mmap:
+        return ColumnarMolDataDict(np.memmap(path, dtype=np.uint8, mode='r'))
+    with open(path, 'rb') as fh:
+        return ColumnarMolDataDict(fh.read())
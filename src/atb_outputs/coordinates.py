@@ -0,0 +1,103 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from atb_outputs.helpers.types_helpers import Atom
+
+COORDINATE_KEYS = ('coord', 'ocoord')
+
+
+def _is_xyz(value: Any) -> bool:
+    try:
+        return len(value) == 3
+    except TypeError:
+        return False
+
+
+def _is_backed_by(atom: Atom, key: str, array: np.ndarray, row: int, view: Optional[np.ndarray]) -> bool:
+    if view is None:
+        return hasattr(atom, 'is_backed_by') and atom.is_backed_by(key, array, row)
+    # A view handed out by the store is never rebased, so identity is enough
+    return atom.get(key) is view
+
+
+class CoordinateStore(object):
+    '''
+    Contiguous (N, 3) float64 arrays holding the 'coord' and 'ocoord' of a molecule's atoms, one row per atom (see
+    MolData.adopt_coordinates).
+
+    Building a store adopts the atoms: their 'coord' and 'ocoord' entries are replaced by (3,) views onto the rows of
+    the arrays, so that per-atom access (atom['coord'][0], ...) keeps working, and writing through it updates the
+    array. A key is only stored if every atom has a 3D value for it; otherwise the atoms keep their own values.
+    Rows follow the order of the atoms dictionary at build time; row_for_id maps atom ids onto them.
+
+    Compact atom records (atb_outputs.records.Atom) are adopted without views: they keep a reference to the array
+    and their row, and read their coordinates from it on access.
+    '''
+
+    def __init__(self, atoms: Dict[int, Atom], arrays: Optional[Dict[str, np.ndarray]] = None) -> None:
+        '''arrays, if given, are adopted as they are instead of being built from atoms (e.g. when unpickling).'''
+        self._ids = list(atoms)
+        self.row_for_id = {atom_id: row for (row, atom_id) in enumerate(self._ids)}
+        self._arrays = {}
+        self._views = {}
+        for key in COORDINATE_KEYS:
+            if arrays is not None:
+                if key in arrays:
+                    self._adopt(atoms, key, arrays[key])
+            elif atoms and all(_is_xyz(atom.get(key)) for atom in atoms.values()):
+                array = np.array([atom[key] for atom in atoms.values()], dtype=np.float64)
+                self._adopt(atoms, key, array)
+
+    def _adopt(self, atoms: Dict[int, Atom], key: str, array: np.ndarray) -> None:
+        views = []
+        for (row, atom) in enumerate(atoms.values()):
+            if hasattr(atom, 'adopt_coordinate'):
+                atom.adopt_coordinate(key, array, row)
+                views.append(None)
+            else:
+                atom[key] = array[row]
+                views.append(atom[key])
+        self._arrays[key] = array
+        self._views[key] = views
+
+    def array(self, key: str) -> Optional[np.ndarray]:
+        '''The (N, 3) array for key, or None if key is not stored.'''
+        return self._arrays.get(key)
+
+    def digest(self) -> bytes:
+        '''Digest of the contents of the arrays, hashed in place (writes through atom views change it)'''
+        digest = hashlib.blake2b(digest_size=16)
+        for key in COORDINATE_KEYS:
+            if key in self._arrays:
+                digest.update(key.encode('ascii'))
+                digest.update(memoryview(np.ascontiguousarray(self._arrays[key])))
+        return digest.digest()
+
+    def rows(self, atom_ids: Iterable[int]) -> np.ndarray:
+        return np.fromiter((self.row_for_id[atom_id] for atom_id in atom_ids), dtype=np.intp)
+
+    def is_current(self, atoms: Dict[int, Atom]) -> bool:
+        '''
+        Whether the store still backs atoms: same atoms, every stored entry still the view handed out, and no key that
+        was not stored has since been given to every atom.
+        '''
+        if list(atoms) != self._ids:
+            return False
+        for key in COORDINATE_KEYS:
+            if key in self._arrays:
+                array = self._arrays[key]
+                if not all(
+                    _is_backed_by(atom, key, array, row, view)
+                    for (row, (atom, view)) in enumerate(zip(atoms.values(), self._views[key]))
+                ):
+                    return False
+            elif atoms and all(_is_xyz(atom.get(key)) for atom in atoms.values()):
+                return False
+        return True
+
+
+def coordinate_list(coordinate: Any) -> List[float]:
+    '''Plain list of floats for a coordinate, whether a list or a view onto a CoordinateStore array.'''
+    return coordinate.tolist() if isinstance(coordinate, np.ndarray) else coordinate
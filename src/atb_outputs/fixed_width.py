@@ -0,0 +1,41 @@
+'''
+Bulk formatting of fixed-width records, one line per atom (PDB ATOM/HETATM, g96 POSITION).
+
+The values of the lines are laid out row by row in an object array built column by column (indexes, names, an (N, 3)
+coordinate array, ...), and each chunk of lines is formatted by a single % operation on the line format repeated for
+each of its lines. Numbers are still formatted by Python's %, so the lines are the same as when formatted one at a time.
+'''
+from typing import Any, Iterator, List
+
+import numpy as np
+
+# Number of lines formatted together
+CHUNK_SIZE = 4096
+
+
+def value_rows(columns: List[Any], n_rows: int) -> np.ndarray:
+    '''
+    (n_rows, M) object array of the values of columns, in order: sequences of n_rows values, (n_rows, k) arrays
+    (giving k values per row) or single values (repeated on every row).
+    '''
+    widths = [column.shape[1] if isinstance(column, np.ndarray) and column.ndim == 2 else 1 for column in columns]
+    values = np.empty((n_rows, sum(widths)), dtype=object)
+    start = 0
+    for (column, width) in zip(columns, widths):
+        if width == 1:
+            values[:, start] = column
+        else:
+            values[:, start:start + width] = column
+        start += width
+    return values
+
+
+def format_blocks(line_format: str, columns: List[Any], n_rows: int, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    '''
+    Blocks of up to chunk_size lines, each line the values of its row (see value_rows) formatted with line_format, which
+    includes the newline.
+    '''
+    values = value_rows(columns, n_rows)
+    for start in range(0, n_rows, chunk_size):
+        end = min(start + chunk_size, n_rows)
+        yield (line_format * (end - start)) % tuple(values[start:end].ravel().tolist())
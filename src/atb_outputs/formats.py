@@ -1,16 +1,19 @@
 from io import StringIO
-from copy import deepcopy
-import yaml
+from time import perf_counter
 import numpy as np
 import pickle as pickle_module
 
-from atb_outputs.helpers.types_helpers import MolData, Dict, Any, Output_File, Output_Files
+from atb_outputs.helpers.types_helpers import MolData, Dict, Any, List, Output_File, Output_Files
 import atb_outputs.pdb as PDB
+import atb_outputs.itp as ITP
 import atb_outputs.yml as YML
 import atb_outputs.lgf as LGF
 import atb_outputs.ccd_cif as CIF
 import atb_outputs.graph as molecule_graph
 import atb_outputs.mol2 as MOL2
+import atb_outputs.columnar as COLUMNAR
+import atb_outputs.fixed_width as FixedWidth
+from atb_outputs.sinks import text_sink, binary_sink
 
 DOUBLE_BOND_LENGTH_CUTOFF = {
     frozenset(['C', 'C']): 0.139, #nm, Source: phenix.elbow.elbow.quantum.hf_631Gdp.py
@@ -19,182 +22,237 @@ DOUBLE_BOND_LENGTH_CUTOFF = {
     frozenset(['C', 'O']): 0.134, #nm, Source: phenix.elbow.elbow.quantum.hf_631Gdp.py
 }
 
+# g96 POSITION line: residue index and name, atom name and index, then x, y, z (nm)
+G96_POSITION_FORMAT = '%5d %5s %5s%7d%15.9f%15.9f%15.9f\n'
 
-def ccd_cif(mol_data, comp_id, comp_id_3char, average_ch2_bonds=True, average_ch3_bonds=True):
-    cif_str = CIF.CCD_DISCLAIMER
-    cif_str += CIF.MOLECULE_DESCRIPTERS_TEMPLATE.format(
-        comp_id=comp_id,
-        comp_id_3char=comp_id_3char,
-        net_charge=mol_data.var["total_charge"],
-    )
-    cif_str += CIF.ATOMS_HEADER
-    aromatic_ring_atoms = [r["atoms"] for r in list(mol_data.rings.values()) if "aromatic" in r and r["aromatic"]]
-    aromatic_atom_ids = [a for r in aromatic_ring_atoms for a in r]
-    ocoord_key = "ocoord" if "ocoord" in list(mol_data.atoms.values())[0] else "coord"
-    if average_ch2_bonds:
-        updated_ch2_coords = get_averaged_ch_bond(mol_data, 2, ocoord_key)
-    else:
-        updated_ch2_coords = {}
-    if average_ch3_bonds:
-        updated_ch3_coords = get_averaged_ch_bond(mol_data, 3, ocoord_key)
-    else:
-        updated_ch3_coords = {}
-
-    for atom in sorted(mol_data.atoms.values(), key=lambda x:x["index"]):
-        if atom["symbol"] in updated_ch2_coords:
-            x, y, z = updated_ch2_coords[atom["symbol"]]
-        elif atom["symbol"] in updated_ch3_coords:
-            x, y, z = updated_ch3_coords[atom["symbol"]]
-        else:
-            x, y, z = atom[ocoord_key][0], atom[ocoord_key][1], atom[ocoord_key][2]
-
-        line_params = dict(
-            comp_id=comp_id,
-            name=atom["symbol"],
-            type=atom["type"],
-            charge=0,
-            pdbx_align=1,
-            aromatic="Y" if atom["id"] in aromatic_atom_ids else "N",
-            terminal_atom="N",
-            stereo_config="N",
-            x_model=atom["coord"][0]*10,
-            y_model=atom["coord"][1]*10,
-            z_model=atom["coord"][2]*10,
-            x_ideal=x*10,
-            y_ideal=y*10,
-            z_ideal=z*10,
-            index=atom["index"],
-        )
 
-        cif_str += CIF.ATOM_LINE_TEMPLATE.format(
-            **line_params
-        )
-    cif_str += CIF.BONDS_HEADER
-    for i, bond in enumerate(sorted(mol_data.bonds, key=lambda x:mol_data.atoms[x['atoms'][0]]["index"])):
-        bond_length = bond["value"]
-        atom1_type = mol_data.atoms[bond["atoms"][0]]["type"]
-        atom2_type = mol_data.atoms[bond["atoms"][1]]["type"]
-        bond_order_id = frozenset([atom1_type, atom2_type])
-        if bond_order_id in DOUBLE_BOND_LENGTH_CUTOFF:
-            bond_order = "DOUB" if bond_length < DOUBLE_BOND_LENGTH_CUTOFF[bond_order_id] else "SING"
-        else:
-            bond_order = "SING"
-        cif_str += CIF.BONDS_TEMPLATE.format(
-            comp_id=comp_id,
-            name1=mol_data.atoms[bond["atoms"][0]]["symbol"],
-            name2=mol_data.atoms[bond["atoms"][1]]["symbol"],
-            bond_order=bond_order,
-            aromatic="Y" if all([atom_id in aromatic_atom_ids for atom_id in bond["atoms"]]) else "N",
-            stereo_config="N",
-            index=i+1,
-        )
-    return cif_str
+class RenderContext(object):
+    '''
+    What the writers of render_all have in common, derived once per molecule on first use: the all-atom and united-atom
+    views (atom orders and index maps, see MolData.united_atom_view), coordinate arrays in view order, the ids of the
+    atoms of aromatic rings and the mol_data_dict. A context assumes the molecule does not change while it is in use.
+    '''
+
+    def __init__(self, mol_data: MolData) -> None:
+        self.mol_data = mol_data
+        self._coordinates = {}
+        self._aromatic_atom_ids = None
+        self._mol_data_dict = None
+
+    def view(self, united: bool) -> Any:
+        return self.mol_data.united_atom_view(united)
+
+    def coordinates(self, key: str, united: bool) -> np.ndarray:
+        '''(N, 3) array of the key ('coord' or 'ocoord') coordinates of the atoms of view(united), in its order'''
+        if (key, united) not in self._coordinates:
+            self._coordinates[key, united] = self.mol_data.coordinate_array(key, self.view(united).ids)
+        return self._coordinates[key, united]
+
+    def aromatic_atom_ids(self) -> set:
+        if self._aromatic_atom_ids is None:
+            self._aromatic_atom_ids = {
+                atom_id for r in self.mol_data.rings.values() if "aromatic" in r and r["aromatic"] for atom_id in r["atoms"]
+            }
+        return self._aromatic_atom_ids
+
+    def mol_data_dict(self) -> Dict[str, Any]:
+        if self._mol_data_dict is None:
+            self._mol_data_dict = mol_data_dict(self.mol_data)
+        return self._mol_data_dict
+
+
+def ccd_cif(mol_data, comp_id, comp_id_3char, average_ch2_bonds=True, average_ch3_bonds=True, context=None):
+    io = StringIO()
+    write_ccd_cif(mol_data, io, comp_id, comp_id_3char, average_ch2_bonds=average_ch2_bonds,
+                  average_ch3_bonds=average_ch3_bonds, context=context)
+    return io.getvalue()
 
 
-def pdb(mol_data: MolData, optimized: bool = True, united: bool = False, use_rnme: bool = True, write_connects=True) -> Output_File:
+def write_ccd_cif(mol_data, io, comp_id, comp_id_3char, average_ch2_bonds=True, average_ch3_bonds=True, context=None):
+    '''Stream the ccd_cif output to a text or binary sink, see atb_outputs.sinks'''
+    with text_sink(io) as io:
+        if context is None:
+            context = RenderContext(mol_data)
+        io.write(CIF.CCD_DISCLAIMER)
+        io.write(CIF.MOLECULE_DESCRIPTERS_TEMPLATE.format(
+            comp_id=comp_id,
+            comp_id_3char=comp_id_3char,
+            net_charge=mol_data.var["total_charge"],
+        ))
+        io.write(CIF.ATOMS_HEADER)
+        aromatic_atom_ids = context.aromatic_atom_ids()
+        ocoord_key = "ocoord" if "ocoord" in list(mol_data.atoms.values())[0] else "coord"
+        averaged_coords = averaged_ch_coordinates(
+            mol_data, ocoord_key, [n for (n, average) in ((2, average_ch2_bonds), (3, average_ch3_bonds)) if average],
+        )
+        updated_ch2_coords = averaged_coords.get(2, {})
+        updated_ch3_coords = averaged_coords.get(3, {})
+
+        sorted_atoms = context.view(False).atoms
+        model_coords = context.coordinates("coord", False).tolist()
+        ideal_coords = context.coordinates(ocoord_key, False).tolist()
+        for (atom, model_coord, ideal_coord) in zip(sorted_atoms, model_coords, ideal_coords):
+            if atom["symbol"] in updated_ch2_coords:
+                x, y, z = updated_ch2_coords[atom["symbol"]]
+            elif atom["symbol"] in updated_ch3_coords:
+                x, y, z = updated_ch3_coords[atom["symbol"]]
+            else:
+                x, y, z = ideal_coord
+
+            io.write(CIF.ATOM_LINE_TEMPLATE.format(
+                comp_id=comp_id,
+                name=atom["symbol"],
+                type=atom["type"],
+                charge=0,
+                pdbx_align=1,
+                aromatic="Y" if atom["id"] in aromatic_atom_ids else "N",
+                terminal_atom="N",
+                stereo_config="N",
+                x_model=model_coord[0]*10,
+                y_model=model_coord[1]*10,
+                z_model=model_coord[2]*10,
+                x_ideal=x*10,
+                y_ideal=y*10,
+                z_ideal=z*10,
+                index=atom["index"],
+            ))
+        io.write(CIF.BONDS_HEADER)
+        atoms = mol_data.atoms
+        for i, bond in enumerate(sorted(mol_data.bonds, key=lambda x:atoms[x['atoms'][0]]["index"])):
+            bond_length = bond["value"]
+            atom1 = atoms[bond["atoms"][0]]
+            atom2 = atoms[bond["atoms"][1]]
+            bond_order_id = frozenset([atom1["type"], atom2["type"]])
+            if bond_order_id in DOUBLE_BOND_LENGTH_CUTOFF:
+                bond_order = "DOUB" if bond_length < DOUBLE_BOND_LENGTH_CUTOFF[bond_order_id] else "SING"
+            else:
+                bond_order = "SING"
+            io.write(CIF.BONDS_TEMPLATE.format(
+                comp_id=comp_id,
+                name1=atom1["symbol"],
+                name2=atom2["symbol"],
+                bond_order=bond_order,
+                aromatic="Y" if aromatic_atom_ids.issuperset(bond["atoms"]) else "N",
+                stereo_config="N",
+                index=i+1,
+            ))
+
+
+def pdb(mol_data: MolData, optimized: bool = True, united: bool = False, use_rnme: bool = True, write_connects=True,
+        context: RenderContext = None) -> Output_File:
     '''return a new pdb string reflecting changes of atom order and numbering'''
     io = StringIO()
+    write_pdb(mol_data, io, optimized=optimized, united=united, use_rnme=use_rnme, write_connects=write_connects,
+              context=context)
+    return io.getvalue()
 
-    atoms = list(
-        sorted(
-            filter(
-                lambda atom: (not united) or (united and 'uindex' in atom),
-                mol_data.atoms.values(),
-            ),
-            key=lambda atom: atom['uindex' if united else 'index'],
-        ),
-    )
 
-    PDB.header(mol_data, io, rev_date=mol_data.var["REV_DATE"], united=united)
-    PDB.atoms(mol_data, io, atoms, united=united, use_rnme=use_rnme, optimized=optimized)
-    if write_connects:
-        PDB.connectivity(mol_data, io, atoms, united=united)
-    PDB.footer(mol_data, io)
+def write_pdb(mol_data: MolData, io: Any, optimized: bool = True, united: bool = False, use_rnme: bool = True,
+              write_connects=True, context: RenderContext = None) -> None:
+    '''Stream the pdb output to a text or binary sink, see atb_outputs.sinks'''
+    if context is None:
+        context = RenderContext(mol_data)
+    view = context.view(united)
+    coords = context.coordinates(PDB.coordinate_key(mol_data, optimized), united)
 
-    return io.getvalue()
+    with text_sink(io) as io:
+        PDB.header(mol_data, io, rev_date=mol_data.var["REV_DATE"], united=united)
+        PDB.atoms(mol_data, io, view.atoms, united=united, use_rnme=use_rnme, optimized=optimized, view=view, coords=coords)
+        if write_connects:
+            PDB.connectivity(mol_data, io, view.atoms, united=united, view=view)
+        PDB.footer(mol_data, io)
 
 
 def get_averaged_ch_bond(mol_data, n_hydrogens, ocoord_key):
-    selected_carbons = get_carbons_with_n_hydrogens(mol_data, n_hydrogens)
-    ch_scaling_factors = {}
-    for c_atom in selected_carbons:
-        ch_bond_lengths = []
-        h_ids = []
-        for conn_atom_id in c_atom["conn"]:
-            conn_atom = mol_data[conn_atom_id]
-            if conn_atom["type"] == "H":
-                ch_length = np.linalg.norm(np.array(c_atom[ocoord_key]) - np.array(conn_atom[ocoord_key]))
-                ch_bond_lengths.append(ch_length)
-                h_ids.append(conn_atom_id)
-        av_ch_len = np.mean(ch_bond_lengths)
-        ch_scaling_factors.update({h_id: av_ch_len/ch_bond_length for h_id, ch_bond_length in zip(h_ids, ch_bond_lengths)})
-    updated_h_coords = {}
-    for h_id, scaling_factor in ch_scaling_factors.items():
-        updated_h_coords[mol_data.atoms[h_id]["symbol"]] = get_av_bond_length_coords(mol_data, h_id, scaling_factor, ocoord_key)
+    return averaged_ch_coordinates(mol_data, ocoord_key, [n_hydrogens])[n_hydrogens]
+
+
+def averaged_ch_coordinates(mol_data, ocoord_key, hydrogen_counts=(2, 3)):
+    '''
+    For each n of hydrogen_counts, the ocoord_key coordinates of the hydrogens of the carbons bonded to n hydrogens,
+    moved along their C-H bond to the mean C-H bond length of their carbon, by hydrogen symbol: {n: {symbol: [x, y, z]}}.
+    The carbons are found in one pass over the atoms, and all C-H bonds are scaled at once on the coordinate array.
+    '''
+    atoms = mol_data.atoms
+    updated_h_coords = {n: {} for n in hydrogen_counts}
+    # C-H bonds of the selected carbons, in atom and connectivity order, with the ordinal of their carbon
+    carbon_ids, h_ids, carbon_ordinals, carbon_counts = [], [], [], []
+    for a in atoms.values():
+        if a["type"] != "C":
+            continue
+        a_h_ids = [atom_id for atom_id in a["conn"] if atoms[atom_id]["type"] == "H"]
+        if len(a_h_ids) in updated_h_coords:
+            carbon_ordinals.extend([len(carbon_counts)] * len(a_h_ids))
+            carbon_counts.append(len(a_h_ids))
+            carbon_ids.extend([a["id"]] * len(a_h_ids))
+            h_ids.extend(a_h_ids)
+    if not h_ids:
+        return updated_h_coords
+    for h_id in h_ids:
+        assert len(atoms[h_id]["conn"]) == 1, "Hydrogen does not have exactly 1 bond, method assumptions no longer hold."
+
+    coords = mol_data.coordinate_array(ocoord_key)
+    row_for_id = {atom_id: row for (row, atom_id) in enumerate(atoms)}
+    c_coords = coords[[row_for_id[atom_id] for atom_id in carbon_ids]]
+    h_coords = coords[[row_for_id[h_id] for h_id in h_ids]]
+    bonded_coords = coords[[row_for_id[atoms[h_id]["conn"][0]] for h_id in h_ids]]
+    differences = c_coords - h_coords
+    # Row by row dot products, as np.linalg.norm computes them for a single vector
+    ch_bond_lengths = np.sqrt(np.matmul(differences[:, np.newaxis, :], differences[:, :, np.newaxis]).ravel())
+    # Means summed in bond order, as np.mean does for a carbon's few bonds
+    av_ch_lens = np.bincount(carbon_ordinals, weights=ch_bond_lengths) / np.array(carbon_counts)
+    scaling_factors = av_ch_lens[carbon_ordinals] / ch_bond_lengths
+    scaled_coords = ((h_coords - bonded_coords) * scaling_factors[:, np.newaxis] + bonded_coords).tolist()
+    for (h_id, carbon_ordinal, coord) in zip(h_ids, carbon_ordinals, scaled_coords):
+        updated_h_coords[carbon_counts[carbon_ordinal]][atoms[h_id]["symbol"]] = coord
     return updated_h_coords
 
 
 def get_av_bond_length_coords(mol_data, h_id, scaling_factor, ocoord_key):
     h_atom = mol_data.atoms[h_id]
     assert len(h_atom["conn"]) == 1, "Hydrogen does not have exactly 1 bond, method assumptions no longer hold."
-    c_atom = mol_data.atoms[h_atom["conn"][0]]
-    return (np.array(h_atom[ocoord_key]) - np.array(c_atom[ocoord_key])) * scaling_factor + np.array(c_atom[ocoord_key])
-
-
-
-def get_carbons_with_n_hydrogens(mol_data, n_hydrogens):
-    selected_carbons = []
-    for a in mol_data.atoms.values():
-        if a["type"] == "C" and \
-                len([atom_id for atom_id in a["conn"] if mol_data.atoms[atom_id]["type"] == "H"]) == n_hydrogens:
-            selected_carbons.append(a)
-    return selected_carbons
+    (h_coord, c_coord) = mol_data.coordinate_array(ocoord_key, [h_id, h_atom["conn"][0]])
+    return (h_coord - c_coord) * scaling_factor + c_coord
 
 
 def mol2(pdb_str):
     return MOL2.use_babel(pdb_str)
 
 
-def g96(mol_data: MolData, optimized: bool = True, united: bool = False) -> Output_File:
+def g96(mol_data: MolData, optimized: bool = True, united: bool = False, context: RenderContext = None) -> Output_File:
     io = StringIO()
-    print_to_io = lambda *args: print(*args, file=io)
+    write_g96(mol_data, io, optimized=optimized, united=united, context=context)
+    return io.getvalue()
 
-    atoms = list(
-        sorted(
-            filter(
-                lambda atom: (not united) or (united and 'uindex' in atom),
-                mol_data.atoms.values(),
-            ),
-            key=lambda atom: atom['uindex' if united else 'index'],
-        ),
-    )
 
-    print_to_io('TITLE')
-    print_to_io('')
-    print_to_io('END')
+def write_g96(mol_data: MolData, io: Any, optimized: bool = True, united: bool = False,
+              context: RenderContext = None) -> None:
+    '''Stream the g96 output to a text or binary sink, see atb_outputs.sinks'''
+    with text_sink(io) as io:
+        print_to_io = lambda *args: print(*args, file=io)
 
-    print_to_io('POSITION')
-    for atom in atoms:
-        # Source: GROMOS96 Manual (ISBN 3 7281 2422 2), page III-41
-        print_to_io(
-            '{residue_index:>5d}{X:1s}{residue_name:>5s}{X:1s}{atom_name:>5s}{atom_index:>7d}{x:15.9f}{y:15.9f}{z:15.9f}'.format(
-                X=' ',
-                residue_index=1,
-                residue_name=mol_data.var['rnme'],
-                atom_name=atom['symbol'],
-                atom_index=atom['uindex' if united else 'index'],
-                **dict(zip(('x', 'y', 'z'), atom['ocoord' if optimized else 'coord'])),
-            ),
-        )
+        if context is None:
+            context = RenderContext(mol_data)
+        view = context.view(united)
 
-    print_to_io('END')
+        print_to_io('TITLE')
+        print_to_io('')
+        print_to_io('END')
 
-    return io.getvalue()
+        coords = context.coordinates('ocoord' if optimized else 'coord', united)
+
+        print_to_io('POSITION')
+        # Source: GROMOS96 Manual (ISBN 3 7281 2422 2), page III-41
+        columns = [1, mol_data.var['rnme'], [atom['symbol'] for atom in view.atoms], view.indexes, coords]
+        for block in FixedWidth.format_blocks(G96_POSITION_FORMAT, columns, len(view.atoms)):
+            io.write(block)
+
+        print_to_io('END')
 
 
 def mol_data_dict(mol_data: MolData) -> Dict[str, Any]:
     def clean_up_flavours(atom: Dict[str, Any]) -> Dict[str, Any]:
-        return {k: v for (k, v) in atom.items() if k != 'flavour'}
+        return {k: v for (k, v) in YML.plain_atom(atom).items() if k != 'flavour'}
 
     return {
         'atoms': {atom_id: clean_up_flavours(atom) for (atom_id, atom) in mol_data.atoms.items()},
@@ -208,17 +266,46 @@ def mol_data_dict(mol_data: MolData) -> Dict[str, Any]:
     }
 
 
-def yml(mol_data: MolData) -> Output_File:
-    mol_data = mol_data_dict(mol_data)
-    return YML.add_yml_comments(yaml.dump(mol_data))
+def yml(mol_data: MolData, context: RenderContext = None) -> Output_File:
+    io = StringIO()
+    write_yml(mol_data, io, context=context)
+    return io.getvalue()
+
+
+def write_yml(mol_data: MolData, io: Any, context: RenderContext = None) -> None:
+    '''Stream the yml output to a text or binary sink (see atb_outputs.sinks), see YML.dump_yml'''
+    with text_sink(io) as io:
+        YML.dump_yml(context.mol_data_dict() if context is not None else mol_data_dict(mol_data), io)
+
+
+def pickle(mol_data: MolData, context: RenderContext = None) -> Output_File:
+    return pickle_module.dumps(context.mol_data_dict() if context is not None else mol_data_dict(mol_data))
+
+
+def write_pickle(mol_data: MolData, io: Any, context: RenderContext = None) -> None:
+    '''Stream the pickle output to a binary sink (or the buffer of a text one), see atb_outputs.sinks'''
+    pickle_module.dump(context.mol_data_dict() if context is not None else mol_data_dict(mol_data), binary_sink(io))
+
 
+def columnar(mol_data: MolData, context: RenderContext = None) -> Output_File:
+    '''mol_data_dict in the binary columnar format, see atb_outputs.columnar and mol_data_from_columnar'''
+    return COLUMNAR.dumps(context.mol_data_dict() if context is not None else mol_data_dict(mol_data))
 
-def pickle(mol_data: MolData) -> Output_File:
-    return pickle_module.dumps(mol_data_dict(mol_data))
+
+def write_columnar(mol_data: MolData, io: Any, context: RenderContext = None) -> None:
+    '''Stream the columnar output to a binary sink (or the buffer of a text one), see atb_outputs.sinks'''
+    COLUMNAR.write(context.mol_data_dict() if context is not None else mol_data_dict(mol_data), binary_sink(io))
 
 
 def template_yml(mol_data: MolData) -> Output_File:
-    mol_data = deepcopy(mol_data)
+    io = StringIO()
+    write_template_yml(mol_data, io)
+    return io.getvalue()
+
+
+def write_template_yml(mol_data: MolData, io: Any) -> None:
+    '''Stream the template_yml output to a text or binary sink, see atb_outputs.sinks'''
+    # The clean_* functions build the template from copies of the atoms and terms, mol_data is left as it is
     mol_data = {
         'atoms': YML.clean_atoms(mol_data.atoms, template=True),
          'bonds': YML.clean_bonds(mol_data.bonds, template=True),
@@ -228,7 +315,8 @@ def template_yml(mol_data: MolData) -> Output_File:
          'rings': YML.clean_rings(mol_data.rings, template=True),
          'var': mol_data.var,
     }
-    return YML.add_yml_comments(yaml.dump(mol_data))
+    with text_sink(io) as io:
+        YML.dump_yml(mol_data, io)
 
 
 STORE_GRAPH_GT = False
@@ -271,3 +359,96 @@ def lgf(mol_data, **kwargs: Dict[str, Any]) -> Output_Files:
         ]
     except AssertionError:
         return []
+
+
+def write_lgf(mol_data: MolData, io: Any, **kwargs: Dict[str, Any]) -> None:
+    '''
+    Stream the lgf output to a text or binary sink (see atb_outputs.sinks). Unlike lgf, raises AssertionError (before
+    writing anything) if the molecule lacks charges or optimised coordinates.
+    '''
+    with text_sink(io) as io:
+        LGF.write_graph(mol_data, io, **kwargs)
+
+
+# target: (writer, default keyword arguments, whether the writer takes the RenderContext shared by render_all)
+RENDER_TARGETS = {
+    'pdb': (pdb, {}, True),
+    'pdb_united': (pdb, {'united': True}, True),
+    'g96': (g96, {}, True),
+    'g96_united': (g96, {'united': True}, True),
+    'itp': (ITP.itp, {}, False),
+    'itp_united': (ITP.itp, {'united': True}, False),
+    'yml': (yml, {}, True),
+    'template_yml': (template_yml, {}, False),
+    'pickle': (pickle, {}, True),
+    'columnar': (columnar, {}, True),
+    'ccd_cif': (ccd_cif, {}, True),
+    'lgf': (lgf, {}, False),
+}
+
+
+def render_all(mol_data: MolData,
+               targets: List[str],
+               options: Dict[str, Dict[str, Any]] = None,
+               timings: Dict[str, float] = None) -> Dict[str, Any]:
+    '''
+    Render mol_data to each of targets (see RENDER_TARGETS), in order, returning the outputs by target. The writers
+    share a RenderContext, so that atom orders, index maps, coordinate arrays, aromatic atoms and the mol_data_dict are
+    only derived once. options holds extra keyword arguments by target, e.g. {'ccd_cif': {'comp_id': ...,
+    'comp_id_3char': ...}}. If timings is given, the time taken by each writer (s) is stored in it by target.
+    '''
+    for target in targets:
+        assert target in RENDER_TARGETS, target
+    context = RenderContext(mol_data)
+    outputs = {}
+    for target in targets:
+        (writer, kwargs, shares_context) = RENDER_TARGETS[target]
+        kwargs = dict(kwargs, **(options or {}).get(target, {}))
+        if shares_context:
+            kwargs['context'] = context
+        start = perf_counter()
+        outputs[target] = writer(mol_data, **kwargs)
+        if timings is not None:
+            timings[target] = perf_counter() - start
+    return outputs
+
+
+# target: (streaming writer, default keyword arguments, whether the writer takes the RenderContext shared by write_all)
+WRITE_TARGETS = {
+    'pdb': (write_pdb, {}, True),
+    'pdb_united': (write_pdb, {'united': True}, True),
+    'g96': (write_g96, {}, True),
+    'g96_united': (write_g96, {'united': True}, True),
+    'itp': (ITP.write_itp, {}, False),
+    'itp_united': (ITP.write_itp, {'united': True}, False),
+    'yml': (write_yml, {}, True),
+    'template_yml': (write_template_yml, {}, False),
+    'pickle': (write_pickle, {}, True),
+    'columnar': (write_columnar, {}, True),
+    'ccd_cif': (write_ccd_cif, {}, True),
+    'lgf': (write_lgf, {}, False),
+}
+
+
+def write_all(mol_data: MolData,
+              sinks: Dict[str, Any],
+              options: Dict[str, Dict[str, Any]] = None,
+              timings: Dict[str, float] = None) -> None:
+    '''
+    Stream mol_data to a sink per target (see WRITE_TARGETS and atb_outputs.sinks), in the order of sinks, sharing a
+    RenderContext as render_all does. Each sink receives the same content as the output of render_all for its target
+    (encoded as UTF-8 for text outputs written to binary sinks), except that write_lgf raises AssertionError where lgf
+    returns no file. Sinks are left open. options and timings are as for render_all.
+    '''
+    for target in sinks:
+        assert target in WRITE_TARGETS, target
+    context = RenderContext(mol_data)
+    for (target, sink) in sinks.items():
+        (writer, kwargs, shares_context) = WRITE_TARGETS[target]
+        kwargs = dict(kwargs, **(options or {}).get(target, {}))
+        if shares_context:
+            kwargs['context'] = context
+        start = perf_counter()
+        writer(mol_data, sink, **kwargs)
+        if timings is not None:
+            timings[target] = perf_counter() - start
@@ -0,0 +1,319 @@
+# Ring perception on integer adjacency lists
+#
+# Atoms are numbered 0..N-1 and adjacency[i] lists the neighbours of atom i.
+# The graph is never copied per bond: acyclic parts (bridges and the trees
+# hanging off ring systems) are removed once in linear time, and candidate
+# cycles are only generated inside each remaining ring system.
+# Candidates are grouped in Vismara's cycle families (one breadth-first search
+# per root, restricted to lower numbered vertices), then filtered for linear
+# independence over GF(2), with cycles encoded as Python int bitsets over the
+# edges of their ring system.
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+Adjacency = Sequence[Sequence[int]]
+
+Cycle = List[int]
+
+
+def adjacency_from_conn(atoms: Dict[int, Dict]) -> Tuple[List[int], List[List[int]]]:
+    '''
+    Map an atom dictionary (atom_id -> {'conn': [...], ...}) onto integer adjacency lists.
+    Returns (ids, adjacency) where ids[i] is the atom id of vertex i.
+    Connections to unknown atoms and self-connections are ignored.
+    '''
+    ids = list(atoms)
+    position = {atom_id: i for (i, atom_id) in enumerate(ids)}
+    adjacency = [[] for _ in ids]
+    for (i, atom_id) in enumerate(ids):
+        neighbours = adjacency[i]
+        for other_id in atoms[atom_id]['conn']:
+            j = position.get(other_id)
+            if j is None or j == i:
+                continue
+            neighbours.append(j)
+            adjacency[j].append(i)
+    return ids, [sorted(set(neighbours)) for neighbours in adjacency]
+
+
+def smallest_set_of_smallest_rings(adjacency: Adjacency) -> List[Cycle]:
+    '''
+    Return a smallest set of smallest rings (a minimum cycle basis) of the graph.
+    Each ring is a list of vertices in cycle order.
+    '''
+    rings = []
+    for (vertices, local_adjacency) in ring_systems(adjacency):
+        rings.extend(
+            [vertices[i] for i in cycle]
+            for cycle in _minimum_cycle_basis(local_adjacency)
+        )
+    return rings
+
+
+def relevant_cycles(adjacency: Adjacency) -> List[Cycle]:
+    '''
+    Return all relevant cycles of the graph, i.e. the union of all smallest sets of smallest rings.
+    Each ring is a list of vertices in cycle order.
+    '''
+    rings = []
+    for (vertices, local_adjacency) in ring_systems(adjacency):
+        rings.extend(
+            [vertices[i] for i in cycle]
+            for cycle in _relevant_cycles(local_adjacency)
+        )
+    return rings
+
+
+def ring_systems(adjacency: Adjacency) -> List[Tuple[List[int], List[List[int]]]]:
+    '''
+    Split the cyclic part of a graph into ring systems (connected components left after removing all bridges).
+    Returns a list of (vertices, local_adjacency) pairs; local_adjacency is numbered 0..len(vertices)-1.
+    '''
+    bridges = _bridges(adjacency)
+    component = [-1] * len(adjacency)
+    systems = []
+    for start in range(len(adjacency)):
+        if component[start] != -1:
+            continue
+        component[start] = len(systems)
+        members = [start]
+        stack = [start]
+        while stack:
+            v = stack.pop()
+            for w in adjacency[v]:
+                if component[w] == -1 and (min(v, w), max(v, w)) not in bridges:
+                    component[w] = len(systems)
+                    members.append(w)
+                    stack.append(w)
+        systems.append(members)
+
+    ring_systems_ = []
+    for (system_index, members) in enumerate(systems):
+        if len(members) < 3:
+            continue
+        local = {v: i for (i, v) in enumerate(members)}
+        local_adjacency = [
+            [local[w] for w in adjacency[v] if component[w] == system_index]
+            for v in members
+        ]
+        ring_systems_.append((members, local_adjacency))
+    return ring_systems_
+
+
+def _bridges(adjacency: Adjacency) -> set:
+    '''Iterative Tarjan bridge finding; returns bridges as (low_vertex, high_vertex) tuples.'''
+    n = len(adjacency)
+    discovery = [-1] * n
+    low = [0] * n
+    bridges = set()
+    time = 0
+    for root in range(n):
+        if discovery[root] != -1:
+            continue
+        discovery[root] = low[root] = time
+        time += 1
+        stack = [(root, -1, iter(adjacency[root]))]
+        while stack:
+            (v, parent, neighbours) = stack[-1]
+            advanced = False
+            for w in neighbours:
+                if w == parent:
+                    continue
+                if discovery[w] == -1:
+                    discovery[w] = low[w] = time
+                    time += 1
+                    stack.append((w, v, iter(adjacency[w])))
+                    advanced = True
+                    break
+                low[v] = min(low[v], discovery[w])
+            if advanced:
+                continue
+            stack.pop()
+            if parent != -1:
+                low[parent] = min(low[parent], low[v])
+                if low[v] > discovery[parent]:
+                    bridges.add((min(v, parent), max(v, parent)))
+    return bridges
+
+
+def _simple_cycle(adjacency: Adjacency) -> Cycle:
+    '''Walk a ring system in which every vertex has exactly two neighbours.'''
+    cycle = [0]
+    previous, current = 0, adjacency[0][0]
+    while current != 0:
+        cycle.append(current)
+        (a, b) = adjacency[current]
+        previous, current = current, (b if a == previous else a)
+    return cycle
+
+
+def _edge_ids(adjacency: Adjacency) -> Dict[Tuple[int, int], int]:
+    edge_ids = {}
+    for (v, neighbours) in enumerate(adjacency):
+        for w in neighbours:
+            if v < w:
+                edge_ids[(v, w)] = len(edge_ids)
+    return edge_ids
+
+
+def _cycle_bitset(cycle: Cycle, edge_ids: Dict[Tuple[int, int], int]) -> int:
+    bits = 0
+    for (v, w) in zip(cycle, cycle[1:] + cycle[:1]):
+        bits |= 1 << edge_ids[(v, w) if v < w else (w, v)]
+    return bits
+
+
+def _shortest_path_dag(adjacency: Adjacency, root: int) -> Tuple[List[int], List[List[int]]]:
+    '''
+    Breadth-first search from root over the vertices numbered below it, returning the visiting order and all
+    shortest-path predecessors (None for vertices that were not reached).
+    '''
+    distance = [-1] * (root + 1)
+    predecessors = [None] * (root + 1)
+    distance[root] = 0
+    predecessors[root] = []
+    queue = [root]
+    for v in queue:
+        next_distance = distance[v] + 1
+        for w in adjacency[v]:
+            if w > root:
+                continue
+            if distance[w] == -1:
+                distance[w] = next_distance
+                predecessors[w] = []
+                queue.append(w)
+            if distance[w] == next_distance:
+                predecessors[w].append(v)
+    return queue, predecessors
+
+
+def _paths_to_root(predecessors: List[List[int]], v: int, all_paths: bool) -> Iterable[Cycle]:
+    '''Shortest paths v -> root, following the first predecessor only unless all_paths is set.'''
+    if not predecessors[v]:
+        yield [v]
+        return
+    for u in (predecessors[v] if all_paths else predecessors[v][:1]):
+        for path in _paths_to_root(predecessors, u, all_paths):
+            yield [v] + path
+
+
+def _close_cycle(left: Cycle, middle: Cycle, right: Cycle) -> Optional[Cycle]:
+    '''Join two paths ending at the root into a cycle, unless they share any vertex other than the root.'''
+    if len(set(left[:-1]).intersection(right[:-1])) > 0:
+        return None
+    return left[::-1] + middle + right[:-1]
+
+
+class _CycleFamily(object):
+    '''
+    All cycles made of a shortest path root -> x, an optional middle vertex, and a shortest path y -> root
+    (Vismara's cycle families). The prototype uses the first shortest path on each side.
+    '''
+    def __init__(self, predecessors: List[List[int]], x: int, middle: Cycle, y: int, prototype: Cycle) -> None:
+        self.predecessors = predecessors
+        self.x, self.middle, self.y = x, middle, y
+        self.prototype = prototype
+
+    def cycles(self) -> Iterable[Cycle]:
+        for left in _paths_to_root(self.predecessors, self.x, all_paths=True):
+            for right in _paths_to_root(self.predecessors, self.y, all_paths=True):
+                cycle = _close_cycle(left, self.middle, right)
+                if cycle is not None:
+                    yield cycle
+
+
+def _cycle_families(adjacency: Adjacency) -> List[_CycleFamily]:
+    '''
+    Cycle families for every root, where the root is the highest numbered vertex of the cycle.
+    Odd cycles close over an edge (x, y) equidistant from the root; even cycles close over a vertex with two
+    shortest-path predecessors x and y. Every relevant cycle belongs to exactly one family.
+    '''
+    families = []
+    for root in range(len(adjacency)):
+        (order, predecessors) = _shortest_path_dag(adjacency, root)
+        # First shortest path from every reached vertex back to the root
+        first_paths = [None] * (root + 1)
+        first_paths[root] = [root]
+        for x in order[1:]:
+            first_paths[x] = [x] + first_paths[predecessors[x][0]]
+        for x in range(root):
+            if predecessors[x] is None:
+                continue
+            for y in adjacency[x]:
+                if x < y < root and predecessors[y] is not None and len(first_paths[x]) == len(first_paths[y]):
+                    prototype = _close_cycle(first_paths[x], [], first_paths[y])
+                    if prototype is not None:
+                        families.append(_CycleFamily(predecessors, x, [], y, prototype))
+            preds = predecessors[x]
+            for (i, a) in enumerate(preds):
+                for b in preds[i + 1:]:
+                    prototype = _close_cycle(first_paths[a], [x], first_paths[b])
+                    if prototype is not None:
+                        families.append(_CycleFamily(predecessors, a, [x], b, prototype))
+    return sorted(families, key=lambda family: (len(family.prototype), sorted(family.prototype)))
+
+
+def _reduce(bits: int, basis: Dict[int, int]) -> int:
+    '''Reduce a GF(2) vector against an echelon basis keyed by pivot bit; 0 means linearly dependent.'''
+    while bits:
+        pivot = bits.bit_length() - 1
+        row = basis.get(pivot)
+        if row is None:
+            return bits
+        bits ^= row
+    return 0
+
+
+def _cyclomatic_number(adjacency: Adjacency) -> int:
+    return sum(len(neighbours) for neighbours in adjacency) // 2 - len(adjacency) + 1
+
+
+def _minimum_cycle_basis(adjacency: Adjacency) -> List[Cycle]:
+    rank = _cyclomatic_number(adjacency)
+    if rank == 1:
+        return [_simple_cycle(adjacency)]
+
+    edge_ids = _edge_ids(adjacency)
+    basis, rings = {}, []
+    for family in _cycle_families(adjacency):
+        reduced = _reduce(_cycle_bitset(family.prototype, edge_ids), basis)
+        if reduced:
+            basis[reduced.bit_length() - 1] = reduced
+            rings.append(family.prototype)
+            if len(rings) == rank:
+                break
+    return rings
+
+
+def _relevant_cycles(adjacency: Adjacency) -> List[Cycle]:
+    '''
+    A family is relevant if its prototype is not a sum of strictly shorter prototypes, in which case every cycle of
+    the family is relevant. Note that there can be exponentially many relevant cycles (e.g. cyclodextrins).
+    '''
+    rank = _cyclomatic_number(adjacency)
+    if rank == 1:
+        return [_simple_cycle(adjacency)]
+
+    edge_ids = _edge_ids(adjacency)
+    families = _cycle_families(adjacency)
+    basis, rings, seen = {}, [], set()
+    start = 0
+    while start < len(families) and len(basis) < rank:
+        length = len(families[start].prototype)
+        end = start
+        while end < len(families) and len(families[end].prototype) == length:
+            end += 1
+        shorter_basis = dict(basis)
+        for family in families[start:end]:
+            bits = _cycle_bitset(family.prototype, edge_ids)
+            if not _reduce(bits, shorter_basis):
+                continue
+            reduced = _reduce(bits, basis)
+            if reduced:
+                basis[reduced.bit_length() - 1] = reduced
+            for cycle in family.cycles():
+                bits = _cycle_bitset(cycle, edge_ids)
+                if bits not in seen:
+                    seen.add(bits)
+                    rings.append(cycle)
+        start = end
+    return rings
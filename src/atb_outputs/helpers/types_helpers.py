@@ -1,4 +1,4 @@
-from typing import Any, Dict, Callable, Tuple, List, Union
+from typing import Any, Dict, Callable, Tuple, List, Union, IO
 
 Atom = Dict[str, Any]
 
@@ -6,6 +6,8 @@ Ring = Dict[str, Any]
 
 Coordinate = List[float]
 
+PDB_Source = Union[str, bytes, IO]
+
 MolData = Any
 
 Output_File = str
@@ -1,5 +1,9 @@
-from functools import reduce
 from io import StringIO
+from itertools import islice
+
+from atb_outputs.fixed_width import CHUNK_SIZE, format_blocks
+from atb_outputs.sinks import text_sink
+from atb_outputs.united_atoms import TERMS
 
 GROMOS_IMPROPER_DIHEDRALS = {
 1: {'fc': 0.0510, 'value': 0.0       },
@@ -9,11 +13,58 @@ GROMOS_IMPROPER_DIHEDRALS = {
 5: {'fc': 0.102,  'value': -35.26439 },
 }
 
+#force constant has to be converted from kJ/mol/deg^2 to kJ/mol/rad^2
+GROMOS_IMPROPER_PARAMETERS = {
+    code: ' %9.2f %8.2f\n' % (improper['value'], improper['fc']*3281.5686)
+    for (code, improper) in GROMOS_IMPROPER_DIHEDRALS.items()
+}
+
+# variant: united
+VARIANTS = {'all': False, 'united': True}
+
 
 def has_all_charges(data):
     return all( ["charge" in atom for atom in list(data.atoms.values())] )
 
 
+def split_terms(terms, name):
+    # The terms (bonds, angles, impropers or dihedrals, given by name) written by the all-atom and the united-atom itp,
+    # as (all-atom, united-atom) lists, decided in one walk: the united-atom itp leaves out terms flagged 'united', the
+    # all-atom itp type 2 impropers, and neither writes non-essential dihedrals
+    all_atom, united = [], []
+    for term in terms:
+        if name == 'dihedrals' and 'essential' in term and not term['essential']:
+            continue
+        if not (name == 'impropers' and term['code'] == 2):
+            all_atom.append(term)
+        if 'united' not in term:
+            united.append(term)
+    return all_atom, united
+
+
+class ItpContext(object):
+    # What the all-atom and united-atom itps of a molecule have in common, derived once on first use: whether all atoms
+    # have charges, and the terms each representation writes (see split_terms). Like formats.RenderContext, a context
+    # assumes the molecule does not change while it is in use.
+
+    def __init__(self, data):
+        self.data = data
+        self._has_charges = None
+        self._terms = {}
+
+    @property
+    def has_charges(self):
+        if self._has_charges is None:
+            self._has_charges = has_all_charges(self.data)
+        return self._has_charges
+
+    def terms(self, name, united):
+        assert name in TERMS, name
+        if name not in self._terms:
+            self._terms[name] = split_terms(getattr(self.data, name), name)
+        return self._terms[name][1 if united else 0]
+
+
 def first_code(obj):
     return obj['code'][0]
 
@@ -27,17 +78,17 @@ def to_uindex(atom_id, data):
 
 
 def to_atom_id(atom_index, data, united):
+    return data.get_id(atom_index, united=united)
 
-    def uindex_to_id_filter(item):
-        ref_index = item[1]["uindex"] if "uindex" in item[1] else item[1]["index"]
-        return ref_index == atom_index
-
-    def index_to_id_filter(item):
-        return item[1]["index"] == atom_index
-
-    index_filter = uindex_to_id_filter if united else index_to_id_filter
 
-    return list(filter(index_filter, list(data.atoms.items())))[0][0]
+def _write_lines(io, lines):
+    # Write lines (each ending with a newline) CHUNK_SIZE at a time
+    lines = iter(lines)
+    while True:
+        block = ''.join(islice(lines, CHUNK_SIZE))
+        if not block:
+            break
+        io.write(block)
 
 
 def a_ljsym(atom, united_atom_prefix):
@@ -66,7 +117,7 @@ def moleculetype(data, io):
     print(data.var['rnme'] + (9-len(data.var['rnme']))*' ' + '3', file=io)
 
 
-def atoms(data, io, united):
+def atoms(data, io, united, view=None, context=None):
     united_atom_prefix = 'u' if united else ''
     # Write 'atoms' block
     print('[ atoms ]', file=io)
@@ -74,73 +125,62 @@ def atoms(data, io, united):
     a_rnme = data.var['rnme']
     totalcharge = 0.0
 
-    has_charges = has_all_charges(data)
+    has_charges = context.has_charges if context is not None else has_all_charges(data)
 
     atom_format = '%8.3f' if has_charges else '%8s'
-    if united:
-        sorted_atoms = sorted(
-            [a for a in data.atoms.values() if 'uindex' in a],
-            key=lambda atom: atom['uindex'],
-        )
+    if view is None:
+        view = data.united_atom_view(united)
+    sorted_atoms = view.atoms
+    mass_key = united_atom_prefix + 'mass'
+
+    if has_charges:
+        charges = [a_charge(atom, united_atom_prefix) for atom in sorted_atoms]
+        # Summed in order, as the charges are printed
+        for atom_charge in charges:
+            totalcharge += atom_charge
     else:
-        sorted_atoms = sorted(
-            data.atoms.values(),
-            key=lambda atom: atom['index'],
-         )
-
-    atom_lines = []
-
-    for atom in sorted_atoms:
-        a_symbol = atom['symbol']
-        a_index = atom[united_atom_prefix + 'index']
-        a_cgroup = atom['cgroup']
-        a_mass = atom[united_atom_prefix + 'mass'] if (united_atom_prefix + 'mass') in atom else atom['mass']
+        charges = '%%'
+    columns = [
+        view.indexes,
+        [a_ljsym(atom, united_atom_prefix) for atom in sorted_atoms],
+        '1',
+        a_rnme,
+        [atom['symbol'] for atom in sorted_atoms],
+        view.indexes,
+        charges,
+        [atom[mass_key] if mass_key in atom else atom['mass'] for atom in sorted_atoms],
+    ]
+    for block in format_blocks('%5d %5s %4s %7s %6s %4d {0} %8.4f\n'.format(atom_format), columns, len(sorted_atoms)):
+        io.write(block)
+    print('; total charge of the molecule: %7.3f' % totalcharge, file=io)
+
+
+def bonds(data, io, united, view=None, context=None):
+    # Write 'bonds' block
+    print('[ bonds ]', file=io)
+    print(';  ai   aj  funct   c0         c1', file=io)
+    if view is None:
+        view = data.united_atom_view(united)
+    _write_lines(io, _bond_lines(_terms(data, 'bonds', united, context), view.index_for_id))
 
-        if has_charges:
-            atom_charge = a_charge(atom, united_atom_prefix)
-        else:
-            atom_charge = '%%'
-
-        atom_lines.append(
-            '%5d %5s %4s %7s %6s %4d {0} %8.4f'.format(atom_format) % (
-                a_index,
-                a_ljsym(atom, united_atom_prefix),
-                '1',
-                a_rnme,
-                a_symbol,
-                a_index,
-                atom_charge,
-                a_mass,
-            ),
-        )
-        if has_charges:
-            totalcharge += atom_charge
-    atom_lines.append('; total charge of the molecule: %7.3f' % totalcharge)
 
-    print("\n".join(atom_lines), file=io)
+def _terms(data, name, united, context):
+    # The terms written by the itp of a representation (see split_terms)
+    if context is not None:
+        return context.terms(name, united)
+    return split_terms(getattr(data, name), name)[1 if united else 0]
 
 
-def bonds(data, io, united):
-    # Write 'bonds' block
-    print('[ bonds ]', file=io)
-    print(';  ai   aj  funct   c0         c1', file=io)
-    to_index = to_uindex if united else to_aaindex
-    for b in data.bonds:
-        if united and 'united' in b: continue
+def _bond_lines(bonds, index_for_id):
+    for b in bonds:
+        atoms = b['atoms']
         if 'value' in b and len(b['code']) > 0 :
-            print('%5d %4d %4s %8.4f %12.4e' \
-                    %( to_index(b['atoms'][0], data),
-                       to_index(b['atoms'][1], data),
-                       '2',
-                       first_code(b)['value'],
-                       first_code(b)['fc']), file=io)
+            code = first_code(b)
+            yield '%5d %4d %4s %8.4f %12.4e\n' % (
+                index_for_id[atoms[0]], index_for_id[atoms[1]], '2', code['value'], code['fc'],
+            )
         else:
-            print('%5d %4d %4s %8s %12s' \
-                    %( to_index(b['atoms'][0], data),
-                       to_index(b['atoms'][1], data),
-                       '2',
-                       '%%',
-                       '%%'), file=io)
+            yield '%5d %4d %4s %8s %12s\n' % (index_for_id[atoms[0]], index_for_id[atoms[1]], '2', '%%', '%%')
 
 
 def dummy_blocks(data, io):
@@ -155,106 +195,99 @@ def dummy_blocks(data, io):
     print(';  ai   aj   ak   al  funct    ph0      cp     mult', file=io)
 
 
-def pairs_1_4(data, io, nbr3, united):
+def split_1_4(data, nbr3, united, view=None):
+    # Split the 1-4 neighbours (see calculate_1_4_neighbours) into (pairs, exclusions), lists of (index, neighbour
+    # index) ordered by index, the exclusions being the neighbours in the (u)excl of the atom
+    excl_key = ('u' if united else '') + 'excl'
+    if view is None:
+        view = data.united_atom_view(united)
+    id_for_index = view.id_for_index
+    pairs, exclusions = [], []
+    for k, v in sorted(nbr3.items()):
+        if not v:
+            continue
+        excl = data.atoms[id_for_index[k]][excl_key]
+        if not excl:
+            pairs.extend([(k, n) for n in v])
+            continue
+        excl = set(excl)
+        for n in v:
+            (exclusions if n in excl else pairs).append((k, n))
+    return pairs, exclusions
+
 
-    # Print 1-4 pairs
+def pairs_1_4(data, io, nbr3, united, split=None):
+    # Print 1-4 pairs (split: split_1_4(data, nbr3, united), if already done)
+    pairs = (split if split is not None else split_1_4(data, nbr3, united))[0]
     print('[ pairs ]', file=io)
     print(';  ai   aj  funct  ;  all 1-4 pairs but the ones excluded in GROMOS itp', file=io)
-    united_atom_prefix = 'u' if united else ''
-    for k, v in sorted(list(nbr3.items())):
-        atom = data.atoms[to_atom_id(k, data, united)]
-        for n in v:
-            should_be_displayed = n not in atom[united_atom_prefix + 'excl']
-            if should_be_displayed:
-                print('%5d %4d %4s' %(
-                          k,
-                          n,
-                          '1'), file=io)
+    _write_lines(io, ('%5d %4d %4s\n' % (k, n, '1') for (k, n) in pairs))
 
 
-def angles(data, io, united):
+def angles(data, io, united, view=None, context=None):
     # Print angle block
     print('[ angles ]', file=io)
     print(';  ai   aj   ak  funct   angle     fc', file=io)
-    to_index = to_uindex if united else to_aaindex
-    for angle in data.angles:
-        if united and 'united' in angle: continue
+    if view is None:
+        view = data.united_atom_view(united)
+    _write_lines(io, _angle_lines(_terms(data, 'angles', united, context), view.index_for_id))
+
+
+def _angle_lines(angles, index_for_id):
+    for angle in angles:
+        atoms = angle['atoms']
         if 'value' in angle and 'code' in angle and len(angle['code']) > 0:
-            print('%5d %4d %4d %4s %9.2f %8.2f' \
-                    %( to_index(angle['atoms'][0], data),
-                       to_index(angle['atoms'][1], data),
-                       to_index(angle['atoms'][2], data),
-                       '2',
-                       first_code(angle)['value'],
-                       first_code(angle)['fc']), file=io)
+            code = first_code(angle)
+            yield '%5d %4d %4d %4s %9.2f %8.2f\n' % (
+                index_for_id[atoms[0]], index_for_id[atoms[1]], index_for_id[atoms[2]], '2', code['value'], code['fc'],
+            )
         else:
-            print('%5d %4d %4d %4s %9s %8s' \
-                    %( to_index(angle['atoms'][0], data),
-                       to_index(angle['atoms'][1], data),
-                       to_index(angle['atoms'][2], data),
-                       '2',
-                       '%%',
-                       '%%'), file=io)
+            yield '%5d %4d %4d %4s %9s %8s\n' % (
+                index_for_id[atoms[0]], index_for_id[atoms[1]], index_for_id[atoms[2]], '2', '%%', '%%',
+            )
 
 
-def impropers(data, io, united):
+def impropers(data, io, united, view=None, context=None):
     # Print improper dihedral block
     print('[ dihedrals ]', file=io)
     print('; GROMOS improper dihedrals', file=io)
     print(';  ai   aj   ak   al  funct   angle     fc', file=io)
-    to_index = to_uindex if united else to_aaindex
-    for i in data.impropers:
-        if united and 'united' in i: continue
-        # if this is an all atom output, skip all type 2 impropers
-        if not united and i['code'] == 2:
-            continue
-        #force constant has to be converted from kJ/mol/deg^2 to kJ/mol/rad^2
-        print('%5d %4d %4d %4d %4s %9.2f %8.2f' \
-                %( to_index(i['atoms'][0], data),
-                   to_index(i['atoms'][1], data),
-                   to_index(i['atoms'][2], data),
-                   to_index(i['atoms'][3], data),
-                   '2',
-                   GROMOS_IMPROPER_DIHEDRALS[ i['code'] ]['value'],
-                   GROMOS_IMPROPER_DIHEDRALS[ i['code'] ]['fc']*3281.5686
-                  ), file=io)
-
-
-def dihedrals(data, io, united):
+    if view is None:
+        view = data.united_atom_view(united)
+    _write_lines(io, _improper_lines(_terms(data, 'impropers', united, context), view.index_for_id))
+
+
+def _improper_lines(impropers, index_for_id):
+    for i in impropers:
+        atoms = i['atoms']
+        yield '%5d %4d %4d %4d %4s' % (
+            index_for_id[atoms[0]], index_for_id[atoms[1]], index_for_id[atoms[2]], index_for_id[atoms[3]], '2',
+        ) + GROMOS_IMPROPER_PARAMETERS[i['code']]
+
+
+def dihedrals(data, io, united, view=None, context=None):
     # Print dihedral block
     print('[ dihedrals ]', file=io)
     print(';  ai   aj   ak   al  funct    ph0      cp     mult', file=io)
-    to_index = to_uindex if united else to_aaindex
-    for i in data.dihedrals:
-        if united and 'united' in i:
-            # print("skipping united")
-            continue
-        # Only print essential dihedrals
-        if 'essential' in i and not i['essential']:
-            # print("skipping essential")
-            continue
+    if view is None:
+        view = data.united_atom_view(united)
+    _write_lines(io, _dihedral_lines(_terms(data, 'dihedrals', united, context), view.index_for_id))
+
+
+def _dihedral_lines(dihedrals, index_for_id):
+    for i in dihedrals:
+        atoms = i['atoms']
         if 'code' in i and len(i['code']) > 0:
-            print('%5d %4d %4d %4d %4s %9.2f %8.2f %4d' \
-                    %( to_index(i['atoms'][0], data),
-                       to_index(i['atoms'][1], data),
-                       to_index(i['atoms'][2], data),
-                       to_index(i['atoms'][3], data),
-                       '1',
-                       first_code(i)['value'],
-                       first_code(i)['fc'],
-                       first_code(i)['mul']
-                     ), file=io)
+            code = first_code(i)
+            yield '%5d %4d %4d %4d %4s %9.2f %8.2f %4d\n' % (
+                index_for_id[atoms[0]], index_for_id[atoms[1]], index_for_id[atoms[2]], index_for_id[atoms[3]], '1',
+                code['value'], code['fc'], code['mul'],
+            )
         else:
-            print('%5d %4d %4d %4d %4s %9s %8s %4s' \
-                    %( to_index(i['atoms'][0], data),
-                       to_index(i['atoms'][1], data),
-                       to_index(i['atoms'][2], data),
-                       to_index(i['atoms'][3], data),
-                       '1',
-                       '%%',
-                       '%%',
-                       '%%'
-                     ), file=io)
+            yield '%5d %4d %4d %4d %4s %9s %8s %4s\n' % (
+                index_for_id[atoms[0]], index_for_id[atoms[1]], index_for_id[atoms[2]], index_for_id[atoms[3]], '1',
+                '%%', '%%', '%%',
+            )
 
 
 def graph_dihedrals(data, io, united):
@@ -299,63 +332,60 @@ def graph_dihedrals(data, io, united):
                      ), file=io)
 
 
-def exclusions_1_4(data, io, nbr3, united):
-    # Print 1-4 exclusions
+def exclusions_1_4(data, io, nbr3, united, split=None):
+    # Print 1-4 exclusions (split: split_1_4(data, nbr3, united), if already done)
+    exclusions = (split if split is not None else split_1_4(data, nbr3, united))[1]
     print('[ exclusions ]', file=io)
     print(';  ai   aj  funct  ;  GROMOS 1-4 exclusions', file=io)
-    united_atom_prefix = 'u' if united else ''
-    for k, v in sorted(list(nbr3.items())):
-        atom = data.atoms[to_atom_id(k, data, united)]
-        for n in v:
-            should_be_displayed = n in atom[united_atom_prefix + 'excl']
-            if should_be_displayed:
-                print('%5d %4d' %(k, n), file=io)
+    _write_lines(io, ('%5d %4d\n' % (k, n) for (k, n) in exclusions))
 
 
-def calculate_1_4_neighbours(data, united):
-    # Calculate all 1-4 neighbourship
-    if not united:
-        conn_index = dict([(a["index"], _conv_to_index(a["conn"], data, united)) for a in list(data.atoms.values())])
-    else:
-        conn_index = dict([(a["uindex"], _conv_to_index(a["uconn"], data, united)) for a in list(data.atoms.values()) if
-                           'uindex' in a])
-    nbr3 = {}
-    for index, conn in list(conn_index.items()):
-        # 1st neighbor
-        first_neighbours = sorted(conn)
-        # 2nd neighbor
-        second_neighbours = [x for x in _get_neighbour_ids(first_neighbours, conn_index) if x not in first_neighbours]
-        # 3rd neighbor
-        third_neighbours = [x for x in _get_neighbour_ids(second_neighbours, conn_index) if
-                            x not in first_neighbours + second_neighbours]
+def calculate_1_4_neighbours(data, united, view=None):
+    # All 1-4 neighbours, by (u)index in data.atoms order: the neighbours of the 1-3 neighbours of each atom that are
+    # neither 1-2 nor 1-3 neighbours, keeping those with a higher (u)index (see atb_outputs.neighbours)
+    if view is None:
+        view = data.united_atom_view(united)
+    nbr3 = view.neighbour_shells.neighbours(3, upper=True)
+    index_key = view.index_key
+    return {atom[index_key]: nbr3[atom[index_key]] for atom in data.atoms.values() if index_key in atom}
 
-        nbr3[index] = [x for x in third_neighbours if x > index]
-    return nbr3
-
-
-def _get_neighbour_ids(atom_ids, conn_index):
-    return sorted( list( set( reduce(lambda x,y:x+y, [conn_index[atom_id] for atom_id in atom_ids], []) ) ) )
-
-
-def _conv_to_index(atom_ids, data, united):
-    to_index = to_uindex if united else to_aaindex
-    return [to_index(x, data) for x in atom_ids]
-
-
-def itp(data, united=False):
-    nbr3 = calculate_1_4_neighbours(data, united)
 
+def itp(data, united=False, context=None):
     io = StringIO()
-    header(data, io)
-    title(data, io)
-    moleculetype(data, io)
-    atoms(data, io, united)
-    bonds(data, io, united)
-    pairs_1_4(data, io, nbr3, united)
-    angles(data, io, united)
-    impropers(data, io, united)
-    # graph_dihedrals(data, io, united)
-    dihedrals(data, io, united)
-    exclusions_1_4(data, io, nbr3, united)
-
+    write_itp(data, io, united=united, context=context)
     return io.getvalue()
+
+
+def itp_variants(data, variants=('all', 'united')):
+    # The itp of each of variants ('all': all-atom, 'united': united-atom), by variant, sharing an ItpContext: charges
+    # are checked and the terms split between the representations once. Atom orders, 1-4 neighbours, pairs and
+    # exclusions are by index or uindex, so each itp derives its own (through the view cached by data, see
+    # MolData.united_atom_view)
+    for variant in variants:
+        assert variant in VARIANTS, variant
+    context = ItpContext(data)
+    return {variant: itp(data, united=VARIANTS[variant], context=context) for variant in variants}
+
+
+def write_itp(data, io, united=False, context=None):
+    # Stream the itp to a text or binary sink, block by block (see atb_outputs.sinks)
+    # The view (index maps), the terms (see ItpContext) and the pairs and exclusions (in one pass) are resolved once,
+    # for all the blocks
+    if context is None:
+        context = ItpContext(data)
+    view = data.united_atom_view(united)
+    nbr3 = calculate_1_4_neighbours(data, united, view=view)
+    split = split_1_4(data, nbr3, united, view=view)
+
+    with text_sink(io) as io:
+        header(data, io)
+        title(data, io)
+        moleculetype(data, io)
+        atoms(data, io, united, view=view, context=context)
+        bonds(data, io, united, view=view, context=context)
+        pairs_1_4(data, io, nbr3, united, split=split)
+        angles(data, io, united, view=view, context=context)
+        impropers(data, io, united, view=view, context=context)
+        # graph_dihedrals(data, io, united)
+        dihedrals(data, io, united, view=view, context=context)
+        exclusions_1_4(data, io, nbr3, united, split=split)
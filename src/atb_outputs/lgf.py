@@ -1,11 +1,14 @@
 from io import StringIO
 
+from atb_outputs.sinks import text_sink
+
 def graph(molecule_data, enforce_has_charges: bool = True, enforce_has_ocoords: bool = True):
     io = StringIO()
+    write_graph(molecule_data, io, enforce_has_charges=enforce_has_charges, enforce_has_ocoords=enforce_has_ocoords)
+    return io.getvalue()
 
-    print('''@nodes
-partial_charge  label   label2  atomType    coordX  coordY  coordZ  initColor''', file=io)
-
+def write_graph(molecule_data, io, enforce_has_charges: bool = True, enforce_has_ocoords: bool = True):
+    # Stream the graph to a text or binary sink (see atb_outputs.sinks); nothing is written if an assertion fails
     atoms = list(molecule_data.atoms.values())
 
     if enforce_has_charges:
@@ -17,16 +20,25 @@ partial_charge  label   label2  atomType    coordX  coordY  coordZ  initColor'''
     else:
         coordinate_key = 'coord'
 
-    for atom in atoms:
+    with text_sink(io) as io:
+        _write_graph(molecule_data, io, atoms, coordinate_key)
+
+def _write_graph(molecule_data, io, atoms, coordinate_key):
+    print('''@nodes
+partial_charge  label   label2  atomType    coordX  coordY  coordZ  initColor''', file=io)
+
+    coords = molecule_data.coordinate_array(coordinate_key, list(molecule_data.atoms)).tolist()
+
+    for (atom, coord) in zip(atoms, coords):
         iacm_key = "std_iacm" if "std_iacm" in atom else "iacm"
         print('''{0:4.3f} {1} {2} {3} {4:4.3f} {5:4.3f} {6:4.3f} {7}'''.format(
             atom['charge'] if 'charge' in atom else 0.0,
             atom['id'],
             atom['symbol'],
             atom[iacm_key],
-            atom[coordinate_key][0],
-            atom[coordinate_key][1],
-            atom[coordinate_key][2],
+            coord[0],
+            coord[1],
+            coord[2],
             atom['cgroup'],
         ), file=io)
 
@@ -40,8 +52,6 @@ partial_charge  label   label2  atomType    coordX  coordY  coordZ  initColor'''
             i,
         ), file=io)
 
-    return io.getvalue()
-
 if __name__ == '__main__':
     example_file = '''
 @nodes
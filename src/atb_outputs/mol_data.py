@@ -1,11 +1,19 @@
+from collections import namedtuple
+from itertools import chain
+from operator import itemgetter
 from logging import Logger
 from sys import stderr
-from copy import deepcopy
-from math import sqrt
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Callable, Iterable, Iterator, List
 
-from atb_outputs.helpers.types_helpers import Atom, Tuple, Ring, Coordinate
-from atb_outputs.helpers.dijkstra import shortestPath
+import numpy as np
+
+from atb_outputs.helpers.types_helpers import Atom, Tuple, Ring, PDB_Source
+from atb_outputs.coordinates import CoordinateStore
+from atb_outputs.records import Record, Atom as AtomRecord, Bond as BondRecord
+from atb_outputs.united_atoms import UnitedAtomView
+import atb_outputs.pdb as PDB
+from atb_outputs.helpers.ring_perception import adjacency_from_conn, smallest_set_of_smallest_rings, \
+    relevant_cycles as find_relevant_cycles
 
 
 class MolDataFailure(Exception):
@@ -14,22 +22,32 @@ class MolDataFailure(Exception):
 
 class MolData(object):
     def __init__(self,
-                 initialiser_object: Optional[str],
+                 initialiser_object: Optional[PDB_Source],
                  log: Optional[Logger] = None,
                  build_ring: bool = True,
-                 enforce_single_molecule: bool = True) -> None:
+                 enforce_single_molecule: bool = True,
+                 compact: bool = False) -> None:
         """
         TODO: MolData docs
-        :param initialiser_object: One of a Molecule3D, FDB_Molecule or a pdb_string, each has a different initialiser
+        :param initialiser_object: One of a Molecule3D, FDB_Molecule or a pdb_string, each has a different initialiser.
+            PDB data can also be given as a bytes buffer or a (text or binary) file object, which is read line by line.
         :param log: ?
-        :param build_ring: ?
+        :param build_ring: Perceive rings (see MolData.rings) on first access; otherwise rings must be set explicitly
         :param enforce_single_molecule: ?
+        :param compact: Hold atoms and bonds as compact records, see MolData.compact()
         :param atom_index_name: If using a Molecule3D to initialise, which atom ID to use for the mapping. Needs to be
             and ID of type int
         """
 
         #### Added method for instanciating from FDBMolecule objects
 
+        self._reset_indexes()
+        self._coordinate_store = None
+        self._version = 0
+        self._rings = None
+        self._perceived_rings = None
+        self._build_ring = build_ring
+        self._log = log
         self.atoms = {}
         self.bonds = []
         self.equivalenceGroups = {}
@@ -43,10 +61,246 @@ class MolData(object):
         else:
             self._readPDB(initialiser_object, enforce_single_molecule=enforce_single_molecule)
 
-        if build_ring:
-            self.rings = build_rings(self, log)
+        self.united_hydrogens = []
+
+        if compact:
+            self.compact()
+
+    @property
+    def atoms(self) -> Dict[int, Atom]:
+        return self._atoms
+
+    @atoms.setter
+    def atoms(self, atoms: Dict[int, Atom]) -> None:
+        self._atoms = atoms
+        self._reset_indexes()
+        self._coordinate_store = None
+        self.modified()
+
+    @property
+    def bonds(self) -> List[Dict[str, Any]]:
+        return self._bonds
+
+    @bonds.setter
+    def bonds(self, bonds: List[Dict[str, Any]]) -> None:
+        self._bonds = bonds
+        self._bond_for_atoms = None
+        self._united_atom_views = {}
+        self.modified()
+
+    @property
+    def rings(self) -> Dict[int, Ring]:
+        '''
+        Rings set explicitly, or else perceived by build_rings on first access (if build_ring was set). Perceived rings
+        are cached until atoms or bonds are replaced, the number of atoms or bonds changes, coordinates are written
+        with set_coordinates or (once adopted, see adopt_coordinates) through the arrays or their atom views, or
+        modified() is called.
+        Other edits in place are not seen: after replacing a bond, changing a bond's atoms or an atom's conn, or editing
+        the plain 'coord' or 'ocoord' lists of atoms, call modified().
+        '''
+        if self._rings is not None:
+            return self._rings
+        if not self._build_ring:
+            raise AttributeError("'MolData' object has no attribute 'rings'")
+        if self._perceived_rings is None or self._perceived_rings[1] != self._rings_signature():
+            rings = build_rings(self, self._log)
+            self._perceived_rings = (rings, self._rings_signature())
+        return self._perceived_rings[0]
+
+    @rings.setter
+    def rings(self, rings: Optional[Dict[int, Ring]]) -> None:
+        '''Explicitly set rings are kept as they are; setting None goes back to perceiving them.'''
+        self._rings = rings
+
+    def _rings_signature(self) -> Tuple[int, int, int, str, Optional[bytes]]:
+        '''
+        What perceived rings depend on, all cheap to check: the version of the molecule (see modified), its numbers of
+        atoms and bonds, which coordinates the ring planes are fitted to and the contents of adopted coordinate arrays.
+        '''
+        store = self._coordinate_store
+        return (
+            self._version, len(self.atoms), len(self.bonds), _ring_coordinate_key(self) if self.atoms else '',
+            store.digest() if store is not None else None,
+        )
 
+    def modified(self) -> None:
+        '''
+        Note that atoms, bonds or coordinates were changed in place, so that derived data (perceived rings) is rebuilt.
+        Replacing atoms or bonds, and set_coordinates, do so themselves.
+        '''
+        self._version += 1
+
+    def _reset_indexes(self) -> None:
+        '''
+        Drop the index -> id, uindex -> id and atom pair -> bond maps; they are rebuilt lazily on the next lookup.
+        Lookups also rebuild them when an index is missing or points to an atom that no longer carries it, and when
+        bonds were added or removed in place.
+        '''
+        self._id_for_index = None
+        self._id_for_uindex = None
+        self._bond_for_atoms = None
+        self._united_atom_views = {}
+
+    def _index_map(self, index_key: str) -> Dict[int, int]:
+        attribute = '_id_for_' + index_key
+        index_map = getattr(self, attribute)
+        if index_map is None:
+            index_map = {}
+            for (atom_id, atom) in self.atoms.items():
+                if index_key in atom:
+                    index_map.setdefault(atom[index_key], atom_id)
+            setattr(self, attribute, index_map)
+        return index_map
+
+    def _lookup_id(self, index: int, index_key: str) -> Optional[int]:
+        for rebuild in (False, True):
+            if rebuild:
+                setattr(self, '_id_for_' + index_key, None)
+            atom_id = self._index_map(index_key).get(index)
+            if atom_id in self.atoms and self.atoms[atom_id].get(index_key) == index:
+                return atom_id
+        return None
+
+    def get_id(self, index: int, united: bool = False) -> int:
+        '''
+        return id of the atom with specified index number.
+        If united, index is a united atom index (uindex); atoms without one are matched on their index instead.
+        '''
+        atom_id = self._lookup_id(index, 'uindex') if united else None
+        if atom_id is None:
+            atom_id = self._lookup_id(index, 'index')
+        if atom_id is None:
+            raise IndexError('atom with index number %d not found.' % index)
+        return atom_id
+
+    def coordinate_store(self) -> Optional[CoordinateStore]:
+        '''
+        The columnar (N, 3) arrays of the atoms' 'coord' and 'ocoord' (see adopt_coordinates), while they still back the
+        atoms; None if coordinates were never adopted, or atoms or their coordinates have since been replaced.
+        '''
+        if self._coordinate_store is not None and not self._coordinate_store.is_current(self.atoms):
+            self._coordinate_store = None
+        return self._coordinate_store
+
+    def adopt_coordinates(self) -> 'MolData':
+        '''
+        Hold the atoms' 'coord' and 'ocoord' in a CoordinateStore: the per-atom values become views onto the rows of
+        contiguous (N, 3) arrays, which coordinate_array then slices instead of gathering the values atom by atom.
+        Nothing else adopts coordinates of plain atoms (compact() and unpickling do for records and adopted stores), so
+        reading or writing outputs leaves the atoms' lists as they are. Returns self.
+        '''
+        if self.coordinate_store() is None:
+            self._coordinate_store = CoordinateStore(self.atoms)
+        return self
+
+    def coordinate_array(self, key: str = 'coord', atom_ids: Optional[List[int]] = None) -> np.ndarray:
+        '''
+        (N, 3) array of the 'coord' or 'ocoord' of atom_ids (default: all atoms, in the order of self.atoms): rows of
+        the coordinate store if coordinates were adopted, or else a new array gathered from the atoms.
+        Raises KeyError, as per-atom access would, if an atom has no such coordinate.
+        '''
+        store = self.coordinate_store()
+        array = store.array(key) if store is not None else None
+        if array is None:
+            atoms = self.atoms
+            atoms = atoms.values() if atom_ids is None else [atoms[atom_id] for atom_id in atom_ids]
+            # Flattened, which numpy reads faster than a list of (3,) lists
+            return np.fromiter(
+                chain.from_iterable(atom[key] for atom in atoms), dtype=np.float64, count=3 * len(atoms),
+            ).reshape(-1, 3)
+        return array if atom_ids is None else array[store.rows(atom_ids)]
+
+    def set_coordinates(self, key: str, coordinates: Any, atom_ids: Optional[List[int]] = None) -> None:
+        '''
+        Write the (N, 3) coordinates of atom_ids (default: all atoms, in the order of self.atoms) as their 'coord' or
+        'ocoord', through the coordinate store if it holds key, or else atom by atom (as lists).
+        '''
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+        atom_ids = list(self.atoms) if atom_ids is None else list(atom_ids)
+        assert len(coordinates) == len(atom_ids), (len(coordinates), len(atom_ids))
+        store = self.coordinate_store()
+        array = store.array(key) if store is not None else None
+        if array is not None:
+            array[store.rows(atom_ids)] = coordinates
+        else:
+            for (atom_id, coordinate) in zip(atom_ids, coordinates.tolist()):
+                self.atoms[atom_id][key] = coordinate
+        self.modified()
+
+    @classmethod
+    def from_many(cls, pdb_sources: Iterable[PDB_Source], **batch_options: Any) -> Iterator['BatchResult']:
+        '''
+        Read many PDB strings (or bytes) over a process pool, yielding a BatchResult(index, mol_data, error, traceback)
+        for each; rings are perceived in the workers. See atb_outputs.batch.read_many for the batch_options (max_workers,
+        chunksize, ordered, progress, executor) and the MolData options passed on.
+        '''
+        from atb_outputs.batch import read_many
+        return read_many('pdb', pdb_sources, **batch_options)
+
+    def compact(self) -> 'MolData':
+        '''
+        Switch atoms and bonds to the compact representation (atb_outputs.records): slotted Atom and Bond records
+        instead of dicts, connectivities as tuples, and coordinates held only by the (N, 3) arrays of the coordinate
+        store. Records support the same item access as dicts, so writers work on either. Returns self.
+        '''
+        self.atoms = {
+            atom_id: atom if isinstance(atom, Record) else AtomRecord(atom)
+            for (atom_id, atom) in self.atoms.items()
+        }
+        self.bonds = [bond if isinstance(bond, Record) else BondRecord(bond) for bond in self.bonds]
+        return self.adopt_coordinates()
+
+    def __reduce__(self) -> Tuple[Callable, Tuple[type, Dict[str, Any]]]:
+        '''Pickle without derived data, and with records and coordinates in numpy arrays, see atb_outputs.pickling.'''
+        from atb_outputs.pickling import mol_data_state, restore_mol_data
+        return (restore_mol_data, (type(self), mol_data_state(self)))
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        '''
+        Restore pickled attributes. Pickles written before MolData.__reduce__ hold the whole __dict__ of the molecule,
+        which may lack attributes added since, or hold 'atoms', 'bonds' and 'rings' as plain attributes.
+        '''
+        self._reset_indexes()
+        self._coordinate_store = None
+        self._version = 0
+        self._rings = None
+        self._perceived_rings = None
+        self._build_ring = True
+        self._log = None
+        self._atoms = {}
+        self._bonds = []
+        self.equivalenceGroups = {}
+        self._atom_index_map = {}
         self.united_hydrogens = []
+        state = dict(state)
+        plain_attributes = [(key, state.pop(key)) for key in ('atoms', 'bonds', 'rings') if key in state]
+        self.__dict__.update(state)
+        for (key, value) in plain_attributes:
+            setattr(self, key, value)
+
+    def united_atom_view(self, united: bool = True) -> UnitedAtomView:
+        '''
+        The united-atom (or, with united=False, all-atom) view of the molecule shared by the writers, built on first use
+        and rebuilt when atoms are replaced, renumbered, (un)united or reconnected ('conn' or 'uconn' changed), or after
+        modified(). Terms whose 'united' flag is changed in place afterwards need a call to unite_atoms or a new bonds
+        list (or reset_united_atom_views, or modified()) to show up.
+        '''
+        view = self._united_atom_views.get(united)
+        if view is None or not view.is_current(self):
+            view = self._united_atom_views[united] = UnitedAtomView(self, united)
+        return view
+
+    def reset_united_atom_views(self) -> None:
+        self._united_atom_views = {}
+
+    def get_bond(self, atm1: int, atm2: int) -> Optional[Dict[str, Any]]:
+        '''return the bond between atom ids atm1 and atm2, or None if they are not bonded.'''
+        if self._bond_for_atoms is None or self._bond_for_atoms_count != len(self.bonds):
+            self._bond_for_atoms = {}
+            for bond in self.bonds:
+                self._bond_for_atoms.setdefault(frozenset(bond["atoms"]), bond)
+            self._bond_for_atoms_count = len(self.bonds)
+        return self._bond_for_atoms.get(frozenset([atm1, atm2]))
 
     def unite_atoms(self) -> None:
         self.united_hydrogens = []
@@ -55,23 +309,24 @@ class MolData(object):
             if atom["type"] == "C" and len(connected_hydrogens) > 1:
                 self.united_hydrogens.extend([a_id for a_id in connected_hydrogens])
 
+        united_hydrogens = set(self.united_hydrogens)
         united_atoms = []
         for atom_id, atom in sorted(self.atoms.items()):
-            if atom_id not in self.united_hydrogens:
+            if atom_id not in united_hydrogens:
                 united_atoms.append(atom_id)
                 self.atoms[atom_id]["uindex"] = len(united_atoms)
-        self._unite_bonds()
+        self._id_for_uindex = None
+        self._unite_bonds(united_hydrogens)
 
-    def _unite_bonds(self) -> None:
+    def _unite_bonds(self, united_hydrogens: Optional[set] = None) -> None:
+        if united_hydrogens is None:
+            united_hydrogens = set(self.united_hydrogens)
         for bond in self.bonds:
-            if any([a in self.united_hydrogens for a in bond["atoms"]]):
+            if any([a in united_hydrogens for a in bond["atoms"]]):
                 continue
             else:
                 bond["united"] = True
-
-    def get_id(self, index: int) -> int:
-        '''return id of the atom with specified index number'''
-        return [k for (k, v) in self.atoms.items() if v['index'] == index][0]
+        self.reset_united_atom_views()
 
     def __getitem__(self, atom_id: int) -> Atom:
         '''return an atom with atom_id. '''
@@ -84,20 +339,28 @@ class MolData(object):
     def _addBondData(self, atm1: int, atm2: int) -> None:
         if atm1 == atm2:
             return
-        if set([atm1, atm2]) in [set(b["atoms"]) for b in self.bonds]:
+        if self.get_bond(atm1, atm2) is not None:
             return
-        self.bonds.append({"atoms": [int(atm1), int(atm2)]})
+        bond = {"atoms": [int(atm1), int(atm2)]}
+        self.bonds.append(bond)
+        self._bond_for_atoms[frozenset(bond["atoms"])] = bond
+        self._bond_for_atoms_count += 1
 
     def _readFDBMolecule(self, Molecule: 'FDBMolecule') -> None:
-        fdb_atom_info = Molecule.atom_info
+        # Index the FDB atom info by elementID and the atom ids once, instead of searching them for every atom
+        fdb_info_for_name = {}
+        for a_fdb in Molecule.atom_info:
+            fdb_info_for_name.setdefault(a_fdb['elementID'], []).append(a_fdb)
+        id_for_atom = {a: Molecule.atoms[a]._index['id'] for a in Molecule.atoms}
+
         for a in Molecule.atoms:
             index_dict = Molecule.atoms[a]._index
 
             bond_info = Molecule.bonds(a)
-            connectivity = [Molecule.atoms[a_bonded]._index['id'] for _, a_bonded in bond_info]
+            connectivity = [id_for_atom[a_bonded] for _, a_bonded in bond_info]
             i = index_dict['id']
             name = index_dict['name']
-            fdb_info = [a_fdb for a_fdb in fdb_atom_info if a_fdb['elementID'] == name]
+            fdb_info = fdb_info_for_name.get(name, [])
             assert len(fdb_info) == 1, fdb_info
             fdb_info = fdb_info[0]
 
@@ -109,9 +372,7 @@ class MolData(object):
                              'coord': [fdb_info['x3d'], fdb_info['y3d'], fdb_info['z3d']]
                              }
 
-            self.bonds = [
-                {'atoms': [Molecule.atoms[a1]._index['id'], Molecule.atoms[a2]._index['id']]}
-                for a1, a2 in Molecule.bonds]
+        self.bonds = [{'atoms': [id_for_atom[a1], id_for_atom[a2]]} for a1, a2 in Molecule.bonds]
 
     def _readMolecule3D(self, Molecule: 'Molecule3D') -> None:
         if tuple(sorted(Molecule.atoms)) != sorted(range(1,len(Molecule.atoms)+1)):
@@ -161,103 +422,55 @@ class MolData(object):
         #     for a1, a2 in Molecule.bonds
         #     assert self._atom_index_map[Molecule.atoms[a1].get_index()] if map_id_flag
 
-    def _readPDB(self, pdb_str: Optional[str], enforce_single_molecule: bool = True) -> None:
-        '''Read lines of PDB files'''
-        assert pdb_str is None or isinstance(pdb_str, str), type(pdb_str)
-
-        pdbDict = {}
-        for line in ([] if pdb_str is None else pdb_str.splitlines()):
-            # lines with atom coordinates
-            if line.startswith("ATOM") or line.startswith('HETATM'):
-                # split line for different fields
-                # it = line.split()
-                # in case of some fields are missing, read according to pdb standard
-                # if len(it) < 11:
-                it = [line[0:6], line[6:11], line[12:16], line[17:20],
-                      line[22:27], line[30:38], line[38:46], line[46:54], line[54:60],
-                      line[60:66], line[76:78]]
-                it = [i.strip() for i in it]
-                # store information that we are interested in. Refer to MoleculeData
-                # class for more details, also here we have a angstrom to nm conversion
-                pdbDict[int(it[1])] = {
-                    'index': int(it[1]),
-                    'symbol': it[2],
-                    'group': it[3],
-                    'coord': [float(it[5]) / 10., float(it[6]) / 10., float(it[7]) / 10.],
-                    'pdb': line.strip(),
-                    'type': it[-1].upper(),
-                }
-            # connectivity records
-            if line.startswith('CONECT'):
-                it = line.split()
-                for key, item in pdbDict.items():
-                    if key == int(it[1]):
-                        conn_list = []
-                        for i in it[2:6]:
-                            try:
-                                num = int(i)
-                                if num == 0:
-                                    break
-                                conn_list.append(num)
-                            except Exception:
-                                break
-                        if 'conn' in item:
-                            item['conn'].extend(conn_list)
-                        else:
-                            item['conn'] = conn_list
-                        break
+    def _readPDB(self, pdb_source: Optional[PDB_Source], enforce_single_molecule: bool = True) -> None:
+        '''Read lines of PDB files, from a str, a bytes buffer or a (text or binary) file object'''
+        assert pdb_source is None or isinstance(pdb_source, (str, bytes, bytearray, memoryview)) \
+            or hasattr(pdb_source, 'read'), type(pdb_source)
 
+        (pdbDict, conect) = ({}, {}) if pdb_source is None else PDB.read(pdb_source)
+        self._readPDBRecords(pdbDict, conect, enforce_single_molecule=enforce_single_molecule)
+
+    def _readPDBRecords(self, pdbDict: Dict[int, Atom], conect: Dict[int, List[int]],
+                        enforce_single_molecule: bool = True) -> None:
+        '''Atoms and bonds from ATOM/HETATM and CONECT records, as read by atb_outputs.pdb.read'''
         # make sure connectivity information is symmetric by simply mirroring connections
         # flag any orphan connectivities for removal
+        conn = {key: set() for key in pdbDict}
         orphanAtomReference = {}
-        for key in pdbDict:  # for each atom in pdb
-            if 'conn' in pdbDict[key]:  # if this atom lists connections to others
-                for conn in pdbDict[key]['conn']:  # for each connection to others
-                    if conn not in pdbDict:  # if it connects to a non-existent atom
-                        stderr.write("connectivity made from atom %s to non-existent atom %s!" % (key, conn))
-                        if key not in orphanAtomReference:
-                            orphanAtomReference[key] = [conn]
-                        else:
-                            orphanAtomReference[key].append(conn)
-                        continue
-                    if 'conn' in pdbDict[conn]:  # if the other atom has a list of connections
-                        pdbDict[conn]['conn'].append(key)  # append this atom to the end of the other atom's list
-                    else:
-                        pdbDict[conn]['conn'] = [key]  # create new list containing this atom
+        for (key, neighbours) in conect.items():  # for each atom listing connections to others
+            for neighbour in neighbours:
+                if neighbour not in conn:  # if it connects to a non-existent atom
+                    stderr.write("connectivity made from atom %s to non-existent atom %s!" % (key, neighbour))
+                    orphanAtomReference.setdefault(key, []).append(neighbour)
+                    continue
+                conn[key].add(neighbour)
+                conn[neighbour].add(key)
 
         # remove any orphan connection records
         for (k, connList) in orphanAtomReference.items():
             for c in connList:
-                pdbDict[k]["conn"].remove(c)
                 error_msg = "connectivity made from %s to non-existent atom %s removed" % (k, c)
 
                 stderr.write(error_msg)
                 raise MolDataFailure(error_msg)
 
-        has_connects = lambda atom: 'conn' in atom and atom['conn']
-        if not all(has_connects(atom) for atom in pdbDict.values()):
-            if len(pdbDict) == 1:
-                # Only single atom molecules are allowed to have no bonds
-                list(pdbDict.values())[0]['conn'] = []
-            else:
-                if enforce_single_molecule:
-                    raise MolDataFailure(
-                        'Mol_Data Error: Missing connectivities for atoms {0}'.format(
-                            [atom['index'] for atom in pdbDict.values() if not has_connects(atom)],
-                        ),
-                    )
-                else:
-                    pass
+        if not all(conn.values()) and len(pdbDict) > 1:
+            # Only single atom molecules are allowed to have no bonds
+            if enforce_single_molecule:
+                raise MolDataFailure(
+                    'Mol_Data Error: Missing connectivities for atoms {0}'.format(
+                        [atom['index'] for (key, atom) in pdbDict.items() if not conn[key]],
+                    ),
+                )
 
         # sort and unique connectivities
         for (ID, atom) in pdbDict.items():
-            atom['conn'] = sorted(set(atom['conn']))
+            atom['conn'] = sorted(conn[ID])
+            atom['id'] = ID
             for neighbour in atom['conn']:
                 self._addBondData(ID, neighbour)
 
         self.atoms = pdbDict
-        for (atom_id, atom) in self.atoms.items():
-            atom['id'] = atom_id
 
     def __str__(self) -> str:
         return 'MolData(atoms={0}, bonds={1})'.format(
@@ -266,41 +479,159 @@ class MolData(object):
         )
 
 
-def mol_data_from_mol_data_dict(mol_data_dict: Dict[str, Any]) -> MolData:
+def iter_mol_data(source: PDB_Source,
+                  log: Optional[Logger] = None,
+                  build_ring: bool = True,
+                  split_components: bool = False,
+                  compact: bool = False,
+                  on_failure: Optional[Callable[[int, MolDataFailure], None]] = None) -> Iterator[MolData]:
+    '''
+    Lazily yield one MolData per molecule of a PDB holding many, as MODEL/ENDMDL blocks or END terminated records (see
+    atb_outputs.pdb.iter_models). File objects are read line by line, and only one block is held at a time.
+    With split_components, each connected component of a block is yielded as a molecule of its own; otherwise each block
+    is read as MolData(block) would (so that, e.g., a block with an atom without any bonds fails).
+    Molecules that fail (MolDataFailure, or a malformed record) are reported to on_failure(block_number, failure),
+    with blocks numbered from 1, or else logged (or written to stderr), and the stream carries on.
+    '''
+    def report(block_number: int, failure: MolDataFailure) -> None:
+        if on_failure is not None:
+            on_failure(block_number, failure)
+        elif log:
+            log.warning('Molecule {0} skipped: {1}'.format(block_number, failure))
+        else:
+            stderr.write('Molecule {0} skipped: {1}\n'.format(block_number, failure))
+
+    for (block_number, (atoms, conect, error)) in enumerate(PDB.iter_models(source), start=1):
+        if error is not None:
+            report(block_number, MolDataFailure('Malformed PDB record: {0}'.format(error)))
+            continue
+        for (component_atoms, component_conect) in (
+            _connected_components(atoms, conect) if split_components else [(atoms, conect)]
+        ):
+            try:
+                mol_data = MolData(None, log=log, build_ring=build_ring)
+                mol_data._readPDBRecords(component_atoms, component_conect)
+            except MolDataFailure as failure:
+                report(block_number, failure)
+                continue
+            if compact:
+                mol_data.compact()
+            yield mol_data
+
+
+def _connected_components(atoms: Dict[int, Atom],
+                          conect: Dict[int, List[int]]) -> List[Tuple[Dict[int, Atom], Dict[int, List[int]]]]:
+    '''
+    Split PDB records into their connected components, keeping the order of the atoms.
+    Connections to unknown atoms stay with the atom listing them, so that reading that component fails as it should.
+    '''
+    neighbours = {serial: set() for serial in atoms}
+    for (serial, bonded) in conect.items():
+        for other in bonded:
+            if other in neighbours:
+                neighbours[serial].add(other)
+                neighbours[other].add(serial)
+
+    component_for_atom = {}
+    components = []
+    for serial in atoms:
+        if serial in component_for_atom:
+            continue
+        component_for_atom[serial] = len(components)
+        stack = [serial]
+        while stack:
+            for other in neighbours[stack.pop()]:
+                if other not in component_for_atom:
+                    component_for_atom[other] = len(components)
+                    stack.append(other)
+        components.append(({}, {}))
+
+    for (serial, atom) in atoms.items():
+        components[component_for_atom[serial]][0][serial] = atom
+    for (serial, bonded) in conect.items():
+        components[component_for_atom[serial]][1][serial] = bonded
+    return components
+
+
+def mol_data_from_mol_data_dict(mol_data_dict: Dict[str, Any], compact: bool = False) -> MolData:
     mol_data = MolData(None)
 
     for key in mol_data_dict.keys():
         setattr(mol_data, key, mol_data_dict[key])
 
-    return mol_data
-
+    if compact:
+        mol_data.compact()
 
-def build_rings(data: MolData, log: Optional[Logger] = None) -> Dict[int, Ring]:
-    def _is_ring_in_all_rings(ring: Any, all_rings: List[Any]) -> bool:
-        for existing_ring in all_rings.values():
-            if frozenset(existing_ring["atoms"]) == frozenset(ring):
-                return True
-        return False
+    return mol_data
 
-    all_rings = {}
-    ring_count = 1
-    mol_graph = _get_graph_dict(data.atoms)
 
-    # serialized_graph = []
-    # _serialize_weighted_graph(mol_graph,output=serialized_graph)
-    # log.debug("connectivity_graph:\n" + "\n".join(serialized_graph))
+def mol_data_from_columnar(path: str, compact: bool = False, mmap: bool = True) -> MolData:
+    '''
+    Read a mol_data_dict written by formats.columnar. The file is memory mapped (unless mmap is False) and atoms are
+    only turned into dicts as they are looked up, see atb_outputs.columnar.
+    '''
+    from atb_outputs.columnar import load
+    return mol_data_from_mol_data_dict(load(path, mmap=mmap), compact=compact)
+
+
+def mol_data_from_many_fdb_molecules(molecules: Iterable['FDBMolecule'], **batch_options: Any) -> Iterator['BatchResult']:
+    '''
+    Build a MolData from each of many FDBMolecules, yielding a BatchResult(index, mol_data, error, traceback) per
+    molecule, see MolData.from_many. Molecules are pickled to the worker processes, unless max_workers=1.
+    '''
+    from atb_outputs.batch import read_many
+    return read_many('fdb_molecule', molecules, **batch_options)
+
+
+def mol_data_from_many_mol_data_dicts(sources: Iterable[Any], **batch_options: Any) -> Iterator['BatchResult']:
+    '''
+    Batch version of mol_data_from_mol_data_dict, over a process pool: sources are mol_data_dicts or paths of YAML files
+    holding them. Yields a BatchResult(index, mol_data, error, traceback) per source, see MolData.from_many.
+    '''
+    from atb_outputs.batch import read_many
+    return read_many('mol_data_dict', sources, **batch_options)
+
+
+def build_rings(data: MolData, log: Optional[Logger] = None, relevant_cycles: bool = False) -> Dict[int, Ring]:
+    '''
+    Perceive the rings of a molecule from its connectivity.
+    By default this returns the smallest set of smallest rings (SSSR); with relevant_cycles=True, all relevant
+    cycles (the union of every possible SSSR) are returned instead, e.g. all three rings of bicyclo[2.2.2]octane.
+    Rings are numbered from 1, ordered by the first bond of data.bonds they contain (then by size), and their atoms
+    are listed in cycle order starting from that bond.
+    '''
+    (ids, adjacency) = adjacency_from_conn(data.atoms)
+    find_rings = find_relevant_cycles if relevant_cycles else smallest_set_of_smallest_rings
+
+    bond_positions = {}
+    for (position, bond) in enumerate(data.bonds):
+        bond_positions.setdefault(frozenset(bond["atoms"]), (position, tuple(bond["atoms"])))
+
+    def first_bond(ring: List[int]) -> Tuple[int, Tuple[int, int]]:
+        edges = [(ring[i], ring[(i + 1) % len(ring)]) for i in range(len(ring))]
+        return min(
+            bond_positions.get(frozenset(edge), (len(data.bonds), edge))
+            for edge in edges
+        )
 
-    for bond in data.bonds:
-        rings = _get_all_rings_for_bond(deepcopy(mol_graph), bond["atoms"])
-        for ring in rings:
-            if len(ring) == 2:
-                continue
-            ring = list(map(int, ring))
-            if not _is_ring_in_all_rings(ring, all_rings):
-                ring_dict = {"atoms": ring, "aromatic": False}
-                ring_dict["aromatic"] = is_ring_aromatic(data, ring_dict, log)
-                all_rings[ring_count] = ring_dict
-                ring_count += 1
+    def ring_from_bond(ring: List[int], bond_atoms: Tuple[int, int]) -> List[int]:
+        start = ring.index(bond_atoms[0])
+        ring = ring[start:] + ring[:start]
+        # Walk away from the second bond atom, so that the ring ends on it
+        return ring if ring[-1] == bond_atoms[1] else ring[:1] + ring[:0:-1]
+
+    rings = []
+    for cycle in find_rings(adjacency):
+        ring = [ids[i] for i in cycle]
+        (position, bond_atoms) = first_bond(ring)
+        rings.append((position, len(ring), ring_from_bond(ring, bond_atoms)))
+
+    all_rings = {
+        ring_count: {"atoms": list(map(int, ring)), "aromatic": False}
+        for (ring_count, (_, _, ring)) in enumerate(sorted(rings, key=lambda ring: ring[:2]), start=1)
+    }
+    for (ring_dict, classification) in zip(all_rings.values(), classify_rings(data, all_rings.values(), log)):
+        ring_dict["aromatic"] = classification.aromatic
     return all_rings
 
 
@@ -313,16 +644,130 @@ ACCEPTED_PLANAR_VALENCE_PER_ATOM_TYPE = {
 PLANAR_DISTANCE_TOL = 0.025
 
 
+RingClassification = namedtuple(
+    'RingClassification',
+    ['deviations', 'max_deviation', 'planar_geometry', 'planar_valences', 'aromatic'],
+)
+
+
+def classify_rings(data: MolData, rings: Iterable[Ring], log: Optional[Logger] = None) -> List[RingClassification]:
+    '''Planarity and aromaticity of the rings of a molecule, see classify_rings_of_molecules.'''
+    return classify_rings_of_molecules([(data, rings)], log)[0]
+
+
+def classify_rings_of_molecules(molecules: Iterable[Tuple[MolData, Iterable[Ring]]],
+                                log: Optional[Logger] = None) -> List[List[RingClassification]]:
+    '''
+    Classify the rings of many molecules at once, given as (data, rings) pairs.
+    All rings are fitted with least-squares planes in one batch (ring_plane_deviations). For each ring, this returns
+    the distances of its atoms from the plane (deviations) and their maximum, whether it has a planar geometry (at
+    least 4 atoms, all within PLANAR_DISTANCE_TOL of the plane), planar valences (ACCEPTED_PLANAR_VALENCE_PER_ATOM_TYPE;
+    only checked for rings with a planar geometry, None for the others) and is therefore aromatic.
+    '''
+    molecules = [(data, list(rings)) for (data, rings) in molecules]
+    sizes = [len(ring["atoms"]) for (_, rings) in molecules for ring in rings]
+    (deviations, max_deviations) = _fit_ring_planes(_ring_coordinates(molecules, sum(sizes)), sizes)
+    # Only rings within tolerance (usually few) are looked at one by one, for their valences and logging
+    within_tolerance = np.flatnonzero((np.asarray(sizes) >= 4) & (max_deviations <= PLANAR_DISTANCE_TOL)).tolist()
+    max_deviations = max_deviations.tolist()
+    planar_geometries = [False] * len(sizes)
+    planar_valences = [None] * len(sizes)
+    aromatic = [False] * len(sizes)
+    ring_positions = [(data, ring) for (data, rings) in molecules for ring in rings]
+    for position in within_tolerance:
+        (data, ring) = ring_positions[position]
+        planar_geometries[position] = _is_within_planar_tolerance(data, ring, max_deviations[position], log)
+        if planar_geometries[position]:
+            planar_valences[position] = aromatic[position] = has_ring_planar_valences(data, ring, log)
+    ring_classifications = list(map(
+        RingClassification, deviations, max_deviations, planar_geometries, planar_valences, aromatic,
+    ))
+
+    classifications = []
+    start = 0
+    for (_, rings) in molecules:
+        classifications.append(ring_classifications[start:start + len(rings)])
+        start += len(rings)
+    return classifications
+
+
+def _ring_coordinates(molecules: List[Tuple[MolData, List[Ring]]], n_atoms: int) -> np.ndarray:
+    '''(n_atoms, 3) array of the coordinates of the atoms of the rings of molecules, in order, read in one pass'''
+    def coordinates(data: MolData, rings: List[Ring]) -> Iterable[float]:
+        key = _ring_coordinate_key(data)
+        atom_ids = [atom_id for ring in rings for atom_id in ring["atoms"]]
+        store = data.coordinate_store() if data._coordinate_store is not None else None
+        if store is not None and store.array(key) is not None:
+            return store.array(key)[store.rows(atom_ids)].ravel().tolist()
+        return chain.from_iterable(map(itemgetter(key), map(data.atoms.__getitem__, atom_ids)))
+
+    return np.fromiter(
+        chain.from_iterable(coordinates(data, rings) for (data, rings) in molecules if rings),
+        dtype=np.float64, count=3 * n_atoms,
+    ).reshape(-1, 3)
+
+
+def ring_plane_deviations(ring_coordinates: List[np.ndarray]) -> List[np.ndarray]:
+    '''Distances of the atoms of each ring, given as an (n, 3) coordinate array, from the ring's least-squares plane.'''
+    if not ring_coordinates:
+        return []
+    return _fit_ring_planes(
+        np.concatenate(ring_coordinates),
+        [len(coordinates) for coordinates in ring_coordinates],
+    )[0]
+
+
+def _fit_ring_planes(coordinates: np.ndarray, sizes: List[int]) -> Tuple[List[np.ndarray], np.ndarray]:
+    '''
+    Least-squares planes of rings whose coordinates are concatenated in one (sum(sizes), 3) array.
+    Rings of equal size are stacked and fitted together: the normal of each plane is the eigenvector of the (3, 3)
+    scatter matrix of the centred coordinates with the smallest eigenvalue (one stacked np.linalg.eigh per size).
+    Returns the per-ring distances from the plane and their maxima (0 for rings of less than 3 atoms).
+    '''
+    sizes = np.asarray(sizes, dtype=np.intp)
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.intp)
+    deviations = [None] * len(sizes)
+    max_deviations = np.zeros(len(sizes))
+    for size in np.unique(sizes):
+        positions = np.flatnonzero(sizes == size)
+        if size < 3:
+            for position in positions.tolist():
+                deviations[position] = np.zeros(size)
+            continue
+        stacked = coordinates[offsets[positions, None] + np.arange(size)]
+        centred = stacked - stacked.mean(axis=1, keepdims=True)
+        # Eigenvalues come in ascending order
+        normals = np.linalg.eigh(np.matmul(centred.transpose(0, 2, 1), centred))[1][:, :, 0]
+        distances = np.abs(np.einsum('rij,rj->ri', centred, normals))
+        max_deviations[positions] = distances.max(axis=1)
+        for (position, ring_distances) in zip(positions.tolist(), distances):
+            deviations[position] = ring_distances
+    return deviations, max_deviations
+
+
+def _ring_coordinate_key(data: MolData) -> str:
+    return "ocoord" if "ocoord" in next(iter(data.atoms.values())) else "coord"
+
+
+def _is_within_planar_tolerance(data: MolData, ring: Ring, max_deviation: float, log: Optional[Logger]) -> bool:
+    if max_deviation > PLANAR_DISTANCE_TOL:
+        return False
+    if log:
+        log.debug(
+            "Maximum distance to plane is {0:.3f}nm ({1})".format(
+                max_deviation,
+                [data[x]["symbol"] for x in ring["atoms"]],
+            ),
+        )
+    return True
+
+
 def is_ring_aromatic(data: MolData, ring: Ring, log: Logger) -> bool:
-    return has_ring_planar_geometry(data, ring, log) and has_ring_planar_valences(data, ring, log)
+    return classify_rings(data, [ring], log)[0].aromatic
 
 
 def has_ring_planar_geometry(data: MolData, ring: Ring, log: Logger) -> bool:
-    if len(ring["atoms"]) < 4:
-        return False
-    else:
-        # Get dihedral atoms
-        return is_ring_planar(data, ring, log)
+    return classify_rings(data, [ring], log)[0].planar_geometry
 
 
 def has_ring_planar_valences(data: MolData, ring: Ring, log: Logger) -> bool:
@@ -358,76 +803,5 @@ def _serialize_weighted_graph(G: Any, indent: str = "", output: List[Any] = [])
 
 
 def is_ring_planar(data: MolData, ring: Ring, log: Logger) -> bool:
-    atoms = data.atoms
-    coord_type = "ocoord" if "ocoord" in list(atoms.values())[0] else "coord"
-
-    ring_atoms = [atoms[atom_id] for atom_id in ring["atoms"]]
-    A, B, C, D = equation_of_plane(
-        ring_atoms[0][coord_type],
-        ring_atoms[1][coord_type],
-        ring_atoms[2][coord_type],
-    )
-    max_distance = 0
-    for atom in ring_atoms[3:]:
-        distance = _distance_from_plane(A, B, C, D, atom[coord_type])
-        max_distance = max(abs(distance), max_distance)
-        if abs(distance) > PLANAR_DISTANCE_TOL:
-            return False
-    if log:
-        log.debug(
-            "Maximum distance to plane is {0:.3f}nm ({1})".format(
-                max_distance,
-                [data[x]["symbol"] for x in ring["atoms"]],
-            ),
-        )
-    return True
-
-
-def equation_of_plane(a0: Coordinate, a1: Coordinate, a2: Coordinate) -> Tuple[float, float, float, float]:
-    det1 = ((a1[1] - a0[1]) * (a2[2] - a0[2])) - ((a2[1] - a0[1]) * (a1[2] - a0[2]))
-    det2 = ((a1[2] - a0[2]) * (a2[0] - a0[0])) - ((a2[2] - a0[2]) * (a1[0] - a0[0]))
-    det3 = ((a1[0] - a0[0]) * (a2[1] - a0[1])) - ((a2[0] - a0[0]) * (a1[1] - a0[1]))
-    D = det1 * a0[0] + det2 * a0[1] + det3 * a0[2]
-    D = -D
-    return (det1, det2, det3, D)
-
-
-def _distance_from_plane(A: float, B: float, C: float, D: float, pt: Coordinate) -> float:
-    x, y, z = pt
-    denom = sqrt(A ** 2 + B ** 2 + C ** 2)
-    if not denom: return 0
-    numer = A * x + B * y + C * z + D
-    distance = numer / denom
-    return distance
-
-
-def _get_all_rings_for_bond(mol_graph: Any, bond_atom_ids: Any) -> List[Any]:
-    i0 = str(bond_atom_ids[0])
-    i1 = str(bond_atom_ids[1])
-    all_rings = []
-    mol_graph[i0][i1] = 999
-    found = True
-    while found:
-        found = False
-        ring = shortestPath(
-            mol_graph,
-            i0,
-            i1,
-        )
-        if not ring in all_rings:
-            all_rings.append(ring)
-            found = True
-            for i in range(len(ring) - 1):
-                mol_graph[ring[i]][ring[i + 1]] = 2
-    mol_graph[i0][i1] = 1
-    return all_rings
-
-
-def _get_graph_dict(atoms: Dict[int, Atom]) -> Dict[str, Atom]:
-    G = {}
-    for (atom_id, atom) in atoms.items():
-        tmp = {}
-        for i in atom["conn"]:
-            tmp[str(i)] = 1
-        G[str(atom_id)] = tmp
-    return G
+    '''Whether all atoms of ring are within PLANAR_DISTANCE_TOL of its least-squares plane (see classify_rings).'''
+    return _is_within_planar_tolerance(data, ring, classify_rings(data, [ring])[0].max_deviation, log)
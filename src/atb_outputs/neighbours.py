@@ -0,0 +1,111 @@
+'''
+Neighbour shells (1-2, 1-3 and 1-4 neighbours) of all the atoms of a molecule at once, as used for the pairs and
+exclusions of topologies (see itp.calculate_1_4_neighbours).
+
+The connectivity is laid out as a compressed sparse row (CSR) adjacency over the positions of the atoms, and each shell
+is a sorted array of (atom, neighbour) pairs, encoded as atom * n_atoms + neighbour. A shell is grown from the previous
+one by following the adjacency from each of its pairs' neighbours (in bulk, with numpy), and the pairs of the shells
+before it are removed: the 1-3 neighbours of an atom are the neighbours of its 1-2 neighbours which are not 1-2
+neighbours themselves (the atom itself being one of them), the 1-4 neighbours the neighbours of its 1-3 neighbours which
+are neither 1-2 nor 1-3 neighbours. This takes time in proportion to the number of paths of three bonds, so linear in the
+number of atoms for bounded valences.
+
+As in the atom by atom search this replaced, an atom is one of its own 1-3 neighbours (through any of its 1-2
+neighbours), so that it is never one of its 1-4 neighbours (through a three membered ring). These self pairs are only
+kept within the shells: pairs and neighbours leave them out.
+'''
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# Shells: 1-2, 1-3 and 1-4 neighbours
+MAX_DISTANCE = 3
+
+
+def _unique(codes: np.ndarray) -> np.ndarray:
+    '''Sorted unique codes (np.unique, which hashes large integers in recent numpy versions, is slower)'''
+    codes = np.sort(codes)
+    if len(codes):
+        codes = codes[np.concatenate(([True], codes[1:] != codes[:-1]))]
+    return codes
+
+
+def _difference(codes: np.ndarray, sorted_codes: np.ndarray) -> np.ndarray:
+    '''The codes not in sorted_codes, in order'''
+    if not len(sorted_codes):
+        return codes
+    positions = np.minimum(np.searchsorted(sorted_codes, codes), len(sorted_codes) - 1)
+    return codes[sorted_codes[positions] != codes]
+
+
+class NeighbourShells(object):
+    '''
+    Shells of the atoms of conn, a mapping of each atom (by index, or uindex) to the indexes of its neighbours, as
+    given by UnitedAtomView.topology_conn. Neighbours are followed as listed (conn need not be symmetric).
+    '''
+
+    def __init__(self, conn: Dict[int, List[int]]) -> None:
+        self.indexes = np.array(list(conn), dtype=np.int64)
+        self.n_atoms = n_atoms = len(self.indexes)
+        position_for_index = {index: position for (position, index) in enumerate(conn)}
+        self._degrees = np.array([len(neighbours) for neighbours in conn.values()], dtype=np.int64)
+        self._offsets = np.zeros(n_atoms + 1, dtype=np.int64)
+        np.cumsum(self._degrees, out=self._offsets[1:])
+        self._targets = np.array(
+            [position_for_index[index] for neighbours in conn.values() for index in neighbours], dtype=np.int64,
+        )
+        first = _unique(np.repeat(np.arange(n_atoms, dtype=np.int64), self._degrees) * n_atoms + self._targets)
+        self._shells = [first]
+        seen = first
+        for _ in range(1, MAX_DISTANCE):
+            shell = _difference(self._expand(self._shells[-1]), seen)
+            self._shells.append(shell)
+            # Shells are disjoint
+            seen = np.sort(np.concatenate((seen, shell)))
+
+    def _expand(self, codes: np.ndarray) -> np.ndarray:
+        '''Sorted, unique codes of (atom, t) for each t adjacent to the neighbour of a pair (atom, neighbour) of codes'''
+        (atoms, neighbours) = np.divmod(codes, max(self.n_atoms, 1))
+        counts = self._degrees[neighbours]
+        total = int(counts.sum())
+        if not total:
+            return np.zeros(0, dtype=np.int64)
+        # Position in _targets of each adjacency followed: the start of the neighbour's row, plus the rank in the row
+        ends = np.cumsum(counts)
+        ranks = np.arange(total, dtype=np.int64) - np.repeat(ends - counts, counts)
+        targets = self._targets[np.repeat(self._offsets[neighbours], counts) + ranks]
+        return _unique(np.repeat(atoms, counts) * self.n_atoms + targets)
+
+    def _pairs(self, distance: int, upper: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        assert 1 <= distance <= MAX_DISTANCE, distance
+        (atoms, neighbours) = np.divmod(self._shells[distance - 1], max(self.n_atoms, 1))
+        # Self pairs are left out
+        keep = atoms != neighbours
+        (atoms, neighbours) = (atoms[keep], neighbours[keep])
+        (indexes, neighbour_indexes) = (self.indexes[atoms], self.indexes[neighbours])
+        if upper:
+            keep = neighbour_indexes > indexes
+            (atoms, indexes, neighbour_indexes) = (atoms[keep], indexes[keep], neighbour_indexes[keep])
+        order = np.lexsort((neighbour_indexes, atoms))
+        return (atoms[order], indexes[order], neighbour_indexes[order])
+
+    def pairs(self, distance: int, upper: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        (indexes, neighbour indexes) of the 1-(distance + 1) neighbours, by atom in conn order then by neighbour index,
+        other than the atom itself; with upper=True, only those with a neighbour index above the index of the atom.
+        '''
+        (_, indexes, neighbour_indexes) = self._pairs(distance, upper)
+        return (indexes, neighbour_indexes)
+
+    def neighbours(self, distance: int, upper: bool = False) -> Dict[int, List[int]]:
+        '''
+        The neighbour indexes of pairs(distance, upper) of each atom of conn (empty lists for none), keyed in conn order:
+        by (u)index for UnitedAtomView.topology_conn, whatever the order of the atoms of the molecule.
+        '''
+        (atoms, _, neighbour_indexes) = self._pairs(distance, upper)
+        ends = np.cumsum(np.bincount(atoms, minlength=self.n_atoms)).tolist()
+        neighbour_indexes = neighbour_indexes.tolist()
+        return {
+            index: neighbour_indexes[start:end]
+            for (index, start, end) in zip(self.indexes.tolist(), [0] + ends, ends)
+        }
@@ -1,5 +1,8 @@
 from datetime import date
 from functools import reduce
+from io import StringIO, BytesIO, TextIOWrapper
+
+from atb_outputs.fixed_width import format_blocks
 
 def header(data, io, rev_date="", united=False):
         # Write header
@@ -15,42 +18,163 @@ def header(data, io, rev_date="", united=False):
         print('AUTHOR'+4*' '+'AUTOMATED TOPOLOGY BUILDER (ATB) REVISION ' + rev_date, file=io)
         print('AUTHOR'+3*' '+'2'+'  https://atb.uq.edu.au', file=io)
 
-def atoms(data, io, atoms, united=False, optimized=True, use_rnme=True):
+def coordinate_key(data, optimized=True):
+        return 'ocoord' if optimized and data.completed('has_ocoord') else 'coord'
+
+# ATOM/HETATM record: record name, serial, atom name, residue name, x, y, z (Angstrom), then the columns from 55 on
+ATOM_LINE_FORMAT = '%s%5d%5s %-4s    0    %8.3f%8.3f%8.3f%s\n'
+
+def atoms(data, io, atoms, united=False, optimized=True, use_rnme=True, view=None, coords=None):
         # Write structure
-        for i in atoms:
-            if united:
-                if 'uindex' not in i: continue
-                index = i['uindex']
-            else:
-                index = i['index']
-            if optimized and data.completed('has_ocoord'):
-                coord = [j*10. for j in i['ocoord']]
-            else:
-                coord = [j*10. for j in i['coord']]
-            if use_rnme:
-                rnme = data.var['rnme']
-            else:
-                rnme = i['group']
-            print(i['pdb'][:6] + '%5d' %index + "{:>5} ".format(i["symbol"]) + \
-                    '%-4s' %rnme + "    0    " + \
-                    '%8.3f' %coord[0] + '%8.3f' %coord[1] + '%8.3f' %coord[2] +\
-                    i['pdb'][54:], file=io)
+        # atoms taken from a UnitedAtomView (view) are already filtered
+        # coords, if given, is the (N, 3) array of the coordinates (nm) of atoms, see coordinate_key
+        if united and view is None:
+            atoms = [i for i in atoms if 'uindex' in i]
+        if coords is None:
+            atom_ids = view.ids if view is not None and atoms is view.atoms else [i['id'] for i in atoms]
+            coords = data.coordinate_array(coordinate_key(data, optimized), atom_ids)
+        # Record names and the columns after the coordinates are kept from the records read
+        columns = [
+            [i['pdb'][:6] for i in atoms],
+            [i['uindex'] if united else i['index'] for i in atoms],
+            [i['symbol'] for i in atoms],
+            data.var['rnme'] if use_rnme else [i['group'] for i in atoms],
+            coords * 10.,
+            [i['pdb'][54:] for i in atoms],
+        ]
+        for block in format_blocks(ATOM_LINE_FORMAT, columns, len(atoms)):
+            io.write(block)
 
-def connectivity(data, io, atoms, united=False):
+def connectivity(data, io, atoms, united=False, view=None):
         # Write connectivity
+        # With a UnitedAtomView (view), neighbours are looked up in its precomputed connectivity
         for i in atoms:
             if united:
                 if 'uindex' not in i: continue
-                nbr = sorted([data[n]['uindex'] \
-                        for n in i['conn'] if 'uindex' in data[n]])
+                if view is not None:
+                    nbr = view.conn[i['id']]
+                else:
+                    nbr = sorted([data[n]['uindex'] \
+                            for n in i['conn'] if 'uindex' in data[n]])
                 if len(nbr) == 0: continue
                 neighborstr = reduce(lambda x,y:x+y, ['%5s' %n for n in nbr], '')
                 print("CONECT" + '%5d' %i['uindex'] + neighborstr, file=io)
             else:
                 #sort connectivity
-                nbr = sorted([data[n]['index'] for n in i['conn']])
+                if view is not None:
+                    nbr = view.conn[i['id']]
+                else:
+                    nbr = sorted([data[n]['index'] for n in i['conn']])
                 neighborstr = reduce(lambda x,y:x+y, ['%5s' %n for n in nbr], '')
                 print("CONECT" + '%5d' %i['index'] + neighborstr, file=io)
 
 def footer(data, io):
         print('END', file=io)
+
+def iter_lines(source):
+        '''Lazily iterate over the lines of a PDB str, bytes buffer or (text or binary) file object, without line endings'''
+        if isinstance(source, str):
+            source = StringIO(source, newline=None)
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            source = TextIOWrapper(BytesIO(source), encoding='utf-8', newline=None)
+        for line in source:
+            if isinstance(line, (bytes, bytearray)):
+                line = line.decode('utf-8')
+            yield line.rstrip('\r\n')
+
+def conect_fields(line):
+        '''
+        Split a CONECT record into ['CONECT', atom, neighbours...].
+        Serial numbers above 9999 fill their whole 5 column field and run into each other (and into the record name),
+        so lines with such fields are read by column instead of split on whitespace.
+        '''
+        it = line.split()
+        if it[0] == 'CONECT' and all(len(field) <= 5 for field in it[1:]):
+            return it
+        return [line[0:6]] + [line[i:i + 5].strip() for i in range(6, len(line.rstrip()), 5)]
+
+def conect_neighbours(it):
+        '''Neighbours listed in the (at most 4) bonded atom fields of split CONECT record, up to the first blank or 0'''
+        neighbours = []
+        for i in it[2:6]:
+            try:
+                num = int(i)
+            except ValueError:
+                break
+            if num == 0:
+                break
+            neighbours.append(num)
+        return neighbours
+
+def read(source):
+        '''
+        Read the ATOM/HETATM and CONECT records of a PDB in a single pass over its lines (see iter_lines for the
+        accepted sources). Coordinates are converted from Angstrom to nm.
+        Returns (atoms, conect): atoms maps serial numbers to atom dicts; conect maps serial numbers to the neighbours
+        listed in their CONECT records, as written (not symmetrised, possibly referring to unknown atoms).
+        CONECT records are only matched against atoms read before them.
+        '''
+        (atoms, conect, error, _) = _read_records(iter_lines(source), split_models=False)
+        if error is not None:
+            raise error
+        return atoms, conect
+
+def iter_models(source):
+        '''
+        Lazily read a PDB holding several molecules, as MODEL/ENDMDL blocks or as records terminated by END, yielding
+        (atoms, conect, error) for each block with atoms (see read). Only the current block is held in memory, and
+        CONECT records only apply to the atoms of their own block.
+        A block with a malformed record is yielded with atoms and conect set to None and the ValueError raised while
+        reading it, and reading carries on with the next block.
+        '''
+        lines = iter_lines(source)
+        exhausted = False
+        while not exhausted:
+            (atoms, conect, error, exhausted) = _read_records(lines, split_models=True)
+            if error is not None:
+                yield None, None, error
+            elif atoms:
+                yield atoms, conect, None
+
+def _read_records(lines, split_models=False):
+        '''
+        Read records from an iterator of lines, up to the end of the current model if split_models: an ENDMDL or END
+        record, or a MODEL record following atoms (which is consumed as well).
+        Returns (atoms, conect, error, exhausted); after a ValueError (error), the rest of the model is skipped.
+        '''
+        atoms, conect = {}, {}
+        error = None
+
+        exhausted = True
+        for line in lines:
+            if split_models and (
+                line.startswith('ENDMDL') or line[:6].rstrip() == 'END' or (line.startswith('MODEL') and atoms)
+            ):
+                exhausted = False
+                break
+            if error is not None:
+                continue
+            try:
+                if line.startswith('ATOM') or line.startswith('HETATM'):
+                    serial = int(line[6:11])
+                    atom = {
+                        'index': serial,
+                        'symbol': line[12:16].strip(),
+                        'group': line[17:20].strip(),
+                        'coord': [float(line[30:38]) / 10., float(line[38:46]) / 10., float(line[46:54]) / 10.],
+                        'pdb': line.strip(),
+                        'type': line[76:78].strip().upper(),
+                    }
+                    atoms[serial] = atom
+                    # A record redefining an atom drops the connectivity read for it so far
+                    conect.pop(serial, None)
+                elif line.startswith('CONECT'):
+                    it = conect_fields(line)
+                    serial = int(it[1])
+                    if serial in atoms:
+                        conect.setdefault(serial, []).extend(conect_neighbours(it))
+            except ValueError as e:
+                error = e
+                if not split_models:
+                    break
+        return atoms, conect, error, exhausted
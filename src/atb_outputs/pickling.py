@@ -0,0 +1,117 @@
+'''
+Compact pickling of MolData (see MolData.__reduce__).
+
+Derived data (index maps, united atom views, the coordinate store itself) is left out, and lists and dicts of
+records (atoms, bonds, angles, dihedrals, ...) are stored column by column as numpy arrays (see
+columnar.encode_records): charges and other numeric fields as typed arrays, connectivities and term atoms in CSR form.
+The 'coord' and 'ocoord' arrays of a current coordinate store are stored as they are, and adopted by the coordinate
+store of the unpickled molecule. Records come back as equal copies: objects shared between them (or with other
+attributes) are no longer shared after unpickling.
+
+With pickle protocol 5 and a buffer_callback, all these arrays travel out of band, as PickleBuffers, instead of being
+copied into the pickle (see dumps and loads); with other protocols they are pickled in band, as bytes.
+'''
+import pickle
+from pickle import PickleBuffer
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from atb_outputs import columnar
+from atb_outputs.coordinates import COORDINATE_KEYS, CoordinateStore
+from atb_outputs.mol_data import MolData
+from atb_outputs.records import Atom as AtomRecord, Bond as BondRecord
+
+PROTOCOL = 5
+
+# Derived data that MolData rebuilds on demand
+CACHED_ATTRIBUTES = ('_id_for_index', '_id_for_uindex', '_bond_for_atoms', '_united_atom_views', '_coordinate_store')
+
+RECORD_TYPES = {'dict': dict, 'atom': AtomRecord, 'bond': BondRecord}
+
+
+def _pack_records(records: List[Any], ids: Optional[List[int]], left_out: Iterable[str] = ()) -> Optional[Tuple]:
+    '''(record type, ids, spec, arrays) for records all of the same type (see RECORD_TYPES), or None.'''
+    types = set(map(type, records))
+    if types <= {dict}:
+        record_type = 'dict'
+    elif types == {AtomRecord}:
+        record_type = 'atom'
+    elif types == {BondRecord}:
+        record_type = 'bond'
+    else:
+        return None
+    left_out = frozenset(left_out)
+    plain = [
+        {key: value for (key, value) in record.items() if key not in left_out}
+        if record_type == 'dict' else
+        {key: value for (key, value) in record.as_dict().items() if key not in left_out}
+        for record in records
+    ]
+    if ids is not None and (not all(type(i) is int for i in ids) or not columnar._fits_int64(ids or [0])):
+        return None
+    (spec, arrays) = columnar.encode_records(plain)
+    return (record_type, np.array(ids, dtype=np.int64) if ids is not None else None, spec, arrays)
+
+
+def _unpack_records(packed: Tuple) -> Any:
+    (record_type, ids, spec, arrays) = packed
+    records = columnar.decode_records(spec, arrays)
+    if record_type != 'dict':
+        records = [RECORD_TYPES[record_type](record) for record in records]
+    return records if ids is None else dict(zip(ids.tolist(), records))
+
+
+def mol_data_state(mol_data: MolData) -> Dict[str, Any]:
+    attributes = {key: value for (key, value) in vars(mol_data).items() if key not in CACHED_ATTRIBUTES}
+
+    coordinates = {}
+    store = vars(mol_data).get('_coordinate_store')
+    if store is not None and store.is_current(mol_data.atoms):
+        coordinates = {key: store.array(key) for key in COORDINATE_KEYS if store.array(key) is not None}
+
+    packed = {}
+    for (key, value) in list(attributes.items()):
+        if type(value) is dict and value and all(isinstance(record, (dict, AtomRecord)) for record in value.values()):
+            packed_value = _pack_records(
+                list(value.values()), list(value), left_out=coordinates if key == '_atoms' else (),
+            )
+        elif type(value) is list and value and all(isinstance(record, (dict, BondRecord)) for record in value):
+            packed_value = _pack_records(value, None)
+        else:
+            packed_value = None
+        if packed_value is not None:
+            packed[key] = packed_value
+            del attributes[key]
+    return {'attributes': attributes, 'records': packed, 'coordinates': coordinates}
+
+
+def restore_mol_data(cls: type, state: Dict[str, Any]) -> MolData:
+    mol_data = cls.__new__(cls)
+    attributes = dict(state['attributes'])
+    for (key, packed) in state['records'].items():
+        attributes[key] = _unpack_records(packed)
+    mol_data.__setstate__(attributes)
+    if state['coordinates']:
+        # Out of band buffers may be read only; the store's arrays are written through by atom coordinate updates
+        arrays = {
+            key: array if array.flags.writeable else array.copy()
+            for (key, array) in state['coordinates'].items()
+        }
+        mol_data._coordinate_store = CoordinateStore(mol_data.atoms, arrays=arrays)
+    return mol_data
+
+
+def dumps(mol_data: MolData) -> Tuple[bytes, List[PickleBuffer]]:
+    '''Pickle mol_data with protocol 5, returning the pickle and its out of band buffers (see loads).'''
+    buffers = []
+    return pickle.dumps(mol_data, protocol=PROTOCOL, buffer_callback=buffers.append), buffers
+
+
+def loads(data: bytes, buffers: Iterable[Any] = ()) -> MolData:
+    '''
+    Unpickle a MolData from dumps. buffers are the PickleBuffers (or any buffers holding the same bytes, e.g. received
+    from another process) in the order dumps gave them. Coordinate arrays are views onto them, or copies of read only
+    ones.
+    '''
+    return pickle.loads(data, buffers=buffers)
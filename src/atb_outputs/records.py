@@ -0,0 +1,164 @@
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+
+from atb_outputs.coordinates import COORDINATE_KEYS
+
+
+class Record(MutableMapping):
+    '''
+    Compact, dict-like record: the usual fields of a term live in __slots__, anything else in a lazily created
+    `_extra` dict, so that writers can keep using record['symbol'], 'uindex' in record, record.get(...), etc.
+    Fields listed in TUPLE_FIELDS are stored as tuples (as_dict() gives them back as lists).
+    '''
+    __slots__ = ('_extra',)
+
+    FIELDS = ()
+    TUPLE_FIELDS = frozenset()
+    _field_set = frozenset()
+
+    def __init__(self, fields: Optional[Mapping] = None) -> None:
+        self._extra = None
+        if fields is not None:
+            for (key, value) in fields.items():
+                self[key] = value
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self._field_set:
+            setattr(self, key, tuple(value) if key in self.TUPLE_FIELDS and isinstance(value, list) else value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self._field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key: Any) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.FIELDS:
+            if key in self:
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.as_dict() == (other.as_dict() if isinstance(other, Record) else dict(other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return '{0}({1!r})'.format(type(self).__name__, self.as_dict())
+
+    def as_dict(self) -> Dict[str, Any]:
+        '''Plain dict copy of the record, with tuple fields as lists and coordinates as lists of floats.'''
+        return {
+            key: list(value) if key in self.TUPLE_FIELDS and isinstance(value, tuple) else value
+            for (key, value) in self.items()
+        }
+
+
+ATOM_FIELDS = (
+    'id', 'index', 'uindex', 'symbol', 'type', 'group', 'pdb', 'coord', 'ocoord', 'conn', 'uconn',
+    'charge', 'ucharge', 'formal_charge', 'cgroup', 'mass', 'umass', 'mass_code', 'umass_code',
+    'ljsym', 'uljsym', 'iacm', 'uiacm', 'icgm', 'uicgm', 'excl', 'uexcl',
+    'equivalenceGroup', 'aromatic', 'united', 'type_energy',
+)
+
+BOND_FIELDS = ('atoms', 'code', 'value', 'fc', 'hfc', 'order', 'order_qm', 'aromatic', 'united')
+
+
+class Atom(Record):
+    '''
+    Atom record. Once a CoordinateStore adopts it, 'coord' and 'ocoord' are read from (and written to) a row of the
+    store's arrays instead of being held by the atom.
+    '''
+    __slots__ = ATOM_FIELDS + ('_coord_array', '_ocoord_array', '_row')
+
+    FIELDS = ATOM_FIELDS
+    TUPLE_FIELDS = frozenset(('conn', 'uconn', 'excl', 'uexcl'))
+    _field_set = frozenset(ATOM_FIELDS)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in COORDINATE_KEYS:
+            array = getattr(self, '_' + key + '_array', None)
+            if array is not None:
+                return array[self._row]
+        return Record.__getitem__(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in COORDINATE_KEYS:
+            array = getattr(self, '_' + key + '_array', None)
+            if array is not None:
+                if np.shape(value) == (3,):
+                    array[self._row] = value
+                    return
+                setattr(self, '_' + key + '_array', None)
+        Record.__setitem__(self, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        if key in COORDINATE_KEYS and getattr(self, '_' + key + '_array', None) is not None:
+            setattr(self, '_' + key + '_array', None)
+            return
+        Record.__delitem__(self, key)
+
+    def as_dict(self) -> Dict[str, Any]:
+        atom = Record.as_dict(self)
+        for key in COORDINATE_KEYS:
+            if isinstance(atom.get(key), np.ndarray):
+                atom[key] = atom[key].tolist()
+        return atom
+
+    def adopt_coordinate(self, key: str, array: np.ndarray, row: int) -> None:
+        '''Hand the atom's coordinate for key over to row of array.'''
+        setattr(self, '_' + key + '_array', array)
+        self._row = row
+        try:
+            delattr(self, key)
+        except AttributeError:
+            pass
+
+    def is_backed_by(self, key: str, array: np.ndarray, row: int) -> bool:
+        return getattr(self, '_' + key + '_array', None) is array and self._row == row
+
+
+class Bond(Record):
+    __slots__ = BOND_FIELDS
+
+    FIELDS = BOND_FIELDS
+    TUPLE_FIELDS = frozenset(('atoms',))
+    _field_set = frozenset(BOND_FIELDS)
+
+
+def as_plain_dict(record: Mapping) -> Dict[str, Any]:
+    return record.as_dict() if isinstance(record, Record) else record
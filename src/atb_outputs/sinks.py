@@ -0,0 +1,51 @@
+'''
+Sinks for the streaming writers (formats.write_*, itp.write_itp, lgf.write_graph): any writable text or binary file
+object, e.g. an open file, a socket's makefile('wb') or a gzip, bz2 or lzma stream. Text written to a binary sink is
+UTF-8 encoded, without newline translation, so that it holds the same bytes as the string returned by the matching
+string writer. Sinks are left open.
+'''
+from contextlib import contextmanager
+from io import BufferedIOBase, BufferedWriter, RawIOBase, TextIOBase, TextIOWrapper
+from typing import Any, Iterator
+
+ENCODING = 'utf-8'
+
+
+def is_text_sink(sink: Any) -> bool:
+    '''Whether sink takes str (rather than bytes); file objects of unknown type are taken by their mode, if any.'''
+    if isinstance(sink, TextIOBase):
+        return True
+    if isinstance(sink, (RawIOBase, BufferedIOBase)):
+        return False
+    mode = getattr(sink, 'mode', None)
+    return 'b' not in mode if isinstance(mode, str) else True
+
+
+@contextmanager
+def text_sink(sink: Any) -> Iterator[Any]:
+    '''Text file handle onto sink: sink itself if it takes str, or else a wrapper, flushed and detached on exit.'''
+    if is_text_sink(sink):
+        yield sink
+        return
+    # Unbuffered (raw) sinks can write partially, which a buffer takes care of
+    buffer = BufferedWriter(sink) if isinstance(sink, RawIOBase) else sink
+    wrapper = TextIOWrapper(buffer, encoding=ENCODING, newline='')
+    try:
+        yield wrapper
+    finally:
+        wrapper.flush()
+        wrapper.detach()
+        if buffer is not sink:
+            buffer.flush()
+            buffer.detach()
+
+
+def binary_sink(sink: Any) -> Any:
+    '''Binary file handle onto sink: sink itself, or the (flushed) underlying buffer of a text file handle.'''
+    if not is_text_sink(sink):
+        return sink
+    buffer = getattr(sink, 'buffer', None)
+    if buffer is None:
+        raise TypeError('Binary output cannot be written to a text sink without a buffer: {0}'.format(type(sink).__name__))
+    sink.flush()
+    return buffer
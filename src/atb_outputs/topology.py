@@ -0,0 +1,101 @@
+'''
+GROMACS system topologies (.top) of mixtures of molecules, given as (MolData, count) pairs: the forcefield include, a
+[ moleculetype ] (see itp.itp) per distinct species, then the [ system ] and [ molecules ] sections.
+
+Species are told apart by a digest of what the itp of a molecule is made of (see topology_digest): its residue name, the
+itp fields of its atoms (not their coordinates) and its bonds, angles, impropers and dihedrals. The itp of each species
+is rendered once, when first met, and written out straight away, so that time and memory grow with the number of
+species (and of [ molecules ] entries) rather than with the number of instances. A MolData passed several times in a
+row is only digested once. Equal topologies held differently (compact atom records and plain dicts, say) can digest differently;
+species with the same residue name are then told apart by their itps.
+'''
+from io import StringIO
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from atb_outputs.cache import ITP_ATOM_FIELDS, field_digest
+from atb_outputs.helpers.types_helpers import MolData
+from atb_outputs.sinks import text_sink
+import atb_outputs.itp as ITP
+
+DEFAULT_FORCEFIELD = 'gromos54a7_atb.ff/forcefield.itp'
+
+ITP_TERMS = ('bonds', 'angles', 'impropers', 'dihedrals')
+
+
+def topology_digest(mol_data: MolData, united: bool = False) -> str:
+    '''
+    Digest of what the itp of mol_data (in the united or all-atom representation) is made of: molecules with the same
+    digest have the same [ moleculetype ].
+    '''
+    return field_digest([
+        united,
+        mol_data.var['rnme'],
+        [
+            # Ellipsis for missing fields, which are not the same as fields set to None
+            [atom.get(field, Ellipsis) for field in ITP_ATOM_FIELDS]
+            for (_, atom) in sorted(mol_data.atoms.items())
+        ],
+        [getattr(mol_data, name) for name in ITP_TERMS],
+    ])
+
+
+def write_system_topology(molecules: Iterable[Tuple[MolData, int]], io: Any, system_name: str = 'System',
+                          united: bool = False, forcefield: Optional[str] = DEFAULT_FORCEFIELD,
+                          cache: Any = None) -> Dict[str, int]:
+    '''
+    Stream the system topology of molecules, (MolData, count) pairs in the order of the coordinates of the system, to a
+    text or binary sink (see atb_outputs.sinks), returning the number of instances of each species, by residue name.
+    Consecutive pairs of the same species make a single [ molecules ] entry.
+    forcefield is the file #included first (None for none). If cache (a cache.OutputCache) is given, itps are rendered
+    through it. Raises ValueError for distinct species with the same residue name, which GROMACS could not tell apart.
+    '''
+    target = 'itp_united' if united else 'itp'
+    (last_mol_data, last_digest) = (None, None)
+    name_for_digest, itp_for_name = {}, {}
+    # [ molecules ] entries: [name, count]
+    entries = []
+    with text_sink(io) as io:
+        print(';', file=io)
+        if forcefield is not None:
+            print('#include "{0}"'.format(forcefield), file=io)
+            print(file=io)
+        for (mol_data, count) in molecules:
+            if mol_data is last_mol_data:
+                digest = last_digest
+            else:
+                digest = topology_digest(mol_data, united=united)
+                (last_mol_data, last_digest) = (mol_data, digest)
+            if digest not in name_for_digest:
+                name = mol_data.var['rnme']
+                itp = cache.render(mol_data, target) if cache is not None else ITP.itp(mol_data, united=united)
+                if name not in itp_for_name:
+                    itp_for_name[name] = itp
+                    io.write(itp)
+                    print(file=io)
+                elif itp != itp_for_name[name]:
+                    raise ValueError('Distinct molecule types share the residue name {0}'.format(name))
+                name_for_digest[digest] = name
+            name = name_for_digest[digest]
+            if entries and entries[-1][0] == name:
+                entries[-1][1] += count
+            else:
+                entries.append([name, count])
+
+        print('[ system ]', file=io)
+        print(system_name, file=io)
+        print(file=io)
+        print('[ molecules ]', file=io)
+        print('; Compound        #mols', file=io)
+        counts = {}
+        for (name, count) in entries:
+            print('%-15s %6d' % (name, count), file=io)
+            counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+def system_topology(molecules: Iterable[Tuple[MolData, int]], system_name: str = 'System', united: bool = False,
+                    forcefield: Optional[str] = DEFAULT_FORCEFIELD, cache: Any = None) -> str:
+    '''return the system topology of molecules, see write_system_topology'''
+    io = StringIO()
+    write_system_topology(molecules, io, system_name=system_name, united=united, forcefield=forcefield, cache=cache)
+    return io.getvalue()
@@ -0,0 +1,120 @@
+from operator import itemgetter
+from typing import Any, Dict, List
+
+from atb_outputs.helpers.types_helpers import MolData
+from atb_outputs.neighbours import NeighbourShells
+
+TERMS = ('bonds', 'angles', 'impropers', 'dihedrals')
+
+
+class UnitedAtomView(object):
+    '''
+    The atoms of a molecule in its united-atom (united=True) or all-atom representation, derived once for all the
+    writers (see MolData.united_atom_view):
+    atoms, ids and indexes, ordered by uindex (united; only atoms with a uindex) or index (all-atom);
+    index_for_id and id_for_index, mapping atom ids onto (u)indexes and back;
+    conn, the sorted (u)indexes of the neighbours within the view of each atom (by id), and topology_conn, the
+    (u)indexes of the 'uconn' (united) or 'conn' (all-atom) of each atom (by (u)index), as used for 1-4 neighbours;
+    neighbour_shells, the 1-2, 1-3 and 1-4 neighbours of topology_conn (see neighbours.NeighbourShells);
+    bonds, angles, impropers and dihedrals, leaving out terms flagged 'united' in the united-atom view.
+    '''
+
+    def __init__(self, data: MolData, united: bool) -> None:
+        self.united = united
+        self.index_key = 'uindex' if united else 'index'
+        self._data = data
+        self._atoms_dict = data.atoms
+        self.atoms = sorted(
+            (atom for atom in data.atoms.values() if not united or 'uindex' in atom),
+            key=itemgetter(self.index_key),
+        )
+        self.ids = [atom['id'] for atom in self.atoms]
+        self.indexes = [atom[self.index_key] for atom in self.atoms]
+        self.index_for_id = dict(zip(self.ids, self.indexes))
+        # The first atom (in atoms order) with a given index wins, as for MolData.get_id
+        self.id_for_index = {}
+        for (atom_id, index) in zip(self.ids, self.indexes):
+            self.id_for_index.setdefault(index, atom_id)
+        # Copies of the connectivities the view derives conn, topology_conn and neighbour_shells from, as of when it was
+        # built ('uconn' only matters to the united-atom view)
+        self._conns = [atom['conn'][:] for atom in self.atoms]
+        self._uconns = [atom.get('uconn', ())[:] for atom in self.atoms] if united else None
+        self._version = data._version
+        self._conn = None
+        self._topology_conn = None
+        self._neighbour_shells = None
+        self._terms = {}
+
+    def is_current(self, data: MolData) -> bool:
+        '''
+        Whether the view still matches data: not modified since (see MolData.modified), same atoms, carrying the same
+        (u)indexes and 'conn' (and 'uconn', united), and no other atom with a (u)index.
+        '''
+        atoms = data.atoms
+        if data._version != self._version or atoms is not self._atoms_dict or len(atoms) != len(self._atoms_dict):
+            return False
+        if self.united and sum(1 for atom in atoms.values() if 'uindex' in atom) != len(self.atoms):
+            return False
+        if not all(
+            atoms.get(atom_id) is atom and atom.get(self.index_key) == index and atom['conn'] == conn
+            for (atom_id, atom, index, conn) in zip(self.ids, self.atoms, self.indexes, self._conns)
+        ):
+            return False
+        return self._uconns is None or all(
+            atom.get('uconn', ()) == uconn for (atom, uconn) in zip(self.atoms, self._uconns)
+        )
+
+    @property
+    def conn(self) -> Dict[int, List[int]]:
+        if self._conn is None:
+            index_for_id = self.index_for_id
+            self._conn = {
+                atom['id']: sorted(index_for_id[n] for n in atom['conn'] if n in index_for_id)
+                for atom in self.atoms
+            }
+        return self._conn
+
+    @property
+    def topology_conn(self) -> Dict[int, List[int]]:
+        if self._topology_conn is None:
+            conn_key = 'uconn' if self.united else 'conn'
+            self._topology_conn = {
+                index: [self.index_for_id[atom_id] for atom_id in atom[conn_key]]
+                for (index, atom) in zip(self.indexes, self.atoms)
+            }
+        return self._topology_conn
+
+    @property
+    def neighbour_shells(self) -> NeighbourShells:
+        if self._neighbour_shells is None:
+            self._neighbour_shells = NeighbourShells(self.topology_conn)
+        return self._neighbour_shells
+
+    def terms(self, name: str) -> List[Dict[str, Any]]:
+        '''
+        The bonds, angles, impropers or dihedrals of the molecule in this representation, cached until the list is
+        replaced or changes length.
+        '''
+        assert name in TERMS, name
+        all_terms = getattr(self._data, name)
+        (source, length, terms) = self._terms.get(name, (None, None, None))
+        if source is not all_terms or length != len(all_terms):
+            terms = [term for term in all_terms if not self.united or 'united' not in term]
+            self._terms[name] = (all_terms, len(all_terms), terms)
+        return terms
+
+    @property
+    def bonds(self) -> List[Dict[str, Any]]:
+        return self.terms('bonds')
+
+    @property
+    def angles(self) -> List[Dict[str, Any]]:
+        return self.terms('angles')
+
+    @property
+    def impropers(self) -> List[Dict[str, Any]]:
+        return self.terms('impropers')
+
+    @property
+    def dihedrals(self) -> List[Dict[str, Any]]:
+        return self.terms('dihedrals')
@@ -1,12 +1,29 @@
 from copy import deepcopy
 import re
 
+import yaml
+try:
+    # libyaml's emitter, when PyYAML was built with it; for the block mappings of dump_yml, it writes the same text as
+    # the pure Python one
+    from yaml import CDumper as Dumper
+except ImportError:
+    from yaml import Dumper
+
+from atb_outputs.coordinates import COORDINATE_KEYS, coordinate_list
+from atb_outputs.records import Record, as_plain_dict
+
+def plain_atom(atom):
+    # Coordinates backed by a MolData coordinate store are numpy views; serialise them as lists
+    if isinstance(atom, Record):
+        return atom.as_dict()
+    return {k: coordinate_list(v) if k in COORDINATE_KEYS else v for (k, v) in atom.items()}
+
 def clean_atoms(atoms, template=False):
     if not template:
-        return deepcopy(atoms)
+        return deepcopy({atom_id: plain_atom(atom) for atom_id, atom in atoms.items()})
     atoms_= {}
     for atom_id, atom in list(atoms.items()):
-        atoms_[atom_id] = _make_atom_template(atom)
+        atoms_[atom_id] = _make_atom_template(plain_atom(atom))
     return atoms_
 
 def _make_atom_template(a):
@@ -16,13 +33,26 @@ def _make_atom_template(a):
     a["cgroup"] = None
     return a
 
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
+
+def copy_code(code):
+    # deepcopy of the 'code' of a term, short-cut for the usual list of distinct flat dicts
+    if type(code) is list and all(type(c) is dict and all(type(v) in _SCALAR_TYPES for v in c.values()) for c in code) \
+            and len(set(map(id, code))) == len(code):
+        return [dict(c) for c in code]
+    return deepcopy(code)
+
+# The clean_* functions leave the terms they are given as they are, and return cleaned copies
+
 def clean_bonds(bonds, template=False):
     bonds_ = []
     for b in bonds:
+        # Compact bond records are serialised as plain dicts
+        b = dict(as_plain_dict(b))
         if template:
             _make_bond_template(b)
         else:
-            b["code"] = deepcopy(b["code"])
+            b["code"] = copy_code(b["code"])
             b["value"] = float(b["value"])
 
         bonds_.append(b)
@@ -40,10 +70,11 @@ def _make_bond_template(b):
 def clean_angles(angles, template=False):
     angles_ = []
     for a in angles:
+        a = dict(a)
         if template:
             _make_angle_template(a)
         else:
-            a["code"] = deepcopy(a["code"])
+            a["code"] = copy_code(a["code"])
             a["value"] = float(a["value"])
             
         angles_.append(a)
@@ -59,13 +90,12 @@ def _make_angle_template(a):
 def clean_dihedrals(dihedrals, template=False):
     dihedrals_ = []
     for d in dihedrals:
+        d = dict(d)
         if template:
             _make_dihedral_template(d)
         else:
             if "code" in d:
-                d["code"] = deepcopy(d["code"])  
-            else:
-                print(d)  
+                d["code"] = copy_code(d["code"])
             d["value"] = float(d["value"])
         dihedrals_.append(d)
     
@@ -86,8 +116,7 @@ def clean_rings(rings, template=False):
         rings_[r_id] = {"atoms": r["atoms"]}
     return rings_
 
-def add_yml_comments(yml_str):
-    atoms_comments = '''
+ATOMS_COMMENTS = '''
 #
 # atom data structure
 #    atom_id:
@@ -104,7 +133,7 @@ def add_yml_comments(yml_str):
 #        'equivalenceGroup'  : symmetry group that this atoms belongs to
 '''.strip()
 
-    bonds_comments = '''
+BONDS_COMMENTS = '''
 #
 # force_constant    Kb: force constant
 # value_dist        b0: equilibrium bond length
@@ -125,7 +154,8 @@ def add_yml_comments(yml_str):
 #    'code'  : [[mcb, fc, len] ....] possible parameters
 #    'order' : bond order information from QM
 '''.strip()
-    angles_comments = '''
+
+ANGLES_COMMENTS = '''
 #
 # force_constant      Ka: force constant
 # value_angle       phi0: equilibrium angle
@@ -145,7 +175,8 @@ def add_yml_comments(yml_str):
 #    'fc'    : force constant
 #    'hfc'   : harmonic force constant
 '''.strip()
-    dihedrals_comments = '''
+
+DIHEDRALS_COMMENTS = '''
 #
 # force_constant      Kd: force constant for dihedral potential
 # value_angle     theta0: equilibrium angle between planes 
@@ -166,7 +197,8 @@ def add_yml_comments(yml_str):
 #    'mul'       : multiplicity
 #    'essential' : redudant or not
 '''.strip()
-    impropers_comments = '''
+
+IMPROPERS_COMMENTS = '''
 #
 # force_constant      Kd: force constant for dihedral potential
 # value_angle     theta0: equilibrium angle between planes 
@@ -183,17 +215,66 @@ def add_yml_comments(yml_str):
 #    'ring'  : in which ring if in a ring
 #    'code'  : improper type code (because there's no possible alternatives this is not a list)
 '''.strip()
-    rings_comments = '''
+
+RINGS_COMMENTS = '''
 #
 # rings data structure
 #   ring_id:
 #       'aromatic' : aromatic ring?
 #       'atoms'    : list of atoms on the ring
 '''.strip()
-    yml_str = re.sub(re.compile(r"^atoms:", re.MULTILINE), "{0}\natoms:".format(atoms_comments), yml_str)
-    yml_str = re.sub(re.compile(r"^angles:", re.MULTILINE), "{0}\nangles:".format(angles_comments), yml_str)
-    yml_str = re.sub(re.compile(r"^bonds:", re.MULTILINE), "{0}\nbonds:".format(bonds_comments), yml_str)
-    yml_str = re.sub(re.compile(r"^dihedrals:", re.MULTILINE), "{0}\ndihedrals:".format(dihedrals_comments), yml_str)
-    yml_str = re.sub(re.compile(r"^impropers:", re.MULTILINE), "{0}\nimpropers:".format(impropers_comments), yml_str)
-    yml_str = re.sub(re.compile(r"^rings:", re.MULTILINE), "{0}\nrings:".format(rings_comments), yml_str)
+
+# Comments written above each section of a mol_data_dict YAML file (see add_yml_comments)
+SECTION_COMMENTS = {
+    'atoms': ATOMS_COMMENTS,
+    'angles': ANGLES_COMMENTS,
+    'bonds': BONDS_COMMENTS,
+    'dihedrals': DIHEDRALS_COMMENTS,
+    'impropers': IMPROPERS_COMMENTS,
+    'rings': RINGS_COMMENTS,
+}
+
+def add_yml_comments(yml_str):
+    yml_str = re.sub(re.compile(r"^atoms:", re.MULTILINE), "{0}\natoms:".format(ATOMS_COMMENTS), yml_str)
+    yml_str = re.sub(re.compile(r"^angles:", re.MULTILINE), "{0}\nangles:".format(ANGLES_COMMENTS), yml_str)
+    yml_str = re.sub(re.compile(r"^bonds:", re.MULTILINE), "{0}\nbonds:".format(BONDS_COMMENTS), yml_str)
+    yml_str = re.sub(re.compile(r"^dihedrals:", re.MULTILINE), "{0}\ndihedrals:".format(DIHEDRALS_COMMENTS), yml_str)
+    yml_str = re.sub(re.compile(r"^impropers:", re.MULTILINE), "{0}\nimpropers:".format(IMPROPERS_COMMENTS), yml_str)
+    yml_str = re.sub(re.compile(r"^rings:", re.MULTILINE), "{0}\nrings:".format(RINGS_COMMENTS), yml_str)
     return yml_str
+
+def _has_aliases(data):
+    # Whether yaml.dump would write anchors and aliases: an object other than the scalars of
+    # Representer.ignore_aliases held more than once. Objects of other types, subclasses of those scalars included (numpy
+    # scalars are represented with their dtype, which is shared), are not looked into, so count as aliased.
+    seen = set()
+    pending = [data]
+    while pending:
+        obj = pending.pop()
+        if obj is None or type(obj) in (str, bytes, bool, int, float) or (type(obj) is tuple and obj == ()):
+            continue
+        if id(obj) in seen:
+            return True
+        seen.add(id(obj))
+        if type(obj) is dict:
+            pending.extend(obj)
+            pending.extend(obj.values())
+        elif type(obj) in (list, tuple):
+            pending.extend(obj)
+        else:
+            return True
+    return False
+
+def dump_yml(data, stream):
+    '''
+    Write data to the (text) stream, as add_yml_comments(yaml.dump(data)) would: one top level key at a time, each
+    preceded by its SECTION_COMMENTS, with libyaml's emitter when available. Anything but a non empty dict, or data
+    holding an object more than once (its anchors are numbered across the whole document), goes the slow way.
+    '''
+    if type(data) is not dict or not data or _has_aliases(data):
+        stream.write(add_yml_comments(yaml.dump(data)))
+        return
+    for key in sorted(data):
+        if key in SECTION_COMMENTS:
+            stream.write(SECTION_COMMENTS[key] + '\n')
+        yaml.dump({key: data[key]}, stream, Dumper=Dumper)
@@ -0,0 +1,1201 @@
+from sys import argv
+from copy import deepcopy
+from os.path import dirname, join
+from math import cos, sin, pi, sqrt
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple
+
+from atb_outputs.helpers.dijkstra import shortestPath as shortest_path
+from atb_outputs.mol_data import MolData, iter_mol_data, mol_data_from_mol_data_dict, mol_data_from_many_fdb_molecules, build_rings, is_ring_aromatic, \
+    classify_rings_of_molecules, has_ring_planar_valences, \
+    PLANAR_DISTANCE_TOL
+
+C_C_BOND = 0.14 # nm
+C_H_BOND = 0.109 # nm
+
+Molecule = Tuple[List[str], List[Tuple[float, float, float]], List[Tuple[int, int]]]
+
+
+def pdb_string(molecule: Molecule, residue_name: str = 'BEN') -> str:
+    '''Fixed-column PDB string (coordinates in nm, written in Angstrom) with CONECT records.'''
+    (types, coords, bonds) = molecule
+    conn = {i: [] for i in range(1, len(types) + 1)}
+    for (i, j) in bonds:
+        conn[i].append(j)
+        conn[j].append(i)
+
+    lines = []
+    for (i, (element, (x, y, z))) in enumerate(zip(types, coords), start=1):
+        lines.append(
+            'HETATM{0:>5d} {1:>4s} {2:>3s}     0    {3:8.3f}{4:8.3f}{5:8.3f}  1.00  0.00          {6:>2s}'.format(
+                i, '{0}{1}'.format(element, i)[:4], residue_name, x * 10, y * 10, z * 10, element,
+            ),
+        )
+    for (i, neighbours) in sorted(conn.items()):
+        for start in range(0, len(neighbours), 4):
+            lines.append('CONECT{0:>5d}'.format(i) + ''.join('{0:>5d}'.format(n) for n in neighbours[start:start + 4]))
+    lines.append('END')
+    return '\n'.join(lines)
+
+
+def _add_hydrogens(types: List[str], coords: List[Any], bonds: List[Tuple[int, int]], valence: int = 3) -> None:
+    '''Cap every carbon with fewer than `valence` neighbours with hydrogens pointing away from its neighbours.'''
+    neighbours = {i: [] for i in range(1, len(types) + 1)}
+    for (i, j) in bonds:
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+    for i in range(1, len(types) + 1):
+        if types[i - 1] != 'C':
+            continue
+        for n_h in range(valence - len(neighbours[i])):
+            (x, y, z) = coords[i - 1]
+            (dx, dy, dz) = [sum(coords[i - 1][k] - coords[j - 1][k] for j in neighbours[i]) for k in range(3)]
+            norm = (dx ** 2 + dy ** 2 + dz ** 2) ** 0.5 or 1.0
+            offset = 0.05 * n_h
+            types.append('H')
+            coords.append((x + C_H_BOND * dx / norm, y + C_H_BOND * dy / norm + offset, z + C_H_BOND * dz / norm + offset))
+            bonds.append((i, len(types)))
+
+
+def _honeycomb(hexagon_centres: List[Tuple[float, float]], pucker: float = 0.0) -> Molecule:
+    types, coords, bonds = [], [], []
+    vertex_ids = {}
+    for (cx, cy) in hexagon_centres:
+        ring = []
+        for k in range(6):
+            angle = pi / 6 + k * pi / 3
+            key = (round(cx + C_C_BOND * cos(angle), 4), round(cy + C_C_BOND * sin(angle), 4))
+            if key not in vertex_ids:
+                types.append('C')
+                coords.append((key[0], key[1], pucker * (-1) ** len(types)))
+                vertex_ids[key] = len(types)
+            ring.append(vertex_ids[key])
+        for k in range(6):
+            bond = tuple(sorted((ring[k], ring[(k + 1) % 6])))
+            if bond not in bonds:
+                bonds.append(bond)
+    return (types, coords, bonds)
+
+
+def polycyclic_aromatic_hydrocarbon(rows: int, columns: int) -> Molecule:
+    '''Planar, fully fused (graphene-like) PAH with rows x columns hexagons.'''
+    dx, dy = C_C_BOND * 3 ** 0.5, C_C_BOND * 1.5
+    (types, coords, bonds) = _honeycomb(
+        [(column * dx + (row % 2) * dx / 2, row * dy) for row in range(rows) for column in range(columns)],
+    )
+    _add_hydrogens(types, coords, bonds)
+    return (types, coords, bonds)
+
+
+def steroid(n_units: int = 1) -> Molecule:
+    '''Puckered 6-6-6-5 fused ring skeletons (gonane), chained through their D rings.'''
+    dx, dy = C_C_BOND * 3 ** 0.5, C_C_BOND * 1.5
+    types, coords, bonds = [], [], []
+    previous_d_ring_atom = None
+    for unit in range(n_units):
+        offset = len(types)
+        x0 = unit * 6 * dx
+        (unit_types, unit_coords, unit_bonds) = _honeycomb([(x0, 0.0), (x0 + dx, 0.0), (x0 + 1.5 * dx, dy)], pucker=0.03)
+        # Fuse a five membered D ring onto the outermost free edge of ring C
+        degree = {i: 0 for i in range(1, len(unit_types) + 1)}
+        for (i, j) in unit_bonds:
+            degree[i] += 1
+            degree[j] += 1
+        (a, b) = max(
+            ((i, j) for (i, j) in unit_bonds if degree[i] == degree[j] == 2),
+            key=lambda bond: unit_coords[bond[0] - 1][0] + unit_coords[bond[1] - 1][0],
+        )
+        (ax, ay, _), (bx, by, _) = unit_coords[a - 1], unit_coords[b - 1]
+        (mx, my) = ((ax + bx) / 2 - (x0 + 1.5 * dx), (ay + by) / 2 - dy)
+        norm = (mx ** 2 + my ** 2) ** 0.5
+        (ox, oy) = (mx / norm * C_C_BOND, my / norm * C_C_BOND)
+        for (x, y, z) in ((bx + ox, by + oy, 0.05), ((ax + bx) / 2 + 1.6 * ox, (ay + by) / 2 + 1.6 * oy, -0.05), (ax + ox, ay + oy, 0.05)):
+            unit_types.append('C')
+            unit_coords.append((x, y, z))
+        n = len(unit_types)
+        unit_bonds.extend([(b, n - 2), (n - 2, n - 1), (n - 1, n), (n, a)])
+        types.extend(unit_types)
+        coords.extend(unit_coords)
+        bonds.extend((i + offset, j + offset) for (i, j) in unit_bonds)
+        if previous_d_ring_atom is not None:
+            bonds.append((previous_d_ring_atom, offset + 1))
+        previous_d_ring_atom = len(types)
+    _add_hydrogens(types, coords, bonds, valence=4)
+    return (types, coords, bonds)
+
+
+def cyclodextrin(n_glucose: int = 7) -> Molecule:
+    '''Macrocycle of n_glucose puckered pyranose (C5O) rings joined by glycosidic oxygens.'''
+    types, coords, bonds = [], [], []
+    radius = n_glucose * 0.08
+    ring_starts = []
+    for unit in range(n_glucose):
+        theta = 2 * pi * unit / n_glucose
+        (cx, cy) = (radius * cos(theta), radius * sin(theta))
+        start = len(types) + 1
+        for k in range(6):
+            angle = theta + k * pi / 3
+            types.append('O' if k == 5 else 'C')
+            coords.append((cx + C_C_BOND * cos(angle), cy + C_C_BOND * sin(angle), 0.025 * (-1) ** k))
+        bonds.extend((start + k, start + (k + 1) % 6) for k in range(6))
+        # Glycosidic oxygen on C1
+        types.append('O')
+        coords.append((cx + 2 * C_C_BOND * cos(theta - pi / 3), cy + 2 * C_C_BOND * sin(theta - pi / 3), 0.0))
+        bonds.append((start, len(types)))
+        ring_starts.append(start)
+    for (unit, start) in enumerate(ring_starts):
+        next_start = ring_starts[(unit + 1) % n_glucose]
+        bonds.append((start + 6, next_start + 3))
+    _add_hydrogens(types, coords, bonds, valence=4)
+    return (types, coords, bonds)
+
+
+def alkane(n_carbons: int) -> Molecule:
+    '''Zig-zag linear alkane C(n)H(2n+2).'''
+    types = ['C'] * n_carbons
+    coords = [(i * 0.125, 0.0 if i % 2 else 0.085, 0.0) for i in range(n_carbons)]
+    bonds = [(i, i + 1) for i in range(1, n_carbons)]
+    _add_hydrogens(types, coords, bonds, valence=4)
+    return (types, coords, bonds)
+
+
+def lipid_patch(n_chains: int, n_carbons: int) -> Molecule:
+    '''Monolayer of n_chains parallel alkane chains of n_carbons, on a square grid 0.5 nm apart, as one molecule.'''
+    (chain_types, chain_coords, chain_bonds) = alkane(n_carbons)
+    side = int(n_chains ** 0.5 + 0.999)
+    types, coords, bonds = [], [], []
+    for chain in range(n_chains):
+        (dy, dz) = (0.5 * (chain % side), 0.5 * (chain // side))
+        offset = len(types)
+        types.extend(chain_types)
+        coords.extend((x, y + dy, z + dz) for (x, y, z) in chain_coords)
+        bonds.extend((i + offset, j + offset) for (i, j) in chain_bonds)
+    return (types, coords, bonds)
+
+
+def with_topology(data: MolData) -> MolData:
+    '''Decorate a MolData with the (made up) parameters that the itp, yml, lgf and ccd_cif writers expect.'''
+    from atb_outputs.itp import calculate_1_4_neighbours
+
+    data.var = {'rnme': 'BEN', 'REV_DATE': '', 'total_charge': 0}
+    data.completed = lambda x: True
+    data.unite_atoms()
+    for atom in data.atoms.values():
+        hydrogens = [n for n in atom['conn'] if data.atoms[n]['type'] == 'H']
+        atom.update(
+            charge=0.1 if atom['type'] == 'H' else -0.1 * len(hydrogens),
+            mass=1.008 if atom['type'] == 'H' else 12.011,
+            ljsym='HC' if atom['type'] == 'H' else atom['type'],
+            iacm=20 if atom['type'] == 'H' else 12,
+            cgroup=atom['index'],
+            ocoord=list(atom['coord']),
+            equivalenceGroup=-1,
+        )
+        if 'uindex' in atom:
+            atom.update(
+                uconn=[n for n in atom['conn'] if 'uindex' in data.atoms[n]],
+                ucharge=0.0,
+                umass=atom['mass'] + 1.008 * sum(1 for n in hydrogens if 'uindex' not in data.atoms[n]),
+                uljsym='CH{0}'.format(len(hydrogens)) if atom['type'] == 'C' and len(hydrogens) > 1 else atom['ljsym'],
+            )
+    # As in ATB topologies, 'united' flags terms that disappear in the united atom representation
+    is_united = lambda term: any('uindex' not in data.atoms[a] for a in term['atoms'])
+    for bond in data.bonds:
+        bond.pop('united', None)
+        if is_united(bond):
+            bond['united'] = True
+        bond.update(value=0.109 if 'H' in [data.atoms[a]['type'] for a in bond['atoms']] else 0.153, code=[{'value': 0.153, 'fc': 7.15e6}])
+    data.angles = [
+        {'atoms': [a, b, c], 'value': 111.0, 'code': [{'value': 111.0, 'fc': 530.0}]}
+        for (b, atom) in sorted(data.atoms.items())
+        for (i, a) in enumerate(atom['conn'])
+        for c in atom['conn'][i + 1:]
+    ]
+    data.dihedrals = []
+    for bond in data.bonds:
+        (b, c) = bond['atoms']
+        for (i, (a, d)) in enumerate((a, d) for a in data.atoms[b]['conn'] if a != c for d in data.atoms[c]['conn'] if d != b):
+            data.dihedrals.append({'atoms': [a, b, c, d], 'value': 180.0, 'essential': i == 0, 'code': [{'value': 0.0, 'fc': 5.92, 'mul': 3}]})
+    data.impropers = []
+    for term in data.angles + data.dihedrals:
+        if is_united(term):
+            term['united'] = True
+    for (prefix, united) in (('', False), ('u', True)):
+        for (index, neighbours) in calculate_1_4_neighbours(data, united).items():
+            data.atoms[data.get_id(index, united=united)][prefix + 'excl'] = [n for n in neighbours if (index + n) % 3 == 0]
+    return data
+
+
+class FDBAtom(object):
+    def __init__(self, atom_id: int, name: str, element: str) -> None:
+        self._index = {'id': atom_id, 'name': name}
+        self.element = element
+
+
+class FDBBonds(object):
+    '''Iterates over the bonded pairs of atom keys; called with an atom key, gives its (atom, neighbour) pairs.'''
+
+    def __init__(self, pairs: List[Tuple[str, str]]) -> None:
+        self._pairs = pairs
+        self._pairs_for_atom = {}
+        for (a1, a2) in pairs:
+            self._pairs_for_atom.setdefault(a1, []).append((a1, a2))
+            self._pairs_for_atom.setdefault(a2, []).append((a2, a1))
+
+    def __iter__(self) -> Any:
+        return iter(self._pairs)
+
+    def __call__(self, atom_key: str) -> List[Tuple[str, str]]:
+        return self._pairs_for_atom.get(atom_key, [])
+
+
+class FDBMolecule(object):
+    '''Stand-in for the FDB molecule objects read by MolData._readFDBMolecule (MolData dispatches on the class name).'''
+
+    def __init__(self, molecule: Molecule) -> None:
+        (types, coords, bonds) = molecule
+        names = ['{0}{1}'.format(element, i) for (i, element) in enumerate(types, start=1)]
+        self.atoms = {'a' + name: FDBAtom(i, name, element) for (i, (name, element)) in enumerate(zip(names, types), start=1)}
+        self.atom_info = [
+            {'elementID': name, 'x3d': x, 'y3d': y, 'z3d': z}
+            for (name, (x, y, z)) in reversed(list(zip(names, coords)))
+        ]
+        self.bonds = FDBBonds([('a' + names[i - 1], 'a' + names[j - 1]) for (i, j) in bonds])
+
+
+def _legacy_read_fdb_molecule(data: MolData, Molecule: FDBMolecule) -> None:
+    '''MolData._readFDBMolecule before indexing: a search of atom_info per atom, and bonds rebuilt per atom.'''
+    fdb_atom_info = Molecule.atom_info
+    for a in Molecule.atoms:
+        index_dict = Molecule.atoms[a]._index
+        connectivity = [Molecule.atoms[a_bonded]._index['id'] for _, a_bonded in Molecule.bonds(a)]
+        (i, name) = (index_dict['id'], index_dict['name'])
+        fdb_info = [a_fdb for a_fdb in fdb_atom_info if a_fdb['elementID'] == name]
+        assert len(fdb_info) == 1, fdb_info
+        fdb_info = fdb_info[0]
+        data.atoms[i] = {'id': i, 'index': i, 'symbol': name, 'type': Molecule.atoms[a].element, 'conn': connectivity,
+                         'coord': [fdb_info['x3d'], fdb_info['y3d'], fdb_info['z3d']]}
+        data.bonds = [
+            {'atoms': [Molecule.atoms[a1]._index['id'], Molecule.atoms[a2]._index['id']]} for a1, a2 in Molecule.bonds]
+
+
+def _legacy_carbons_with_n_hydrogens(mol_data: MolData, n_hydrogens: int) -> List[Dict[str, Any]]:
+    '''The carbons of mol_data bonded to exactly n_hydrogens hydrogens, as formats.ccd_cif found them before.'''
+    selected_carbons = []
+    for a in mol_data.atoms.values():
+        if a["type"] == "C" and \
+                len([atom_id for atom_id in a["conn"] if mol_data.atoms[atom_id]["type"] == "H"]) == n_hydrogens:
+            selected_carbons.append(a)
+    return selected_carbons
+
+
+def _legacy_ccd_cif(mol_data: MolData, comp_id: str, comp_id_3char: str) -> str:
+    '''formats.ccd_cif before vectorized C-H averaging: per carbon and per hydrogen lookups, and str concatenation.'''
+    import numpy as np
+    import atb_outputs.ccd_cif as CIF
+    from atb_outputs.formats import DOUBLE_BOND_LENGTH_CUTOFF, get_av_bond_length_coords
+
+    def get_averaged_ch_bond(n_hydrogens: int, ocoord_key: str) -> Dict[str, Any]:
+        coords = mol_data.coordinate_array(ocoord_key)
+        row_for_id = {atom_id: row for (row, atom_id) in enumerate(mol_data.atoms)}
+        ch_scaling_factors = {}
+        for c_atom in _legacy_carbons_with_n_hydrogens(mol_data, n_hydrogens):
+            h_ids = [atom_id for atom_id in c_atom['conn'] if mol_data[atom_id]['type'] == 'H']
+            ch_bond_lengths = [
+                np.linalg.norm(coords[row_for_id[c_atom['id']]] - coords[row_for_id[h_id]]) for h_id in h_ids
+            ]
+            av_ch_len = np.mean(ch_bond_lengths)
+            ch_scaling_factors.update({h_id: av_ch_len / length for (h_id, length) in zip(h_ids, ch_bond_lengths)})
+        return {
+            mol_data.atoms[h_id]['symbol']: get_av_bond_length_coords(mol_data, h_id, scaling_factor, ocoord_key)
+            for (h_id, scaling_factor) in ch_scaling_factors.items()
+        }
+
+    cif_str = CIF.CCD_DISCLAIMER
+    cif_str += CIF.MOLECULE_DESCRIPTERS_TEMPLATE.format(
+        comp_id=comp_id, comp_id_3char=comp_id_3char, net_charge=mol_data.var['total_charge'],
+    )
+    cif_str += CIF.ATOMS_HEADER
+    aromatic_atom_ids = [a for r in mol_data.rings.values() if 'aromatic' in r and r['aromatic'] for a in r['atoms']]
+    ocoord_key = 'ocoord' if 'ocoord' in list(mol_data.atoms.values())[0] else 'coord'
+    updated_ch2_coords = get_averaged_ch_bond(2, ocoord_key)
+    updated_ch3_coords = get_averaged_ch_bond(3, ocoord_key)
+    sorted_atoms = sorted(mol_data.atoms.values(), key=lambda x: x['index'])
+    sorted_ids = [atom['id'] for atom in sorted_atoms]
+    model_coords = mol_data.coordinate_array('coord', sorted_ids).tolist()
+    ideal_coords = mol_data.coordinate_array(ocoord_key, sorted_ids).tolist()
+    for (atom, model_coord, ideal_coord) in zip(sorted_atoms, model_coords, ideal_coords):
+        if atom['symbol'] in updated_ch2_coords:
+            x, y, z = updated_ch2_coords[atom['symbol']]
+        elif atom['symbol'] in updated_ch3_coords:
+            x, y, z = updated_ch3_coords[atom['symbol']]
+        else:
+            x, y, z = ideal_coord
+        cif_str += CIF.ATOM_LINE_TEMPLATE.format(
+            comp_id=comp_id, name=atom['symbol'], type=atom['type'], charge=0, pdbx_align=1,
+            aromatic='Y' if atom['id'] in aromatic_atom_ids else 'N', terminal_atom='N', stereo_config='N',
+            x_model=model_coord[0] * 10, y_model=model_coord[1] * 10, z_model=model_coord[2] * 10,
+            x_ideal=x * 10, y_ideal=y * 10, z_ideal=z * 10, index=atom['index'],
+        )
+    cif_str += CIF.BONDS_HEADER
+    for i, bond in enumerate(sorted(mol_data.bonds, key=lambda x: mol_data.atoms[x['atoms'][0]]['index'])):
+        bond_order_id = frozenset([mol_data.atoms[atom_id]['type'] for atom_id in bond['atoms']])
+        if bond_order_id in DOUBLE_BOND_LENGTH_CUTOFF:
+            bond_order = 'DOUB' if bond['value'] < DOUBLE_BOND_LENGTH_CUTOFF[bond_order_id] else 'SING'
+        else:
+            bond_order = 'SING'
+        cif_str += CIF.BONDS_TEMPLATE.format(
+            comp_id=comp_id,
+            name1=mol_data.atoms[bond['atoms'][0]]['symbol'],
+            name2=mol_data.atoms[bond['atoms'][1]]['symbol'],
+            bond_order=bond_order,
+            aromatic='Y' if all([atom_id in aromatic_atom_ids for atom_id in bond['atoms']]) else 'N',
+            stereo_config='N',
+            index=i + 1,
+        )
+    return cif_str
+
+
+def _legacy_pdb_atoms(data: MolData, io: Any, atoms: List[Any], coords: Any) -> None:
+    '''pdb.atoms (all atoms, residue name from var) before bulk formatting: a % format and a print per line.'''
+    for (i, coord) in zip(atoms, (coords * 10.).tolist()):
+        print(i['pdb'][:6] + '%5d' % i['index'] + '{:>5} '.format(i['symbol']) + '%-4s' % data.var['rnme'] +
+              '    0    ' + '%8.3f' % coord[0] + '%8.3f' % coord[1] + '%8.3f' % coord[2] + i['pdb'][54:], file=io)
+
+
+def _legacy_g96_positions(data: MolData, io: Any, view: Any, coords: Any) -> None:
+    '''POSITION lines of formats.g96 before bulk formatting: a str.format and a print per line.'''
+    for (atom, index, coord) in zip(view.atoms, view.indexes, coords.tolist()):
+        print(
+            '{residue_index:>5d}{X:1s}{residue_name:>5s}{X:1s}{atom_name:>5s}{atom_index:>7d}{x:15.9f}{y:15.9f}{z:15.9f}'.format(
+                X=' ', residue_index=1, residue_name=data.var['rnme'], atom_name=atom['symbol'], atom_index=index,
+                **dict(zip(('x', 'y', 'z'), coord)),
+            ),
+            file=io,
+        )
+
+
+def _legacy_calculate_1_4_neighbours(data: MolData, united: bool) -> Dict[int, List[int]]:
+    '''itp.calculate_1_4_neighbours before the neighbour shell engine: list concatenation and membership, atom by atom.'''
+    from functools import reduce
+
+    def neighbour_ids(atom_ids: List[int]) -> List[int]:
+        return sorted(set(reduce(lambda x, y: x + y, [conn_index[atom_id] for atom_id in atom_ids], [])))
+
+    view = data.united_atom_view(united)
+    conn_index = view.topology_conn
+    nbr3 = {}
+    for atom in data.atoms.values():
+        if view.index_key not in atom:
+            continue
+        index = atom[view.index_key]
+        first_neighbours = sorted(conn_index[index])
+        second_neighbours = [x for x in neighbour_ids(first_neighbours) if x not in first_neighbours]
+        third_neighbours = [x for x in neighbour_ids(second_neighbours) if x not in first_neighbours + second_neighbours]
+        nbr3[index] = [x for x in third_neighbours if x > index]
+    return nbr3
+
+
+def _legacy_itp(data: MolData, united: bool) -> str:
+    '''
+    itp.itp before bulk formatting: a print per line, first_code and index lookups repeated within lines, and 1-4
+    neighbours tested against exclusion lists, once for the pairs and once for the exclusions.
+    '''
+    from io import StringIO
+    import atb_outputs.itp as ITP
+
+    io = StringIO()
+    prefix = 'u' if united else ''
+    view = data.united_atom_view(united)
+    (index_for_id, id_for_index) = (view.index_for_id, view.id_for_index)
+    nbr3 = ITP.calculate_1_4_neighbours(data, united)
+    (first_code, rnme) = (ITP.first_code, data.var['rnme'])
+    ITP.header(data, io)
+    ITP.title(data, io)
+    ITP.moleculetype(data, io)
+    print('[ atoms ]', file=io)
+    print(';  nr  type  resnr  resid  atom  cgnr  charge    mass', file=io)
+    (has_charges, totalcharge) = (ITP.has_all_charges(data), 0.0)
+    for atom in view.atoms:
+        charge = ITP.a_charge(atom, prefix) if has_charges else '%%'
+        print('%5d %5s %4s %7s %6s %4d {0} %8.4f'.format('%8.3f' if has_charges else '%8s') % (
+            atom[prefix + 'index'], ITP.a_ljsym(atom, prefix), '1', rnme, atom['symbol'], atom[prefix + 'index'], charge,
+            atom[prefix + 'mass'] if (prefix + 'mass') in atom else atom['mass'],
+        ), file=io)
+        if has_charges:
+            totalcharge += charge
+    print('; total charge of the molecule: %7.3f' % totalcharge, file=io)
+    print('[ bonds ]', file=io)
+    print(';  ai   aj  funct   c0         c1', file=io)
+    for b in view.bonds:
+        if 'value' in b and len(b['code']) > 0:
+            print('%5d %4d %4s %8.4f %12.4e' % (index_for_id[b['atoms'][0]], index_for_id[b['atoms'][1]], '2',
+                                                first_code(b)['value'], first_code(b)['fc']), file=io)
+        else:
+            print('%5d %4d %4s %8s %12s' % (index_for_id[b['atoms'][0]], index_for_id[b['atoms'][1]], '2', '%%', '%%'), file=io)
+    print('[ pairs ]', file=io)
+    print(';  ai   aj  funct  ;  all 1-4 pairs but the ones excluded in GROMOS itp', file=io)
+    for (k, v) in sorted(nbr3.items()):
+        for n in v:
+            if n not in data.atoms[id_for_index[k]][prefix + 'excl']:
+                print('%5d %4d %4s' % (k, n, '1'), file=io)
+    print('[ angles ]', file=io)
+    print(';  ai   aj   ak  funct   angle     fc', file=io)
+    for angle in view.angles:
+        if 'value' in angle and 'code' in angle and len(angle['code']) > 0:
+            print('%5d %4d %4d %4s %9.2f %8.2f' % (
+                index_for_id[angle['atoms'][0]], index_for_id[angle['atoms'][1]], index_for_id[angle['atoms'][2]], '2',
+                first_code(angle)['value'], first_code(angle)['fc']), file=io)
+        else:
+            print('%5d %4d %4d %4s %9s %8s' % (
+                index_for_id[angle['atoms'][0]], index_for_id[angle['atoms'][1]], index_for_id[angle['atoms'][2]], '2',
+                '%%', '%%'), file=io)
+    print('[ dihedrals ]', file=io)
+    print('; GROMOS improper dihedrals', file=io)
+    print(';  ai   aj   ak   al  funct   angle     fc', file=io)
+    for i in view.impropers:
+        if not united and i['code'] == 2:
+            continue
+        print('%5d %4d %4d %4d %4s %9.2f %8.2f' % (
+            tuple(index_for_id[a] for a in i['atoms'][:4]) + ('2', ITP.GROMOS_IMPROPER_DIHEDRALS[i['code']]['value'],
+                                                              ITP.GROMOS_IMPROPER_DIHEDRALS[i['code']]['fc'] * 3281.5686)
+        ), file=io)
+    print('[ dihedrals ]', file=io)
+    print(';  ai   aj   ak   al  funct    ph0      cp     mult', file=io)
+    for i in view.dihedrals:
+        if 'essential' in i and not i['essential']:
+            continue
+        if 'code' in i and len(i['code']) > 0:
+            print('%5d %4d %4d %4d %4s %9.2f %8.2f %4d' % (
+                tuple(index_for_id[a] for a in i['atoms'][:4]) + ('1', first_code(i)['value'], first_code(i)['fc'],
+                                                                  first_code(i)['mul'])
+            ), file=io)
+        else:
+            print('%5d %4d %4d %4d %4s %9s %8s %4s' % (tuple(index_for_id[a] for a in i['atoms'][:4]) + ('1', '%%', '%%', '%%')), file=io)
+    print('[ exclusions ]', file=io)
+    print(';  ai   aj  funct  ;  GROMOS 1-4 exclusions', file=io)
+    for (k, v) in sorted(nbr3.items()):
+        for n in v:
+            if n in data.atoms[id_for_index[k]][prefix + 'excl']:
+                print('%5d %4d' % (k, n), file=io)
+    return io.getvalue()
+
+
+def _legacy_rings_for_bond(mol_graph: Any, bond_atom_ids: Any) -> List[Any]:
+    '''Rings through a bond, as found by _legacy_build_rings: shortest paths, penalising edges already used.'''
+    i0 = str(bond_atom_ids[0])
+    i1 = str(bond_atom_ids[1])
+    all_rings = []
+    mol_graph[i0][i1] = 999
+    found = True
+    while found:
+        found = False
+        ring = shortest_path(
+            mol_graph,
+            i0,
+            i1,
+        )
+        if not ring in all_rings:
+            all_rings.append(ring)
+            found = True
+            for i in range(len(ring) - 1):
+                mol_graph[ring[i]][ring[i + 1]] = 2
+    mol_graph[i0][i1] = 1
+    return all_rings
+
+
+def _legacy_graph_dict(atoms: Dict[int, Any]) -> Dict[str, Any]:
+    G = {}
+    for (atom_id, atom) in atoms.items():
+        tmp = {}
+        for i in atom["conn"]:
+            tmp[str(i)] = 1
+        G[str(atom_id)] = tmp
+    return G
+
+
+def _legacy_build_rings(data: MolData) -> Dict[int, Any]:
+    '''Dijkstra based ring perception, as used before the SSSR engine.'''
+    all_rings = {}
+    ring_count = 1
+    mol_graph = _legacy_graph_dict(data.atoms)
+    for bond in data.bonds:
+        for ring in _legacy_rings_for_bond(deepcopy(mol_graph), bond["atoms"]):
+            if len(ring) == 2:
+                continue
+            ring = list(map(int, ring))
+            if not any(frozenset(r["atoms"]) == frozenset(ring) for r in all_rings.values()):
+                ring_dict = {"atoms": ring, "aromatic": False}
+                ring_dict["aromatic"] = is_ring_aromatic(data, ring_dict, None)
+                all_rings[ring_count] = ring_dict
+                ring_count += 1
+    return all_rings
+
+
+def _time(function: Callable, repeat: int = 3) -> Tuple[float, Any]:
+    best, result = None, None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_ring_perception() -> None:
+    molecules = [
+        ('naphthalene', polycyclic_aromatic_hydrocarbon(1, 2)),
+        ('coronene-like PAH (3x3)', polycyclic_aromatic_hydrocarbon(3, 3)),
+        ('PAH (6x6)', polycyclic_aromatic_hydrocarbon(6, 6)),
+        ('steroid', steroid(1)),
+        ('steroid x 4', steroid(4)),
+        ('alpha-cyclodextrin', cyclodextrin(6)),
+        ('gamma-cyclodextrin', cyclodextrin(8)),
+    ]
+    print('{0:<26s} {1:>6s} {2:>12s} {3:>12s} {4:>12s} {5:>8s}'.format(
+        'molecule', 'atoms', 'legacy (s)', 'SSSR (s)', 'relevant (s)', 'rings',
+    ))
+    for (name, molecule) in molecules:
+        data = MolData(pdb_string(molecule), build_ring=False)
+        (legacy_time, legacy_rings) = _time(lambda: _legacy_build_rings(data), repeat=1)
+        (sssr_time, sssr_rings) = _time(lambda: build_rings(data))
+        (relevant_time, relevant_rings) = _time(lambda: build_rings(data, relevant_cycles=True))
+        print('{0:<26s} {1:>6d} {2:>12.4f} {3:>12.4f} {4:>12.4f} {5:>8s}'.format(
+            name,
+            len(data.atoms),
+            legacy_time,
+            sssr_time,
+            relevant_time,
+            '{0}/{1}/{2}'.format(len(legacy_rings), len(sssr_rings), len(relevant_rings)),
+        ))
+
+
+def _legacy_equation_of_plane(a0: Any, a1: Any, a2: Any) -> Tuple[float, float, float, float]:
+    '''Plane (A, B, C, D) through three points, as used by _legacy_is_ring_aromatic.'''
+    det1 = ((a1[1] - a0[1]) * (a2[2] - a0[2])) - ((a2[1] - a0[1]) * (a1[2] - a0[2]))
+    det2 = ((a1[2] - a0[2]) * (a2[0] - a0[0])) - ((a2[2] - a0[2]) * (a1[0] - a0[0]))
+    det3 = ((a1[0] - a0[0]) * (a2[1] - a0[1])) - ((a2[0] - a0[0]) * (a1[1] - a0[1]))
+    D = det1 * a0[0] + det2 * a0[1] + det3 * a0[2]
+    D = -D
+    return (det1, det2, det3, D)
+
+
+def _legacy_distance_from_plane(A: float, B: float, C: float, D: float, pt: Any) -> float:
+    x, y, z = pt
+    denom = sqrt(A ** 2 + B ** 2 + C ** 2)
+    if not denom:
+        return 0
+    numer = A * x + B * y + C * z + D
+    distance = numer / denom
+    return distance
+
+
+def _legacy_is_ring_aromatic(data: MolData, ring: Dict[str, Any]) -> bool:
+    '''Ring by ring classification against the plane through the first three ring atoms, as used before batching.'''
+    if len(ring["atoms"]) < 4:
+        return False
+    coords = [data.atoms[atom_id]["coord"] for atom_id in ring["atoms"]]
+    (A, B, C, D) = _legacy_equation_of_plane(*coords[:3])
+    if any(abs(_legacy_distance_from_plane(A, B, C, D, coord)) > PLANAR_DISTANCE_TOL for coord in coords[3:]):
+        return False
+    return has_ring_planar_valences(data, ring, None)
+
+
+def benchmark_ring_classification(n_molecules: int = 200) -> None:
+    print('{0:<26s} {1:>8s} {2:>12s} {3:>12s} {4:>10s}'.format(
+        'molecules', 'rings', 'per ring (s)', 'batch (s)', 'agree',
+    ))
+    for (name, molecule) in (
+        ('PAH (3x3)', polycyclic_aromatic_hydrocarbon(3, 3)),
+        ('steroid x 2', steroid(2)),
+        ('beta-cyclodextrin', cyclodextrin(7)),
+    ):
+        data = MolData(pdb_string(molecule))
+        molecules = [(data, list(data.rings.values()))] * n_molecules
+        (legacy_time, legacy) = _time(
+            lambda: [[_legacy_is_ring_aromatic(data, ring) for ring in rings] for (data, rings) in molecules],
+        )
+        (batch_time, batch) = _time(lambda: classify_rings_of_molecules(molecules))
+        print('{0:<26s} {1:>8d} {2:>12.4f} {3:>12.4f} {4:>10s}'.format(
+            '{0} x {1}'.format(name, n_molecules),
+            sum(len(rings) for (_, rings) in molecules),
+            legacy_time,
+            batch_time,
+            str(legacy == [[ring.aromatic for ring in rings] for rings in batch]),
+        ))
+
+
+def _scaling_exponent(sizes: List[int], timings: List[float]) -> float:
+    '''Least squares slope of log(time) against log(size); 1.0 means linear scaling.'''
+    from math import log
+    xs, ys = [log(x) for x in sizes], [log(y) for y in timings]
+    x_mean, y_mean = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - x_mean) * (y - y_mean) for (x, y) in zip(xs, ys)) / sum((x - x_mean) ** 2 for x in xs)
+
+
+def benchmark_scaling() -> None:
+    '''Time per atom of PDB ingestion and ITP rendering of growing alkanes (test_scaling.py checks the exponents).'''
+    from atb_outputs.itp import itp
+
+    sizes, pdb_timings, itp_timings = [], [], []
+    print('{0:>8s} {1:>12s} {2:>12s} {3:>14s} {4:>14s}'.format('atoms', 'PDB (s)', 'ITP (s)', 'PDB (us/atom)', 'ITP (us/atom)'))
+    for n_carbons in (400, 800, 1600, 3200, 6666):
+        pdb_str = pdb_string(alkane(n_carbons))
+        (pdb_time, data) = _time(lambda: MolData(pdb_str, build_ring=False), repeat=1)
+        with_topology(data)
+        (itp_time, _) = _time(lambda: (itp(data, united=False), itp(data, united=True)), repeat=1)
+        sizes.append(len(data.atoms))
+        pdb_timings.append(pdb_time)
+        itp_timings.append(itp_time)
+        print('{0:>8d} {1:>12.4f} {2:>12.4f} {3:>14.2f} {4:>14.2f}'.format(
+            len(data.atoms), pdb_time, itp_time, 1e6 * pdb_time / len(data.atoms), 1e6 * itp_time / len(data.atoms),
+        ))
+    exponents = (_scaling_exponent(sizes, pdb_timings), _scaling_exponent(sizes, itp_timings))
+    print('scaling exponents: PDB ingestion {0:.2f}, ITP rendering {1:.2f}'.format(*exponents))
+
+
+def benchmark_pdb_reader() -> None:
+    from io import BytesIO
+    from atb_outputs.pdb import read
+
+    print('{0:>8s} {1:>12s} {2:>12s} {3:>12s}'.format('atoms', 'str (s)', 'bytes (s)', 'MolData (s)'))
+    for n_carbons in (1000, 3000, 6666):
+        pdb_str = pdb_string(alkane(n_carbons))
+        pdb_bytes = pdb_str.encode()
+        (str_time, (atoms, _)) = _time(lambda: read(pdb_str))
+        (bytes_time, _) = _time(lambda: read(BytesIO(pdb_bytes)))
+        (mol_data_time, _) = _time(lambda: MolData(BytesIO(pdb_bytes), build_ring=False))
+        print('{0:>8d} {1:>12.4f} {2:>12.4f} {3:>12.4f}'.format(
+            len(atoms), str_time, bytes_time, mol_data_time,
+        ))
+
+
+def benchmark_stream(n_carbons: int = 60) -> None:
+    '''Throughput and peak memory of iter_mol_data over multi-model PDB files read from disk.'''
+    import tracemalloc
+    from tempfile import TemporaryDirectory
+
+    model = pdb_string(alkane(n_carbons)).replace('\nEND', '')
+    print('{0:>8s} {1:>10s} {2:>12s} {3:>14s}'.format('models', 'file (MB)', 'time (s)', 'peak (MB)'))
+    with TemporaryDirectory() as directory:
+        for n_models in (100, 400, 1600):
+            path = join(directory, 'models.pdb')
+            with open(path, 'w') as fh:
+                for i in range(1, n_models + 1):
+                    fh.write('MODEL {0:>8d}\n{1}\nENDMDL\n'.format(i, model))
+
+            def read_all() -> int:
+                with open(path) as fh:
+                    return sum(1 for _ in iter_mol_data(fh))
+
+            (elapsed, n_read) = _time(read_all, repeat=1)
+            assert n_read == n_models, n_read
+            tracemalloc.start()
+            read_all()
+            (_, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('{0:>8d} {1:>10.1f} {2:>12.3f} {3:>14.2f}'.format(
+                n_models, len(model) * n_models / 1e6, elapsed, peak / 1e6,
+            ))
+
+
+def benchmark_batch(n_molecules: int = 2000) -> None:
+    '''Throughput of MolData.from_many against the number of worker processes, on synthetic PDB strings.'''
+    from os import cpu_count
+
+    sources = [pdb_string(steroid(1) if i % 2 else alkane(40)) for i in range(n_molecules)]
+    worker_counts = sorted({1, 2} | {2 ** i for i in range(1, 8) if 2 ** i <= (cpu_count() or 1)})
+    print('# {0} CPUs'.format(cpu_count()))
+    print('{0:>8s} {1:>10s} {2:>12s} {3:>10s}'.format('workers', 'time (s)', 'molecules/s', 'speedup'))
+    serial_time = None
+    for max_workers in worker_counts:
+        (elapsed, results) = _time(lambda: list(MolData.from_many(sources, max_workers=max_workers, chunksize=32)), repeat=1)
+        assert all(result.error is None for result in results)
+        serial_time = serial_time or elapsed
+        print('{0:>8d} {1:>10.3f} {2:>12.1f} {3:>10.2f}'.format(
+            max_workers, elapsed, n_molecules / elapsed, serial_time / elapsed,
+        ))
+
+
+def benchmark_memory(n_copies: int = 10000) -> None:
+    '''
+    tracemalloc comparison of the dict and compact (slotted record) layouts of the atoms and bonds of 21.yaml,
+    replicated n_copies times (angles, dihedrals, etc. are held the same way in both layouts and left out).
+    '''
+    import pickle
+    import tracemalloc
+    from yaml import unsafe_load
+
+    with open(join(dirname(__file__), 'data', '21.yaml')) as fh:
+        mol_data_dict = unsafe_load(fh)
+    # Unpickling gives every replica its own objects, as reading n_copies molecules would
+    replica = pickle.dumps({key: mol_data_dict[key] for key in ('atoms', 'bonds')})
+
+    print('{0:>10s} {1:>10s} {2:>14s} {3:>14s} {4:>14s}'.format(
+        'layout', 'molecules', 'current (MB)', 'peak (MB)', 'per mol (kB)',
+    ))
+    results = {}
+    for compact in (False, True):
+        tracemalloc.start()
+        molecules = [mol_data_from_mol_data_dict(pickle.loads(replica), compact=compact) for _ in range(n_copies)]
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[compact] = current
+        print('{0:>10s} {1:>10d} {2:>14.1f} {3:>14.1f} {4:>14.2f}'.format(
+            'compact' if compact else 'dict', len(molecules), current / 1e6, peak / 1e6, current / len(molecules) / 1e3,
+        ))
+        del molecules
+    print('compact layout uses {0:.0%} of the memory of the dict layout'.format(results[True] / results[False]))
+
+
+def benchmark_fdb(max_legacy_atoms: int = 2000, n_molecules: int = 200) -> None:
+    '''MolData construction from (stub) FDBMolecules of 10 to 10k atoms, against the unindexed ingestion.'''
+    sizes, timings = [], []
+    print('{0:>8s} {1:>12s} {2:>12s} {3:>14s}'.format('atoms', 'indexed (s)', 'legacy (s)', 'us/atom'))
+    for n_carbons in (3, 33, 333, 3333):
+        molecule = FDBMolecule(alkane(n_carbons))
+        (indexed_time, data) = _time(lambda: MolData(molecule, build_ring=False))
+        if len(molecule.atoms) <= max_legacy_atoms:
+            legacy = MolData(None, build_ring=False)
+            (legacy_time, _) = _time(lambda: _legacy_read_fdb_molecule(legacy, molecule), repeat=1)
+            assert (legacy.atoms, legacy.bonds) == (data.atoms, data.bonds)
+            legacy_time = '{0:>12.4f}'.format(legacy_time)
+        else:
+            legacy_time = '{0:>12s}'.format('-')
+        sizes.append(len(data.atoms))
+        timings.append(indexed_time)
+        print('{0:>8d} {1:>12.4f} {2} {3:>14.2f}'.format(
+            len(data.atoms), indexed_time, legacy_time, 1e6 * indexed_time / len(data.atoms),
+        ))
+    print('scaling exponent: {0:.2f}'.format(_scaling_exponent(sizes, timings)))
+
+    molecules = [FDBMolecule(alkane(33)) for _ in range(n_molecules)]
+    (batch_time, results) = _time(lambda: list(mol_data_from_many_fdb_molecules(molecules, max_workers=1)), repeat=1)
+    assert all(result.error is None for result in results)
+    print('batch of {0} molecules: {1:.4f} s'.format(n_molecules, batch_time))
+
+
+def benchmark_render_all(n_carbons: int = 1000) -> None:
+    '''
+    formats.render_all against calling each writer separately, on an alkane with (made up) topology; the YAML writers
+    are left out, as their own costs dominate.
+    '''
+    from atb_outputs.formats import RENDER_TARGETS, render_all
+
+    targets = [target for target in sorted(RENDER_TARGETS) if target not in ('yml', 'template_yml')]
+    options = {'ccd_cif': {'comp_id': 'BEN', 'comp_id_3char': 'BEN'}}
+    data = with_topology(MolData(pdb_string(alkane(n_carbons))))
+    data.completed = lambda x: x == 'has_ocoord'
+
+    def separately() -> Dict[str, Any]:
+        outputs = {}
+        for target in targets:
+            (writer, kwargs, _) = RENDER_TARGETS[target]
+            outputs[target] = writer(data, **dict(kwargs, **options.get(target, {})))
+        return outputs
+
+    timings = {}
+    # Views are dropped before each run, as they would not exist yet for a newly read molecule
+    (separate_time, separate) = _time(lambda: (data.reset_united_atom_views(), separately())[1])
+    (together_time, together) = _time(lambda: (data.reset_united_atom_views(), render_all(data, targets, options=options, timings=timings))[1])
+    assert separate == together
+    print('{0:>12s} {1:>10s}'.format('target', 'time (s)'))
+    for target in targets:
+        print('{0:>12s} {1:>10.4f}'.format(target, timings[target]))
+    print('{0} atoms: separately {1:.4f} s, render_all {2:.4f} s ({3:.2f}x)'.format(
+        len(data.atoms), separate_time, together_time, separate_time / together_time,
+    ))
+
+
+def benchmark_ccd_cif(max_legacy_atoms: int = 4000) -> None:
+    '''
+    formats.ccd_cif on long alkanes (lipid tails, polyethylene) and a large PAH, against the writer before vectorized
+    C-H averaging (up to max_legacy_atoms, as it scales quadratically).
+    '''
+    from atb_outputs.formats import ccd_cif
+
+    print('{0:>20s} {1:>8s} {2:>10s} {3:>10s} {4:>12s}'.format('molecule', 'atoms', 'time (s)', 'legacy (s)', 'atoms/s'))
+    molecules = (
+        ('alkane(100)', alkane(100)),
+        ('alkane(1000)', alkane(1000)),
+        ('alkane(5000)', alkane(5000)),
+        ('pah(20, 20)', polycyclic_aromatic_hydrocarbon(20, 20)),
+    )
+    for (name, molecule) in molecules:
+        data = with_topology(MolData(pdb_string(molecule)))
+        (cif_time, cif) = _time(lambda: ccd_cif(data, 'BEN', 'BEN'))
+        if len(data.atoms) <= max_legacy_atoms:
+            (legacy_time, legacy) = _time(lambda: _legacy_ccd_cif(data, 'BEN', 'BEN'), repeat=1)
+            assert cif == legacy
+            legacy_time = '{0:>10.4f}'.format(legacy_time)
+        else:
+            legacy_time = '{0:>10s}'.format('-')
+        print('{0:>20s} {1:>8d} {2:>10.4f} {3} {4:>12.0f}'.format(
+            name, len(data.atoms), cif_time, legacy_time, len(data.atoms) / cif_time,
+        ))
+
+
+def benchmark_sinks(n_carbons: int = 5000) -> None:
+    '''
+    Time and peak memory of writing outputs to a gzip file through their string writers (formats.pdb, ...) against
+    streaming them into it (formats.write_pdb, ...).
+    '''
+    import gzip
+    import tracemalloc
+    from tempfile import TemporaryDirectory
+    from atb_outputs.formats import RENDER_TARGETS, WRITE_TARGETS
+
+    data = with_topology(MolData(pdb_string(alkane(n_carbons))))
+    data.completed = lambda x: x == 'has_ocoord'
+    # Views and coordinate arrays are derived up front, so that peaks only count the output itself
+    data.united_atom_view(False), data.united_atom_view(True), data.coordinate_array('ocoord')
+
+    print('{0:>12s} {1:>10s} {2:>12s} {3:>12s} {4:>14s} {5:>14s}'.format(
+        'target', 'out (MB)', 'string (s)', 'stream (s)', 'string (MB)', 'stream (MB)',
+    ))
+    with TemporaryDirectory() as directory:
+        path = join(directory, 'output.gz')
+        for target in ('pdb', 'g96', 'itp', 'ccd_cif'):
+            kwargs = {'comp_id': 'BEN', 'comp_id_3char': 'BEN'} if target == 'ccd_cif' else {}
+
+            def via_string() -> None:
+                with gzip.open(path, 'wb') as fh:
+                    fh.write(RENDER_TARGETS[target][0](data, **dict(RENDER_TARGETS[target][1], **kwargs)).encode('utf-8'))
+
+            def streamed() -> None:
+                with gzip.open(path, 'wb') as fh:
+                    WRITE_TARGETS[target][0](data, fh, **dict(WRITE_TARGETS[target][1], **kwargs))
+
+            results = []
+            for write in (via_string, streamed):
+                (elapsed, _) = _time(write)
+                with gzip.open(path, 'rb') as fh:
+                    results.append(fh.read())
+                tracemalloc.start()
+                write()
+                (_, peak) = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append((elapsed, peak))
+            assert results[0] == results[2]
+            print('{0:>12s} {1:>10.2f} {2:>12.4f} {3:>12.4f} {4:>14.2f} {5:>14.2f}'.format(
+                target, len(results[0]) / 1e6, results[1][0], results[3][0], results[1][1] / 1e6, results[3][1] / 1e6,
+            ))
+
+
+def benchmark_fixed_width() -> None:
+    '''Throughput of the PDB ATOM and g96 POSITION blocks, formatted in bulk and line by line (the former writers).'''
+    from io import StringIO
+    import atb_outputs.pdb as PDB
+    from atb_outputs.formats import G96_POSITION_FORMAT
+    from atb_outputs.fixed_width import format_blocks
+
+    def g96_positions(data: MolData, io: Any, view: Any, coords: Any) -> None:
+        columns = [1, data.var['rnme'], [atom['symbol'] for atom in view.atoms], view.indexes, coords]
+        for block in format_blocks(G96_POSITION_FORMAT, columns, len(view.atoms)):
+            io.write(block)
+
+    print('{0:>8s} {1:>8s} {2:>12s} {3:>12s} {4:>14s} {5:>8s}'.format(
+        'block', 'atoms', 'bulk (s)', 'legacy (s)', 'bulk atoms/s', 'speedup',
+    ))
+    for molecule in (alkane(1000), alkane(5000), lipid_patch(340, 50)):
+        data = with_topology(MolData(pdb_string(molecule), build_ring=False))
+        view = data.united_atom_view(False)
+        coords = data.coordinate_array('ocoord', view.ids)
+        writers = (
+            ('pdb', lambda io: PDB.atoms(data, io, view.atoms, view=view, coords=coords),
+             lambda io: _legacy_pdb_atoms(data, io, view.atoms, coords)),
+            ('g96', lambda io: g96_positions(data, io, view, coords),
+             lambda io: _legacy_g96_positions(data, io, view, coords)),
+        )
+        for (name, bulk, legacy) in writers:
+            outputs = []
+            timings = []
+            for write in (bulk, legacy):
+                (elapsed, io) = _time(lambda: (lambda io: (write(io), io)[1])(StringIO()))
+                outputs.append(io.getvalue())
+                timings.append(elapsed)
+            assert outputs[0] == outputs[1]
+            print('{0:>8s} {1:>8d} {2:>12.4f} {3:>12.4f} {4:>14.0f} {5:>7.2f}x'.format(
+                name, len(view.atoms), timings[0], timings[1], len(view.atoms) / timings[0], timings[1] / timings[0],
+            ))
+
+
+def benchmark_neighbours() -> None:
+    '''
+    1-4 neighbours of all-atom and united-atom molecules (itp.calculate_1_4_neighbours), from a new neighbour shell
+    engine each time, against the atom by atom search it replaced.
+    '''
+    from atb_outputs.itp import calculate_1_4_neighbours
+    from atb_outputs.neighbours import NeighbourShells
+
+    print('{0:>8s} {1:>8s} {2:>12s} {3:>12s} {4:>8s}'.format('united', 'atoms', 'shells (s)', 'legacy (s)', 'speedup'))
+    for molecule in (alkane(1000), polycyclic_aromatic_hydrocarbon(20, 20), alkane(5000), lipid_patch(340, 50)):
+        data = with_topology(MolData(pdb_string(molecule), build_ring=False))
+        for united in (False, True):
+            view = data.united_atom_view(united)
+            # A new engine each time, rather than the one cached by the view
+            (elapsed, nbr3) = _time(lambda: NeighbourShells(view.topology_conn).neighbours(3, upper=True))
+            (legacy_elapsed, legacy_nbr3) = _time(lambda: _legacy_calculate_1_4_neighbours(data, united), repeat=1)
+            nbr3_in_atoms_order = calculate_1_4_neighbours(data, united)
+            assert nbr3 == legacy_nbr3 == nbr3_in_atoms_order
+            assert list(nbr3_in_atoms_order) == list(legacy_nbr3)
+            print('{0:>8s} {1:>8d} {2:>12.4f} {3:>12.4f} {4:>7.1f}x'.format(
+                str(united), len(view.atoms), elapsed, legacy_elapsed, legacy_elapsed / elapsed,
+            ))
+
+
+def benchmark_itp() -> None:
+    '''
+    itp.itp (all-atom and united-atom) of molecules with (made up) topology, against the line by line writer it replaced,
+    with charges and with missing charges ('%%' placeholders) and parameters.
+    '''
+    from atb_outputs.itp import itp
+
+    print('{0:>8s} {1:>8s} {2:>8s} {3:>12s} {4:>12s} {5:>8s}'.format('charges', 'united', 'atoms', 'bulk (s)', 'legacy (s)', 'speedup'))
+    for molecule in (alkane(300), alkane(1000), alkane(5000), lipid_patch(340, 50)):
+        data = with_topology(MolData(pdb_string(molecule), build_ring=False))
+        for charges in (True, False):
+            if not charges:
+                for atom in data.atoms.values():
+                    atom.pop('charge')
+                for term in data.bonds[::2] + data.angles[::2] + data.dihedrals[::2]:
+                    term['code'] = []
+            for united in (False, True):
+                (elapsed, output) = _time(lambda: itp(data, united=united))
+                (legacy_elapsed, legacy_output) = _time(lambda: _legacy_itp(data, united))
+                assert output == legacy_output
+                print('{0:>8s} {1:>8s} {2:>8d} {3:>12.4f} {4:>12.4f} {5:>7.2f}x'.format(
+                    str(charges), str(united), len(data.united_atom_view(united).atoms), elapsed, legacy_elapsed,
+                    legacy_elapsed / elapsed,
+                ))
+
+
+def benchmark_itp_variants() -> None:
+    '''
+    All-atom and united-atom itps of molecules with (made up) topology from itp.itp_variants, against two independent
+    itp.itp calls. Views are reset before each run, so that none reuses the work of another.
+    '''
+    from atb_outputs.itp import itp, itp_variants
+
+    def independent(data: MolData) -> Dict[str, str]:
+        data.reset_united_atom_views()
+        return {'all': itp(data), 'united': itp(data, united=True)}
+
+    def variants(data: MolData) -> Dict[str, str]:
+        data.reset_united_atom_views()
+        return itp_variants(data)
+
+    print('{0:>8s} {1:>12s} {2:>12s} {3:>8s}'.format('atoms', 'two (s)', 'variants (s)', 'speedup'))
+    molecules = (alkane(300), polycyclic_aromatic_hydrocarbon(20, 20), alkane(5000), lipid_patch(340, 50))
+    for molecule in molecules:
+        data = with_topology(MolData(pdb_string(molecule), build_ring=False))
+        (two_time, two) = _time(lambda: independent(data), repeat=5)
+        (variants_time, outputs) = _time(lambda: variants(data), repeat=5)
+        assert two == outputs
+        print('{0:>8d} {1:>12.4f} {2:>12.4f} {3:>7.2f}x'.format(
+            len(data.atoms), two_time, variants_time, two_time / variants_time,
+        ))
+
+
+def benchmark_system_topology(n_species: int = 4) -> None:
+    '''
+    System topologies (topology.system_topology) of mixtures of n_species alkanes, each instance a MolData of its own
+    (in shuffled order), against rendering an itp per instance, and for the same system given as one pair per species.
+    '''
+    from random import Random
+    from atb_outputs.itp import itp
+    from atb_outputs.topology import system_topology
+
+    species = []
+    for i in range(n_species):
+        data = with_topology(MolData(pdb_string(alkane(20 + 10 * i)), build_ring=False))
+        data.var['rnme'] = 'A{0}'.format(i)
+        species.append(data)
+    print('{0:>10s} {1:>12s} {2:>12s} {3:>12s} {4:>8s}'.format('instances', 'top (s)', 'per itp (s)', 'species (s)', 'speedup'))
+    for n_instances in (10, 100, 1000):
+        instances = [deepcopy(species[i % n_species]) for i in range(n_instances)]
+        Random(0).shuffle(instances)
+        (top_time, top) = _time(lambda: system_topology([(data, 1) for data in instances]), repeat=1)
+        (itp_time, _) = _time(lambda: [itp(data) for data in instances], repeat=1)
+        (species_time, _) = _time(lambda: system_topology([(data, n_instances // n_species) for data in species]))
+        assert top.count('[ moleculetype ]') == n_species
+        print('{0:>10d} {1:>12.4f} {2:>12.4f} {3:>12.4f} {4:>7.1f}x'.format(
+            n_instances, top_time, itp_time, species_time, itp_time / top_time,
+        ))
+
+
+def benchmark_cache(n_carbons: int = 1000) -> None:
+    '''
+    Time to get outputs through cache.OutputCache: rendered (miss), from memory, and from disk (with a new cache on the
+    same directory), on an alkane with (made up) topology. Hits still hash the fields each writer reads.
+    '''
+    from tempfile import TemporaryDirectory
+    from atb_outputs.cache import OutputCache
+
+    data = with_topology(MolData(pdb_string(alkane(n_carbons))))
+    data.completed = lambda x: x == 'has_ocoord'
+    print('{0:>14s} {1:>12s} {2:>12s} {3:>12s}'.format('target', 'miss (s)', 'memory (s)', 'disk (s)'))
+    with TemporaryDirectory() as directory:
+        cache = OutputCache(directory=directory)
+        for target in ('pdb', 'pdb_united', 'g96', 'itp', 'itp_united', 'yml', 'template_yml', 'ccd_cif', 'lgf'):
+            kwargs = {'comp_id': 'BEN', 'comp_id_3char': 'BEN'} if target == 'ccd_cif' else {}
+            (miss_time, output) = _time(lambda: cache.render(data, target, **kwargs), repeat=1)
+            (memory_time, cached) = _time(lambda: cache.render(data, target, **kwargs))
+            (disk_time, from_disk) = _time(lambda: OutputCache(directory=directory).render(data, target, **kwargs))
+            assert output == cached == from_disk
+            print('{0:>14s} {1:>12.4f} {2:>12.4f} {3:>12.4f}'.format(target, miss_time, memory_time, disk_time))
+        print(cache.stats())
+
+
+def benchmark_yml() -> None:
+    '''YAML output of mol_data_dicts with topology: yaml.dump and regex comments, against YML.dump_yml to a file.'''
+    from tempfile import TemporaryDirectory
+    import numpy as np
+    import yaml
+    from atb_outputs.formats import mol_data_dict
+    from atb_outputs.yml import Dumper, add_yml_comments, dump_yml
+
+    print('# dump_yml emitter: {0}'.format(Dumper.__name__))
+    print('{0:>8s} {1:>10s} {2:>12s} {3:>12s} {4:>10s}'.format('atoms', 'dihedrals', 'legacy (s)', 'dump_yml (s)', 'speedup'))
+    with TemporaryDirectory() as directory:
+        for n_carbons in (100, 300, 1000):
+            data = mol_data_dict(with_topology(MolData(pdb_string(alkane(n_carbons)))))
+            (legacy_time, legacy) = _time(lambda: add_yml_comments(yaml.dump(data)), repeat=1)
+
+            def to_file() -> None:
+                with open(join(directory, 'molecule.yml'), 'w') as fh:
+                    dump_yml(data, fh)
+
+            (dump_time, _) = _time(to_file, repeat=1)
+            with open(join(directory, 'molecule.yml')) as fh:
+                assert fh.read() == legacy
+            print('{0:>8d} {1:>10d} {2:>12.3f} {3:>12.3f} {4:>10.2f}'.format(
+                len(data['atoms']), len(data['dihedrals']), legacy_time, dump_time, legacy_time / dump_time,
+            ))
+
+        # A numpy scalar held in two sections is written with anchors numbered across the whole document
+        data = mol_data_dict(with_topology(MolData(pdb_string(alkane(10)))))
+        data['atoms'][1]['charge'] = data['var']['total_charge'] = np.float64(data['atoms'][1]['charge'])
+        with open(join(directory, 'molecule.yml'), 'w') as fh:
+            dump_yml(data, fh)
+        with open(join(directory, 'molecule.yml')) as fh:
+            assert fh.read() == add_yml_comments(yaml.dump(data))
+
+
+def benchmark_pickle() -> None:
+    '''
+    Payload size and dumps/loads times of formats.pickle (a mol_data_dict, loaded back into a MolData), against pickling
+    MolData itself (MolData.__reduce__), in band and with protocol 5 out of band buffers (atb_outputs.pickling).
+    '''
+    import pickle
+    from atb_outputs.formats import mol_data_dict, pickle as pickle_output
+    from atb_outputs import pickling
+
+    def buffers_size(buffers: List[Any]) -> int:
+        return sum(memoryview(buffer).nbytes for buffer in buffers)
+
+    print('{0:>8s} {1:<22s} {2:>12s} {3:>12s} {4:>10s} {5:>10s}'.format(
+        'atoms', 'method', 'pickle (kB)', 'buffers (kB)', 'dumps (s)', 'loads (s)',
+    ))
+    for n_carbons in (100, 1000, 5000):
+        data = with_topology(MolData(pdb_string(alkane(n_carbons))))
+        # Instance attributes holding functions cannot be pickled
+        del data.completed
+        reference = mol_data_dict(data)
+        methods = (
+            ('formats.pickle', lambda: (pickle_output(data), []),
+             lambda payload, buffers: mol_data_from_mol_data_dict(pickle.loads(payload))),
+            ('MolData, in band', lambda: (pickle.dumps(data, protocol=pickling.PROTOCOL), []),
+             lambda payload, buffers: pickle.loads(payload)),
+            ('MolData, out of band', lambda: pickling.dumps(data), pickling.loads),
+        )
+        for (name, dumps, loads) in methods:
+            (dumps_time, (payload, buffers)) = _time(dumps)
+            (loads_time, loaded) = _time(lambda: loads(payload, buffers))
+            assert mol_data_dict(loaded) == reference
+            print('{0:>8d} {1:<22s} {2:>12.1f} {3:>12.1f} {4:>10.4f} {5:>10.4f}'.format(
+                len(data.atoms), name, len(payload) / 1e3, buffers_size(buffers) / 1e3, dumps_time, loads_time,
+            ))
+
+
+def benchmark_columnar() -> None:
+    '''
+    Load times of a mol_data_dict from YAML (as written by formats.yml), pickle (formats.pickle) and the columnar format
+    (formats.columnar), up to a MolData; the columnar file is timed lazily (one atom looked up) and fully decoded.
+    '''
+    import pickle
+    from tempfile import TemporaryDirectory
+    import yaml
+    from atb_outputs.formats import mol_data_dict, columnar, yml
+    from atb_outputs.mol_data import mol_data_from_columnar
+    try:
+        from yaml import CUnsafeLoader as Loader
+    except ImportError:
+        from yaml import UnsafeLoader as Loader
+
+    print('{0:>8s} {1:>10s} {2:>10s} {3:>12s} {4:>12s} {5:>14s} {6:>14s}'.format(
+        'atoms', 'YAML (s)', 'pickle (s)', 'lazy col (s)', 'full col (s)', 'YAML/full col', 'pickle/full col',
+    ))
+    with TemporaryDirectory() as directory:
+        for n_carbons in (100, 1000, 5000):
+            data = with_topology(MolData(pdb_string(alkane(n_carbons))))
+            reference = mol_data_dict(data)
+            paths = {extension: join(directory, 'molecule.' + extension) for extension in ('yml', 'pkl', 'col')}
+            with open(paths['yml'], 'w') as fh:
+                fh.write(yml(data))
+            with open(paths['pkl'], 'wb') as fh:
+                fh.write(pickle.dumps(reference))
+            with open(paths['col'], 'wb') as fh:
+                fh.write(columnar(data))
+
+            def from_yaml() -> MolData:
+                with open(paths['yml']) as fh:
+                    return mol_data_from_mol_data_dict(yaml.load(fh, Loader=Loader))
+
+            def from_pickle() -> MolData:
+                with open(paths['pkl'], 'rb') as fh:
+                    return mol_data_from_mol_data_dict(pickle.load(fh))
+
+            def from_columnar(lookup: Callable[[MolData], Any]) -> MolData:
+                loaded = mol_data_from_columnar(paths['col'])
+                lookup(loaded)
+                return loaded
+
+            (yaml_time, _) = _time(from_yaml, repeat=1)
+            (pickle_time, _) = _time(from_pickle)
+            (lazy_time, _) = _time(lambda: from_columnar(lambda loaded: loaded.atoms[1]))
+            (full_time, loaded) = _time(lambda: from_columnar(lambda loaded: dict(loaded.atoms)))
+            assert mol_data_dict(loaded) == reference
+            print('{0:>8d} {1:>10.4f} {2:>10.4f} {3:>12.5f} {4:>12.4f} {5:>14.1f} {6:>14.1f}'.format(
+                len(data.atoms), yaml_time, pickle_time, lazy_time, full_time, yaml_time / full_time, pickle_time / full_time,
+            ))
+
+
+BENCHMARKS = {
+    'batch': benchmark_batch,
+    'cache': benchmark_cache,
+    'ccd_cif': benchmark_ccd_cif,
+    'columnar': benchmark_columnar,
+    'fdb': benchmark_fdb,
+    'fixed_width': benchmark_fixed_width,
+    'itp': benchmark_itp,
+    'itp_variants': benchmark_itp_variants,
+    'memory': benchmark_memory,
+    'neighbours': benchmark_neighbours,
+    'pdb_reader': benchmark_pdb_reader,
+    'pickle': benchmark_pickle,
+    'render_all': benchmark_render_all,
+    'ring_classification': benchmark_ring_classification,
+    'rings': benchmark_ring_perception,
+    'scaling': benchmark_scaling,
+    'sinks': benchmark_sinks,
+    'stream': benchmark_stream,
+    'system_topology': benchmark_system_topology,
+    'yml': benchmark_yml,
+}
+
+
+if __name__ == '__main__':
+    for name in (argv[1:] or sorted(BENCHMARKS)):
+        print('# {0}'.format(name))
+        BENCHMARKS[name]()
@@ -0,0 +1,105 @@
+import os
+
+from atb_outputs import formats
+from atb_outputs.cache import DISK_SUFFIX, OutputCache
+from atb_outputs.mol_data import MolData
+
+from benchmarks import alkane, pdb_string, with_topology
+
+
+def molecule(n_carbons: int = 10) -> MolData:
+    return with_topology(MolData(pdb_string(alkane(n_carbons))))
+
+
+def test_hit_and_miss() -> None:
+    data = molecule()
+    cache = OutputCache()
+    output = cache.render(data, 'itp')
+    assert output == formats.ITP.itp(data)
+    assert cache.render(data, 'itp') is output
+    assert cache.render(data, 'itp_united') == formats.ITP.itp(data, united=True)
+    stats = cache.stats()
+    assert (stats.hits, stats.misses) == (1, 2)
+    assert len(cache) == 2
+
+
+def test_keys_follow_what_the_writer_reads() -> None:
+    data = molecule()
+    cache = OutputCache()
+    (itp_key, pdb_key) = (cache.key(data, 'itp'), cache.key(data, 'pdb'))
+    assert cache.key(data, 'itp', united=True) != itp_key
+
+    # The itp does not read coordinates, the pdb does
+    data.set_coordinates('coord', data.coordinate_array('coord') + 1.0)
+    data.set_coordinates('ocoord', data.coordinate_array('ocoord') + 1.0)
+    assert cache.key(data, 'itp') == itp_key
+    assert cache.key(data, 'pdb') != pdb_key
+
+    next(iter(data.atoms.values()))['charge'] = 0.5
+    assert cache.key(data, 'itp') != itp_key
+
+
+def test_invalidate() -> None:
+    data = molecule()
+    cache = OutputCache()
+    cache.render(data, 'g96')
+    assert cache.invalidate_output(data, 'g96')
+    assert not cache.invalidate_output(data, 'g96')
+    assert cache.key(data, 'g96') not in cache
+    cache.render(data, 'g96')
+    stats = cache.stats()
+    assert (stats.misses, stats.invalidations) == (2, 1)
+
+
+def test_memory_eviction_is_least_recently_used() -> None:
+    molecules = [molecule(n_carbons) for n_carbons in (4, 5, 6)]
+    cache = OutputCache(max_entries=2)
+    keys = [cache.key(data, 'g96') for data in molecules]
+    cache.render(molecules[0], 'g96')
+    cache.render(molecules[1], 'g96')
+    cache.render(molecules[0], 'g96')
+    cache.render(molecules[2], 'g96')
+    assert keys[0] in cache and keys[2] in cache and keys[1] not in cache
+    assert cache.stats().evictions == 1
+
+    outputs = [formats.g96(data) for data in molecules]
+    cache = OutputCache(max_bytes=len(outputs[2]) + len(outputs[1]))
+    for data in molecules:
+        cache.render(data, 'g96')
+    assert len(cache) == 2 and keys[0] not in cache
+
+
+def test_disk_tier(tmp_path) -> None:
+    directory = str(tmp_path / 'cache')
+    molecules = [molecule(n_carbons) for n_carbons in (4, 5, 6)]
+    outputs = [formats.g96(data) for data in molecules]
+    cache = OutputCache(max_entries=1, directory=directory)
+    for data in molecules:
+        cache.render(data, 'g96')
+    assert len(cache) == 1 and len(os.listdir(directory)) == 3
+
+    # Outputs evicted from memory, or stored by another cache, are found on disk
+    for cache in (cache, OutputCache(directory=directory)):
+        assert cache.render(molecules[0], 'g96') == outputs[0]
+        assert cache.stats().disk_hits == 1
+
+    cache.clear()
+    assert os.listdir(directory) == [] and len(cache) == 0
+
+
+def test_disk_eviction(tmp_path) -> None:
+    directory = str(tmp_path / 'cache')
+    molecules = [molecule(n_carbons) for n_carbons in (4, 5, 6)]
+    cache = OutputCache(directory=directory)
+    for data in molecules:
+        cache.render(data, 'g96')
+    paths = [os.path.join(directory, cache.key(data, 'g96') + DISK_SUFFIX) for data in molecules]
+    sizes = [os.path.getsize(path) for path in paths]
+    os.remove(paths[2])
+    # The least recently used output goes first
+    os.utime(paths[0], (0, 0))
+
+    cache = OutputCache(directory=directory, max_disk_bytes=sizes[1] + sizes[2])
+    cache.render(molecules[2], 'g96')
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+    assert cache.stats().disk_evictions == 1
@@ -0,0 +1,77 @@
+import os
+import pickle
+import shutil
+from os.path import dirname, join
+
+import pytest
+from yaml import unsafe_load
+
+from atb_outputs.cli import find_sources, load_mol_data, main
+from atb_outputs.formats import columnar, pdb
+from atb_outputs.mol_data import mol_data_from_mol_data_dict
+
+TOLUENE = join(dirname(__file__), 'data', '21.yaml')
+
+
+@pytest.fixture
+def tree(tmp_path):
+    # in/a/toluene.yaml, in/b/nested/copy.pickle, in/b/wide.columnar and in/b/notes.txt (not a source)
+    with open(TOLUENE) as fh:
+        mol_data_dict = unsafe_load(fh)
+    os.makedirs(str(tmp_path / 'in' / 'a'))
+    os.makedirs(str(tmp_path / 'in' / 'b' / 'nested'))
+    shutil.copy(TOLUENE, str(tmp_path / 'in' / 'a' / 'toluene.yaml'))
+    with open(str(tmp_path / 'in' / 'b' / 'nested' / 'copy.pickle'), 'wb') as fh:
+        pickle.dump(mol_data_dict, fh)
+    with open(str(tmp_path / 'in' / 'b' / 'wide.columnar'), 'wb') as fh:
+        fh.write(columnar(mol_data_from_mol_data_dict(mol_data_dict)))
+    with open(str(tmp_path / 'in' / 'b' / 'notes.txt'), 'w') as fh:
+        fh.write('not a molecule\n')
+    return tmp_path
+
+
+def test_find_sources(tree) -> None:
+    root = str(tree / 'in')
+    manifest = str(tree / 'manifest')
+    with open(manifest, 'w') as fh:
+        fh.write('# sources\n\nin/a/toluene.yaml\n')
+    assert find_sources([join(root, 'b'), join(root, 'a')], manifest=manifest) == [
+        join(root, 'b', 'wide.columnar'),
+        join(root, 'b', 'nested', 'copy.pickle'),
+        join(root, 'a', 'toluene.yaml'),
+        join(str(tree), 'in/a/toluene.yaml'),
+    ]
+
+
+def test_converts_a_tree(tree, capsys) -> None:
+    output = str(tree / 'out')
+    assert main([str(tree / 'in'), '-o', output, '-f', 'pdb,itp,yml', '-j', '1', '-q']) == 0
+    assert sorted(os.listdir(output)) == ['copy', 'toluene', 'wide']
+    assert sorted(os.listdir(join(output, 'toluene'))) == ['toluene.itp', 'toluene.pdb', 'toluene.yml']
+    with open(join(output, 'wide', 'wide.pdb')) as fh:
+        assert fh.read() == pdb(load_mol_data(TOLUENE))
+    summary = capsys.readouterr().out
+    assert summary.startswith('3 molecules') and '0 failures' in summary
+
+    # A second run replaces the outputs in place
+    assert main([str(tree / 'in' / 'a'), '-o', output, '-f', 'pdb', '-j', '1', '-q']) == 0
+    assert os.listdir(join(output, 'toluene')) == ['toluene.pdb']
+    assert not [name for name in os.listdir(output) if name.startswith('.')]
+
+
+def test_reports_failures(tree, capsys) -> None:
+    with open(str(tree / 'in' / 'a' / 'broken.yaml'), 'w') as fh:
+        fh.write('atoms: [')
+    output = str(tree / 'out')
+    assert main([str(tree / 'in' / 'a'), '-o', output, '-f', 'pdb', '-j', '1', '-q']) == 1
+    assert os.listdir(output) == ['toluene']
+    assert '1 failures' in capsys.readouterr().out
+
+
+def test_rejects_sources_with_the_same_name(tree, capsys) -> None:
+    shutil.copy(TOLUENE, str(tree / 'in' / 'b' / 'toluene.yaml'))
+    with pytest.raises(SystemExit) as raised:
+        main([str(tree / 'in'), '-o', str(tree / 'out'), '-q'])
+    assert raised.value.code == 2
+    assert 'toluene.yaml' in capsys.readouterr().err
+    assert not os.path.exists(str(tree / 'out'))
@@ -0,0 +1,51 @@
+from typing import List
+
+from atb_outputs.pdb import conect_fields, conect_neighbours, iter_models, read
+
+ATOM_LINE = 'HETATM{0:>5d} {1:>4s} BEN     0    {2:8.3f}{3:8.3f}{4:8.3f}  1.00  0.00           C'
+
+
+def pdb_lines(serials: List[int], conect: List[str]) -> str:
+    atoms = [ATOM_LINE.format(serial, 'C{0}'.format(serial % 1000), 1.0 * i, 2.0, 3.0) for (i, serial) in enumerate(serials)]
+    return '\n'.join(atoms + conect + ['END'])
+
+
+def test_conect_fields_below_10000() -> None:
+    assert conect_fields('CONECT    1    2    3') == ['CONECT', '1', '2', '3']
+    assert conect_neighbours(conect_fields('CONECT    1    2    0    3')) == [2]
+
+
+def test_conect_fields_over_9999() -> None:
+    # Serials above 9999 fill their whole field and run into each other, and into the record name
+    assert conect_fields('CONECT 99991000010001') == ['CONECT', '9999', '10000', '10001']
+    assert conect_fields('CONECT10000 999910001') == ['CONECT', '10000', '9999', '10001']
+    assert conect_neighbours(conect_fields('CONECT10000 999910001')) == [9999, 10001]
+
+
+def test_read_conect_over_9999() -> None:
+    serials = [9998, 9999, 10000, 10001]
+    (atoms, conect) = read(pdb_lines(serials, [
+        'CONECT 9998 9999',
+        'CONECT 9999 999810000',
+        'CONECT10000 999910001',
+        'CONECT1000110000',
+    ]))
+    assert sorted(atoms) == serials
+    assert conect == {9998: [9999], 9999: [9998, 10000], 10000: [9999, 10001], 10001: [10000]}
+    assert atoms[10001]['coord'] == [0.3, 0.2, 0.3]
+
+
+def test_read_sources() -> None:
+    text = pdb_lines([1, 2], ['CONECT    1    2', 'CONECT    2    1'])
+    expected = read(text)
+    assert read(text.encode()) == expected
+    assert read(text.replace('\n', '\r\n').encode()) == expected
+
+
+def test_iter_models() -> None:
+    model = pdb_lines([1, 2], ['CONECT    1    2', 'CONECT    2    1']).replace('\nEND', '')
+    text = '\n'.join(['MODEL 1', model, 'ENDMDL', 'MODEL 2', model, 'HETATM    x', 'ENDMDL', 'MODEL 3', model, 'ENDMDL'])
+    models = list(iter_models(text))
+    assert len(models) == 3
+    assert models[0][1] == models[2][1] == {1: [2], 2: [1]}
+    assert models[1][0] is None and isinstance(models[1][2], ValueError)
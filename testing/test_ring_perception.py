@@ -0,0 +1,82 @@
+from typing import List, Tuple
+
+from atb_outputs.helpers.ring_perception import relevant_cycles, smallest_set_of_smallest_rings
+from atb_outputs.mol_data import MolData, build_rings
+
+from benchmarks import pdb_string, polycyclic_aromatic_hydrocarbon, steroid
+
+
+def adjacency(n_atoms: int, bonds: List[Tuple[int, int]]) -> List[List[int]]:
+    neighbours = [[] for _ in range(n_atoms)]
+    for (i, j) in bonds:
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+    return [sorted(atom_neighbours) for atom_neighbours in neighbours]
+
+
+def ring_sizes(rings: List[List[int]]) -> List[int]:
+    return sorted(len(ring) for ring in rings)
+
+
+def assert_cycles(rings: List[List[int]], graph: List[List[int]]) -> None:
+    for ring in rings:
+        assert len(set(ring)) == len(ring)
+        assert all(ring[(i + 1) % len(ring)] in graph[atom] for (i, atom) in enumerate(ring))
+
+
+# Fused: two hexagons sharing the 0-5 bond
+NAPHTHALENE = adjacency(10, [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 0), (5, 6), (6, 7), (7, 8), (8, 9), (9, 0)])
+# Bridged: bridgeheads 0 and 3, joined by bridges of 2, 2 and 1 atoms
+NORBORNANE = adjacency(7, [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 0), (0, 6), (6, 3)])
+# Bridged: bridgeheads 0 and 1, joined by three bridges of 2 atoms
+BICYCLOOCTANE = adjacency(8, [(0, 2), (2, 3), (3, 1), (0, 4), (4, 5), (5, 1), (0, 6), (6, 7), (7, 1)])
+CUBANE = adjacency(8, [(0, 1), (1, 2), (2, 3), (3, 0), (4, 5), (5, 6), (6, 7), (7, 4), (0, 4), (1, 5), (2, 6), (3, 7)])
+# A ring with a chain attached and a separate ring joined to it by a bridge
+TAILED = adjacency(11, [(0, 1), (1, 2), (2, 0), (2, 3), (3, 4), (4, 5), (5, 6), (6, 7), (7, 8), (8, 5), (0, 9), (9, 10)])
+
+
+def test_fused_rings() -> None:
+    for find_rings in (smallest_set_of_smallest_rings, relevant_cycles):
+        rings = find_rings(NAPHTHALENE)
+        assert ring_sizes(rings) == [6, 6]
+        assert_cycles(rings, NAPHTHALENE)
+
+
+def test_bridged_rings() -> None:
+    rings = smallest_set_of_smallest_rings(NORBORNANE)
+    assert ring_sizes(rings) == [5, 5]
+    assert_cycles(rings, NORBORNANE)
+    assert ring_sizes(relevant_cycles(NORBORNANE)) == [5, 5]
+
+
+def test_relevant_cycles_include_every_smallest_set() -> None:
+    assert ring_sizes(smallest_set_of_smallest_rings(BICYCLOOCTANE)) == [6, 6]
+    rings = relevant_cycles(BICYCLOOCTANE)
+    assert ring_sizes(rings) == [6, 6, 6]
+    assert_cycles(rings, BICYCLOOCTANE)
+
+    assert ring_sizes(smallest_set_of_smallest_rings(CUBANE)) == [4] * 5
+    assert ring_sizes(relevant_cycles(CUBANE)) == [4] * 6
+
+
+def test_acyclic_parts_are_ignored() -> None:
+    rings = smallest_set_of_smallest_rings(TAILED)
+    assert sorted(map(sorted, rings)) == [[0, 1, 2], [5, 6, 7, 8]]
+    assert smallest_set_of_smallest_rings(adjacency(4, [(0, 1), (1, 2), (2, 3)])) == []
+
+
+def test_build_rings_of_molecules() -> None:
+    data = MolData(pdb_string(polycyclic_aromatic_hydrocarbon(1, 3)))
+    rings = build_rings(data)
+    assert sorted(rings) == [1, 2, 3]
+    assert [len(ring['atoms']) for ring in rings.values()] == [6, 6, 6]
+    assert all(ring['aromatic'] for ring in rings.values())
+    for ring in rings.values():
+        atoms = ring['atoms']
+        assert all(atoms[(i + 1) % len(atoms)] in data.atoms[atom_id]['conn'] for (i, atom_id) in enumerate(atoms))
+
+    data = MolData(pdb_string(steroid(1)))
+    rings = build_rings(data)
+    assert sorted(len(ring['atoms']) for ring in rings.values()) == [5, 6, 6, 6]
+    assert not any(ring['aromatic'] for ring in rings.values())
+    assert build_rings(data, relevant_cycles=True) == rings
@@ -0,0 +1,33 @@
+from atb_outputs.itp import itp
+from atb_outputs.mol_data import MolData
+
+from benchmarks import alkane, pdb_string, with_topology, _scaling_exponent, _time
+
+MAX_EXPONENT = 1.3
+
+
+def test_pdb_ingestion_and_itp_rendering_scale_linearly() -> None:
+    sizes, pdb_timings, itp_timings = [], [], []
+    for n_carbons in (500, 1000, 2000, 4000):
+        pdb_str = pdb_string(alkane(n_carbons))
+        (pdb_time, data) = _time(lambda: MolData(pdb_str, build_ring=False), repeat=5)
+        with_topology(data)
+        (itp_time, _) = _time(
+            lambda: (data.reset_united_atom_views(), itp(data, united=False), itp(data, united=True)), repeat=5,
+        )
+        sizes.append(len(data.atoms))
+        pdb_timings.append(pdb_time)
+        itp_timings.append(itp_time)
+    assert _scaling_exponent(sizes, pdb_timings) < MAX_EXPONENT
+    assert _scaling_exponent(sizes, itp_timings) < MAX_EXPONENT
+
+
+def test_molecules_over_9999_atoms_are_read_whole() -> None:
+    (types, coords, bonds) = alkane(3400)
+    data = MolData(pdb_string((types, coords, bonds)), build_ring=False)
+    assert len(data.atoms) == len(types) > 9999
+    assert len(data.bonds) == len(bonds)
+    assert sorted(data.atoms[10001]['conn']) == sorted(
+        [j for (i, j) in bonds if i == 10001] + [i for (i, j) in bonds if j == 10001]
+    )
+    assert data.get_id(10001) == 10001
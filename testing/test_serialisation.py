@@ -0,0 +1,70 @@
+import pickle
+from copy import deepcopy
+from os.path import dirname, join
+
+import pytest
+from yaml import unsafe_load
+
+from atb_outputs import columnar, pickling
+from atb_outputs.formats import mol_data_dict, columnar as columnar_output, pickle as pickle_output, pdb
+from atb_outputs.mol_data import MolData, mol_data_from_columnar, mol_data_from_mol_data_dict
+
+from benchmarks import pdb_string, steroid, with_topology
+
+
+def toluene() -> MolData:
+    with open(join(dirname(__file__), 'data', '21.yaml')) as fh:
+        return mol_data_from_mol_data_dict(unsafe_load(fh))
+
+
+def topology_molecule(compact: bool = False) -> MolData:
+    data = with_topology(MolData(pdb_string(steroid(1))))
+    # The completion flags set by with_topology are a lambda, which cannot be pickled
+    del data.completed
+    if compact:
+        data.compact()
+    return data
+
+
+@pytest.mark.parametrize('make', [toluene, topology_molecule, lambda: topology_molecule(compact=True)])
+def test_columnar_round_trip(make, tmp_path) -> None:
+    data = make()
+    reference = mol_data_dict(data)
+    assert columnar.loads(columnar.dumps(reference)).to_dict() == reference
+
+    path = str(tmp_path / 'molecule.columnar')
+    with open(path, 'wb') as fh:
+        fh.write(columnar_output(data))
+    for mmap in (True, False):
+        loaded = mol_data_from_columnar(path, mmap=mmap)
+        # Atoms are decoded one at a time as they are looked up, then all at once
+        atom_id = next(iter(reference['atoms']))
+        assert loaded.atoms[atom_id] == reference['atoms'][atom_id]
+        assert mol_data_dict(loaded) == reference
+
+
+def test_columnar_keeps_what_it_cannot_store_as_columns() -> None:
+    reference = mol_data_dict(toluene())
+    reference['var'] = dict(reference['var'], mixed=[1, 'two', (3.0,)], nothing=None)
+    reference['atoms'][next(iter(reference['atoms']))]['extra'] = {'nested': [1, 2]}
+    assert columnar.loads(columnar.dumps(reference)).to_dict() == reference
+
+
+@pytest.mark.parametrize('make', [toluene, topology_molecule, lambda: topology_molecule(compact=True)])
+def test_pickle_round_trip(make) -> None:
+    data = make()
+    reference = mol_data_dict(data)
+    assert pickle.loads(pickle_output(data)) == reference
+    assert mol_data_dict(pickle.loads(pickle.dumps(data))) == reference
+    assert mol_data_dict(deepcopy(data)) == reference
+    (payload, buffers) = pickling.dumps(data)
+    assert mol_data_dict(pickling.loads(payload, [bytes(buffer) for buffer in buffers])) == reference
+
+
+def test_pickled_molecule_renders_the_same() -> None:
+    data = topology_molecule()
+    data.coordinate_store()
+    loaded = pickle.loads(pickle.dumps(data))
+    data.completed = loaded.completed = lambda flag: True
+    assert loaded.rings == data.rings
+    assert pdb(loaded, united=True) == pdb(data, united=True)